@@ -1,5 +1,10 @@
-from .supervisor import supervisor_agent
+from .supervisor import supervisor_agent, directory_selector_agent
 from .member import agent_node
 from .analyst import analyst_agent
 
-__all__ = ["supervisor_agent", "agent_node", "analyst_agent"]
+__all__ = [
+    "supervisor_agent",
+    "directory_selector_agent",
+    "agent_node",
+    "analyst_agent",
+]
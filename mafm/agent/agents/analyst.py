@@ -1,16 +1,16 @@
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from .llm_model import api_key
-from langchain_openai import ChatOpenAI
+from .llm_model import get_llm
 from pydantic import BaseModel
 from typing import List, Literal
+import functools
 
 
-def analyst_agent(state, input_prompt: str, output_list: List[str]):
-    llm = ChatOpenAI(api_key=api_key, model="gpt-4o-mini")
+class listResponse(BaseModel):
+    messages: List[str]
 
-    class listResponse(BaseModel):
-        messages: List[str]
 
+@functools.lru_cache(maxsize=None)
+def get_analyst_chain():
     system_prompt = (
         "당신은 구성원들이 답변한 파일의 경로들을 받고 정리하는 감독자입니다."
     )
@@ -25,7 +25,19 @@ def analyst_agent(state, input_prompt: str, output_list: List[str]):
                 "파일 경로: {output_list}",
             ),
         ]
-    ).partial(input_prompt=input_prompt, output_list=", ".join(output_list))
+    )
+    return prompt | get_llm().with_structured_output(listResponse)
+
+
+def analyst_agent(state):
+    # 멤버들이 찾은 파일 경로 (여러 디렉토리에서 같은 파일이 나올 수 있으므로 중복 제거)
+    output_list = list(dict.fromkeys(state.get("file_paths", [])))
     print(output_list)
-    analyst_chain = prompt | llm.with_structured_output(listResponse)
-    return analyst_chain.invoke(state)
+
+    return get_analyst_chain().invoke(
+        {
+            "messages": state["messages"],
+            "input_prompt": state["prompt"],
+            "output_list": ", ".join(output_list),
+        }
+    )
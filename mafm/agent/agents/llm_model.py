@@ -1,6 +1,17 @@
 from dotenv import load_dotenv
+import functools
 import os
 from langchain_openai import ChatOpenAI
 
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm(temperature=None):
+    """설정별로 ChatOpenAI 클라이언트를 한 번만 만들어 재사용하는 함수
+
+    같은 클라이언트를 쓰면 질의마다 HTTP 연결을 새로 맺지 않고 연결 풀을 재사용한다.
+    """
+    options = {} if temperature is None else {"temperature": temperature}
+    return ChatOpenAI(api_key=api_key, model="gpt-4o-mini", **options)
@@ -1,65 +1,98 @@
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from pydantic import BaseModel, Field
-from typing import Literal, List
-from .llm_model import api_key
+from typing import Literal, List, Optional
+from .llm_model import get_llm
 
 # from .tools import get_file_list
-from langchain_openai import ChatOpenAI
 from langgraph.store.base import BaseStore
 from langchain.output_parsers import PydanticOutputParser
 from langchain_core.utils.function_calling import convert_to_openai_function
 from langchain_core.messages import HumanMessage
+import functools
 import os
+import time
 
-from rag.vectorDb import search
-
-global current_directory_name
+from rag.vectorDb import search, get_db_name
+from rag.filters import SearchFilter
 
 
 class queryResponse(BaseModel):
     query: str = Field(description="query sentence")
+    alternatives: List[str] = Field(
+        default_factory=list,
+        description="other phrasings of the query sentence (optional, at most 2)",
+    )
+    # 사용자가 파일 형식, 크기, 수정 시점을 말한 경우에만 채운다 (검색 전에 후보를 줄이는 데 사용)
+    extensions: List[str] = Field(
+        default_factory=list,
+        description="file extensions the user asked for, without dots (e.g. pdf, docx)",
+    )
+    modified_within_days: Optional[int] = Field(
+        default=None, description="only files modified within this many days"
+    )
+    max_size_mb: Optional[float] = Field(
+        default=None, description="only files smaller than this size in megabytes"
+    )
+
+
+def get_search_filter(query: queryResponse) -> Optional[SearchFilter]:
+    """질의 응답에 들어 있는 조건으로 검색 필터를 만드는 함수 (조건이 없으면 None)"""
+    search_filter = SearchFilter(
+        extensions=query.extensions,
+        max_size=(
+            int(query.max_size_mb * 1024 * 1024)
+            if query.max_size_mb is not None
+            else None
+        ),
+        modified_after=(
+            time.time() - query.modified_within_days * 86400
+            if query.modified_within_days is not None
+            else None
+        ),
+    )
+    return None if search_filter.is_empty() else search_filter
 
 
-def get_file_list(query: queryResponse) -> List[str]:
+def get_file_list(query: queryResponse, directory_name: str) -> List[str]:
     """
     get file list from user input
     """
-    global current_directory_name
-
-    print("current_directory_name: ", current_directory_name)
+    print("current_directory_name: ", directory_name)
     print("query: ", query)
+    # 다른 표현의 질의들도 한 번의 임베딩/검색 호출로 함께 검색한다
+    queries = list(dict.fromkeys([query.query] + query.alternatives[:2]))
     return search(
-        current_directory_name + "/" + os.path.basename(current_directory_name) + ".db",
-        [query.query],
+        get_db_name(directory_name), queries, search_filter=get_search_filter(query)
     )
 
 
-def agent_node(state, directory_name: str, output_list: List[str]):
-    global current_directory_name
-    current_directory_name = directory_name
-
-    llm = ChatOpenAI(
-        api_key=api_key,
-        model="gpt-4o-mini",
-        temperature=0,
-    )
+@functools.lru_cache(maxsize=None)
+def get_query_chain():
+    """질의 문장을 만드는 chain (모든 멤버가 공유하고 디렉토리는 입력으로 받는다)"""
     prompt = ChatPromptTemplate.from_messages(
         [
             MessagesPlaceholder(variable_name="messages"),
             (
                 "system",
                 "current directory name: {directory_name} "
-                "사용자에 요청에 따라서 디렉토리에서 파일을 검색하려고 합니다 쿼리를 문장으로 정리해주세요",
+                "사용자에 요청에 따라서 디렉토리에서 파일을 검색하려고 합니다 쿼리를 문장으로 정리해주세요. "
+                "다르게 표현할 수 있다면 다른 표현의 쿼리도 최대 2개까지 함께 주세요.",
             ),
         ]
-    ).partial(
-        directory_name=directory_name,
     )
-    query_chain = prompt | llm.with_structured_output(queryResponse)
-    chain = query_chain | get_file_list
-    res = chain.invoke(state)
+    return prompt | get_llm(temperature=0).with_structured_output(queryResponse)
+
+
+def agent_node(state, directory_name: str = None):
+    # 병렬 모드에서는 Send로 전달된 상태에 검색할 디렉토리가 들어 있다.
+    # 여러 멤버가 동시에 실행되므로 디렉토리는 전역 변수가 아니라 인자로만 전달한다.
+    directory_name = directory_name or state["directory"]
+
+    query = get_query_chain().invoke(
+        {"messages": state["messages"], "directory_name": directory_name}
+    )
+    res = get_file_list(query, directory_name)
     if res:
-        output_list.extend(res)
-        return {"messages": res}
+        return {"messages": res, "file_paths": res}
     else:
-        return {"messages": []}
+        return {"messages": [], "file_paths": []}
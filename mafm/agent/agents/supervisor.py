@@ -1,14 +1,17 @@
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from .llm_model import api_key
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel
+from .llm_model import get_llm
+from pydantic import BaseModel, Field
 from typing import List, Literal
+import functools
 
+# 병렬 모드에서 한 번에 선택할 수 있는 최대 디렉토리 수
+MAX_SELECTED_DIRECTORIES = 3
 
-def supervisor_agent(state, member_list: List[str]):
-    llm = ChatOpenAI(api_key=api_key, model="gpt-4o-mini")
 
-    next_options = member_list + ["analyst"]
+@functools.lru_cache(maxsize=16)
+def get_supervisor_chain(member_options: tuple):
+    """선택지(후보 디렉토리)별로 구조화 출력 chain을 만들어 재사용하는 함수"""
+    next_options = member_options + ("analyst",)
 
     class routeResponse(BaseModel):
         next: Literal[*(next_options)]
@@ -28,7 +31,56 @@ def supervisor_agent(state, member_list: List[str]):
                 "디렉토리를 선택해주세요. 절대로 같은 디렉토리를 두 번 선택하지 마세요.",
             ),
         ]
-    ).partial(members=", ".join(member_list))
+    ).partial(members=", ".join(member_options))
 
-    supervisor_chain = prompt | llm.with_structured_output(routeResponse)
-    return supervisor_chain.invoke(state)
+    return prompt | get_llm().with_structured_output(routeResponse)
+
+
+def supervisor_agent(state):
+    supervisor_chain = get_supervisor_chain(tuple(state["candidates"]))
+    return supervisor_chain.invoke({"messages": state["messages"]})
+
+
+class selectResponse(BaseModel):
+    directories: List[str] = Field(description="선택한 디렉토리 경로 목록")
+
+
+@functools.lru_cache(maxsize=None)
+def get_selector_chain():
+    # 후보 디렉토리는 질의마다 달라지므로 출력 형식에 넣지 않고 입력으로 받은 뒤 결과를 검증한다
+    system_prompt = (
+        "당신은 사용자의 요청에 따라 검색할 디렉토리들을 선택하는 감독자입니다."
+        "관련 있는 디렉토리를 최대 {max_directories}개까지 한 번에 선택해주세요."
+    )
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            MessagesPlaceholder(variable_name="messages"),
+            (
+                "system",
+                "선택할 수 있는 디렉토리는 다음과 같습니다: {members}. "
+                "디렉토리를 선택해주세요. 같은 디렉토리를 두 번 선택하지 마세요.",
+            ),
+        ]
+    )
+    return prompt | get_llm().with_structured_output(selectResponse)
+
+
+def directory_selector_agent(state, max_directories: int = MAX_SELECTED_DIRECTORIES):
+    """한 번의 호출로 검색할 디렉토리들을 모두 선택하는 감독자 (병렬 모드)"""
+    member_list = state["candidates"]
+    response = get_selector_chain().invoke(
+        {
+            "messages": state["messages"],
+            "members": ", ".join(member_list),
+            "max_directories": max_directories,
+        }
+    )
+    # 후보에 없는 경로는 버린다
+    directories = [
+        directory
+        for directory in dict.fromkeys(response.directories)
+        if directory in member_list
+    ]
+    return {"directories": directories[:max_directories]}
@@ -1,37 +1,49 @@
 import functools
 import operator
+import os
+import threading
 from typing import Sequence, TypedDict, Annotated, List
 
 from langchain_core.messages import BaseMessage, HumanMessage
 from langgraph.graph import END, StateGraph, START
-from .agents import agent_node, supervisor_agent, analyst_agent
-from rag.sqlite import get_directory_structure
+from langgraph.types import Send
+from .agents import (
+    agent_node,
+    supervisor_agent,
+    directory_selector_agent,
+    analyst_agent,
+)
+from .agents.supervisor import MAX_SELECTED_DIRECTORIES
+from rag.sqlite import get_directory_structure, get_directory_version
+from rag.routing import route_directories
+
+# 디렉토리 에이전트 실행 방식
+# "parallel": 감독자가 한 번에 여러 디렉토리를 고르고 멤버들을 동시에 실행한다 (기본값)
+# "sequential": 감독자가 디렉토리를 하나씩 고르고 멤버를 차례로 실행한다
+# "routed": LLM 감독자 없이 라우팅 인덱스의 상위 디렉토리로 바로 멤버들을 동시에 실행한다
+AGENT_MODE = os.getenv("MAFM_AGENT_MODE", "parallel")
 
 
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
     next: str
+    # 사용자 질의 (analyst가 최종 파일을 고를 때 사용)
+    prompt: str
+    # 감독자에게 보여줄 후보 디렉토리 (질의마다 달라지므로 그래프가 아니라 상태로 전달한다)
+    candidates: List[str]
+    # 병렬 모드에서 감독자가 고른 디렉토리 목록
+    directories: List[str]
+    # 멤버들이 찾은 파일 경로 (동시에 실행된 멤버의 결과가 합쳐진다)
+    file_paths: Annotated[List[str], operator.add]
 
 
-def graph(directory_path: str, prompt: str) -> List[str]:
-    human_input = HumanMessage(content=prompt)
-
-    members = get_directory_structure()
-    output_list = []
-    print(members)
-    print(human_input)
-    # graph 생성
+def build_sequential_workflow(members: List[str]) -> StateGraph:
+    # 디렉토리마다 노드가 하나씩 있으므로 디렉토리 구조가 바뀌면 다시 만들어야 한다
     workflow = StateGraph(AgentState)
-    supervisor_node = functools.partial(supervisor_agent, member_list=members)
-    workflow.add_node("supervisor", supervisor_node)
-    analyst_node = functools.partial(
-        analyst_agent, input_prompt=human_input.content, output_list=output_list
-    )
-    workflow.add_node("analyst", analyst_node)
+    workflow.add_node("supervisor", supervisor_agent)
+    workflow.add_node("analyst", analyst_agent)
     for member in members:
-        member_node = functools.partial(
-            agent_node, directory_name=member, output_list=output_list
-        )
+        member_node = functools.partial(agent_node, directory_name=member)
         workflow.add_node(member, member_node)
         workflow.add_edge(member, "supervisor")
     conditional_map = {k: k for k in members}
@@ -39,8 +51,104 @@ def graph(directory_path: str, prompt: str) -> List[str]:
     workflow.add_conditional_edges("supervisor", lambda x: x["next"], conditional_map)
     workflow.add_edge(START, "supervisor")
     workflow.add_edge("analyst", END)
+    return workflow
+
+
+def fan_out(state: AgentState):
+    """선택된 디렉토리마다 멤버를 하나씩 동시에 실행하도록 보내는 함수"""
+    if not state.get("directories"):
+        return "analyst"
+    return [
+        Send("member", {"messages": state["messages"], "directory": directory})
+        for directory in state["directories"]
+    ]
+
+
+def select_top_directories(state: AgentState):
+    """라우팅 점수 순으로 정렬된 후보 중 상위 디렉토리를 그대로 고르는 감독자 (LLM 호출 없음)"""
+    return {"directories": state["candidates"][:MAX_SELECTED_DIRECTORIES]}
+
+
+def build_parallel_workflow(use_llm: bool = True) -> StateGraph:
+    # supervisor → (member × 선택된 디렉토리 수, 동시 실행) → analyst
+    # 디렉토리와 질의는 모두 상태로 전달되므로 그래프 모양은 항상 같다
+    workflow = StateGraph(AgentState)
+    selector = directory_selector_agent if use_llm else select_top_directories
+    workflow.add_node("supervisor", selector)
+    workflow.add_node("member", agent_node)
+    workflow.add_node("analyst", analyst_agent)
+    workflow.add_edge(START, "supervisor")
+    workflow.add_conditional_edges("supervisor", fan_out, ["member", "analyst"])
+    workflow.add_edge("member", "analyst")
+    workflow.add_edge("analyst", END)
+    return workflow
+
+
+# 컴파일된 그래프 캐시: {(모드, 디렉토리 버전): app}
+# 병렬 그래프는 디렉토리 구조와 무관하므로 버전을 None으로 두고 한 번만 컴파일한다
+_app_cache = {}
+_directory_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_directories(version=None) -> List[str]:
+    """디렉토리 목록을 디렉토리 버전별로 캐시해서 반환하는 함수"""
+    if version is None:
+        version = get_directory_version()
+    with _cache_lock:
+        directories = _directory_cache.get(version)
+        if directories is None:
+            directories = get_directory_structure()
+            _directory_cache.clear()
+            _directory_cache[version] = directories
+        return directories
+
+
+def get_app(mode: str = AGENT_MODE, use_llm: bool = True):
+    """모드에 맞는 컴파일된 그래프를 반환하는 함수 (디렉토리 구조가 바뀔 때만 다시 컴파일)"""
+    if mode == "sequential":
+        version = get_directory_version()
+        key = (mode, version)
+    else:
+        key = ("parallel", use_llm)
+
+    with _cache_lock:
+        app = _app_cache.get(key)
+    if app is not None:
+        return app
+
+    if mode == "sequential":
+        workflow = build_sequential_workflow(get_directories(version))
+    else:
+        workflow = build_parallel_workflow(use_llm)
     app = workflow.compile()
 
+    with _cache_lock:
+        if mode == "sequential":
+            # 이전 버전의 순차 그래프는 더 이상 쓰이지 않는다
+            for old in [k for k in _app_cache if k[0] == "sequential"]:
+                del _app_cache[old]
+        _app_cache.setdefault(key, app)
+        return _app_cache[key]
+
+
+def graph(directory_path: str, prompt: str, mode: str = AGENT_MODE) -> List[str]:
+    human_input = HumanMessage(content=prompt)
+
+    # 감독자에게는 전체 디렉토리 대신 질의와 가까운 후보 디렉토리만 보여준다
+    # (라우팅 정보가 아직 없으면 전체 디렉토리를 사용)
+    candidates = route_directories(prompt)
+    members = candidates or get_directories()
+    print(members)
+    print(human_input)
+    if mode == "sequential":
+        app = get_app(mode)
+        # 그래프에 노드가 없는 디렉토리(라우팅 정보가 더 최신인 경우)는 후보에서 뺀다
+        nodes = app.get_graph().nodes
+        members = [member for member in members if member in nodes]
+    else:
+        app = get_app(mode, use_llm=mode != "routed" or not candidates)
+
     # from IPython.display import Image, display
     # png_data = app.get_graph().draw_mermaid_png()
     # with open("graph_image.png", "wb") as file:
@@ -48,7 +156,12 @@ def graph(directory_path: str, prompt: str) -> List[str]:
 
     previous_output = None
     for s in app.stream(
-        {"messages": [human_input]},
+        {
+            "messages": [human_input],
+            "prompt": prompt,
+            "candidates": members,
+            "file_paths": [],
+        },
         {"recursion_limit": 20},
     ):
         previous_output = s
@@ -0,0 +1,419 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 같은 경로의 이벤트를 합치기 위해 기다리는 시간(초)과 이벤트를 처리하는 워커 수
+EVENT_DEBOUNCE = float(os.getenv("MAFM_EVENT_DEBOUNCE", "1.0"))
+EVENT_WORKERS = int(os.getenv("MAFM_EVENT_WORKERS", "1"))
+
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+MOVED = "moved"
+
+
+class PendingEvent:
+    """큐에서 대기 중인 (합쳐진) 이벤트
+
+    path: 이벤트가 적용될 현재 경로
+    src_path: moved 이벤트의 원래 경로 (DB에 등록되어 있는 경로)
+    modified: moved 이벤트에서 이동 후 내용도 바뀌었는지 여부
+    """
+
+    __slots__ = ("kind", "path", "src_path", "is_directory", "modified", "seq", "updated_at")
+
+    def __init__(self, kind, path, is_directory, seq, updated_at, src_path=None):
+        self.kind = kind
+        self.path = path
+        self.src_path = src_path
+        self.is_directory = is_directory
+        self.modified = False
+        self.seq = seq
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        if self.kind == MOVED:
+            return f"PendingEvent({self.kind}, {self.src_path} -> {self.path})"
+        return f"PendingEvent({self.kind}, {self.path})"
+
+
+def _is_under(path, dir_path):
+    return path.startswith(dir_path.rstrip("/") + "/")
+
+
+def _event_paths(event):
+    """이벤트가 다루는 경로들 (이동 이벤트는 원래 경로도 포함)"""
+    return (event.path, event.src_path) if event.src_path else (event.path,)
+
+
+def _rebase(path, src_dir, dest_dir):
+    return dest_dir.rstrip("/") + path[len(src_dir.rstrip("/")) :]
+
+
+class CoalescingEventQueue:
+    """파일 이벤트를 경로 단위로 합쳐서 워커에게 넘겨주는 큐
+
+    파일 이벤트는 debounce 시간 동안 같은 경로의 이벤트끼리 합쳐진다.
+    - 생성 후 삭제는 서로 상쇄되고, 반복된 수정은 한 번으로 합쳐진다.
+    - 이름 변경이 이어지면 (a → b → c) 최종 목적지로의 이동 한 번이 된다.
+    - 생성/수정 후 이동은 최종 경로에 대한 생성/수정이 된다.
+
+    디렉토리 이벤트는 합치지 않고 순서를 보장하는 경계로 처리한다. 디렉토리가 이동하거나
+    삭제되면 그 아래에서 대기 중인 파일 이벤트의 경로를 옮기거나 정리한다.
+    이벤트는 처음 들어온 순서대로 꺼내며, 같은 경로의 이벤트나 디렉토리 이벤트가
+    동시에 여러 워커에서 처리되지 않도록 한다. 앞의 이벤트가 아직 debounce 중이거나
+    처리 중이면, 그 이벤트와 경로가 겹치지 않는 뒤의 파일 이벤트를 먼저 꺼낸다.
+    디렉토리 이벤트는 앞의 이벤트가 모두 끝난 뒤에 꺼내고, 뒤의 이벤트가 앞지르지 못한다.
+
+    대기 중인 이벤트를 매번 훑지 않도록 힙 세 개를 둔다.
+    - _heap: 대기 중인 모든 이벤트 (seq 순서). 가장 앞의 이벤트를 찾는 데 쓴다
+    - _deadlines: debounce가 끝나는 시각 순서. 다음에 깰 시각을 알려준다
+    - _ready: debounce가 끝난 이벤트 (seq 순서). 여기서 꺼낼 이벤트를 고른다
+    세 힙 모두 합쳐지거나 순서가 바뀐 항목은 지우지 않고, 볼 때 걸러낸다.
+    """
+
+    def __init__(self, debounce=EVENT_DEBOUNCE, clock=time.monotonic):
+        self.debounce = debounce
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        # 파일 이벤트: 현재 경로 -> PendingEvent
+        self._files = {}
+        # 디렉토리 이벤트: seq -> PendingEvent (seq 순서. 디렉토리 이벤트는 앞에서부터 꺼낸다)
+        self._directories = OrderedDict()
+        # 이동 이벤트의 원래 경로 -> 그 경로에서 옮겨 간 이벤트들 (합쳐진 이벤트는 볼 때 걸러낸다)
+        self._sources = {}
+        # (seq, 키) 힙
+        self._heap = []
+        # (debounce가 끝나는 시각, seq, 키) 힙
+        self._deadlines = []
+        # debounce가 끝난 (seq, 키) 힙
+        self._ready = []
+        # 처리 중인 이벤트: 키 -> PendingEvent
+        self._in_flight = {}
+        self._closed = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._files) + len(self._directories)
+
+    # 이벤트 추가
+
+    def put_created(self, path, is_directory=False):
+        with self._cond:
+            if is_directory:
+                self._add_directory_event(CREATED, path)
+                return
+
+            event = self._files.get(path)
+            if event is None:
+                self._add_file_event(CREATED, path)
+            elif event.kind == DELETED:
+                # 삭제 후 같은 경로에 다시 생성되면 내용이 바뀐 것으로 본다
+                event.kind = MODIFIED
+                self._touch(event)
+            elif event.kind == MOVED:
+                event.modified = True
+                self._touch(event)
+            else:
+                self._touch(event)
+
+    def put_modified(self, path):
+        with self._cond:
+            event = self._files.get(path)
+            if event is None:
+                self._add_file_event(MODIFIED, path)
+            elif event.kind == MOVED:
+                event.modified = True
+                self._touch(event)
+            elif event.kind != DELETED:
+                # 생성 후 수정은 생성, 반복된 수정은 수정 한 번
+                self._touch(event)
+
+    def put_deleted(self, path, is_directory=False):
+        with self._cond:
+            if is_directory:
+                self._drop_pending_under(path)
+                self._add_directory_event(DELETED, path)
+                return
+
+            event = self._files.pop(path, None)
+            if event is None or event.kind == MODIFIED:
+                self._add_file_event(DELETED, path, seq=event.seq if event else None)
+            elif event.kind == MOVED:
+                # 이동 후 삭제는 원래 경로의 삭제
+                self._delete_original(event.src_path, event.seq)
+            # 생성 후 삭제는 상쇄
+            if event is not None:
+                # 없어진 이벤트에 막혀 있던 이벤트가 있을 수 있다
+                self._cond.notify_all()
+
+    def put_moved(self, src_path, dest_path, is_directory=False):
+        with self._cond:
+            if is_directory:
+                event = self._add_directory_event(MOVED, dest_path, src_path=src_path)
+                self._rebase_pending_under(src_path, dest_path, event.seq)
+                return
+
+            event = self._files.pop(src_path, None)
+            if event is None:
+                event = self._new_event(MOVED, dest_path, False, src_path=src_path)
+            elif event.kind == MOVED:
+                # a → b → c 는 a → c
+                event.path = dest_path
+                if event.src_path == dest_path:
+                    # 원래 자리로 돌아왔으면 내용이 바뀐 경우에만 수정으로 처리
+                    if not event.modified:
+                        # 없어진 이벤트에 막혀 있던 이벤트가 있을 수 있다
+                        self._cond.notify_all()
+                        return
+                    event.kind = MODIFIED
+                    event.src_path = None
+            elif event.kind == DELETED:
+                # 삭제된 경로에서 이동 이벤트가 올 수 없으므로 새 이동으로 처리
+                self._files[src_path] = event
+                event = self._new_event(MOVED, dest_path, False, src_path=src_path)
+            elif event.kind == MODIFIED:
+                event.kind = MOVED
+                event.src_path = src_path
+                event.path = dest_path
+                event.modified = True
+            else:
+                # 생성 후 이동은 최종 경로에서의 생성
+                event.path = dest_path
+
+            # 목적지에 대기 중이던 이벤트는 덮어쓴다 (기존 파일은 처리할 때 교체된다)
+            if self._files.pop(dest_path, None) is not None:
+                self._cond.notify_all()
+            self._files[dest_path] = event
+            if event.src_path is not None:
+                self._sources.setdefault(event.src_path, set()).add(event)
+            # 키(경로)가 바뀌었으므로 힙에 새 키로 넣는다
+            heapq.heappush(self._heap, (event.seq, ("file", dest_path)))
+            self._touch(event)
+
+    # 이벤트 꺼내기
+
+    def get(self, timeout=None):
+        """처리할 준비가 된 이벤트를 꺼내는 함수
+
+        큐가 닫히고 비었거나 timeout 동안 꺼낼 이벤트가 없으면 None을 반환한다.
+        꺼낸 이벤트는 처리가 끝나면 done()으로 알려야 한다.
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._cond:
+            while True:
+                event, wait = self._next_ready()
+                if event is not None:
+                    self._remove(event)
+                    self._in_flight[self._key(event)] = event
+                    return event
+                if self._closed and not self._files and not self._directories:
+                    return None
+                if deadline is not None:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def done(self, event):
+        with self._cond:
+            # 처리가 끝난 이벤트(또는 디렉토리 경계)에 막혀 있던 이벤트를 꺼낼 수 있게 깨운다
+            self._in_flight.pop(self._key(event), None)
+            self._cond.notify_all()
+
+    def close(self):
+        """더 이상 이벤트를 받지 않고, 남은 이벤트는 기다리지 않고 바로 꺼낼 수 있게 한다"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # 내부 함수
+
+    def _key(self, event):
+        return ("directory", event.seq) if event.is_directory else ("file", event.path)
+
+    def _new_event(self, kind, path, is_directory, src_path=None, seq=None):
+        if seq is None:
+            seq = next(self._seq)
+        return PendingEvent(kind, path, is_directory, seq, self._clock(), src_path)
+
+    def _add_file_event(self, kind, path, seq=None):
+        event = self._new_event(kind, path, False, seq=seq)
+        self._files[path] = event
+        heapq.heappush(self._heap, (event.seq, ("file", path)))
+        self._push_deadline(event)
+        return event
+
+    def _add_directory_event(self, kind, path, src_path=None):
+        event = self._new_event(kind, path, True, src_path=src_path)
+        self._directories[event.seq] = event
+        heapq.heappush(self._heap, (event.seq, ("directory", event.seq)))
+        self._push_deadline(event)
+        return event
+
+    def _touch(self, event):
+        # 순서(seq)와 힙 항목은 그대로 두고 debounce만 다시 시작한다
+        event.updated_at = self._clock()
+        self._push_deadline(event)
+
+    def _push_deadline(self, event):
+        deadline = event.updated_at + self.debounce
+        earliest = self._deadlines[0][0] if self._deadlines else None
+        heapq.heappush(self._deadlines, (deadline, event.seq, self._key(event)))
+        self._compact()
+        # 기다리는 워커는 가장 이른 시각까지 자므로, 그 시각이 앞당겨질 때만 깨운다
+        if earliest is None or deadline < earliest:
+            self._cond.notify_all()
+
+    def _delete_original(self, src_path, seq):
+        original = self._files.get(src_path)
+        if original is not None and original.kind == CREATED:
+            # 이동 후 원래 경로에 새 파일이 생겼다면 원래 경로는 내용이 바뀐 것
+            original.kind = MODIFIED
+            self._touch(original)
+        elif original is None:
+            self._add_file_event(DELETED, src_path, seq=seq)
+
+    def _drop_pending_under(self, dir_path):
+        # 삭제된 디렉토리 아래의 대기 이벤트는 디렉토리 삭제로 함께 정리된다.
+        # 단, 밖에서 안으로 이동해 온 파일은 원래 경로의 데이터를 지워야 한다
+        for path in [p for p in self._files if _is_under(p, dir_path)]:
+            event = self._files.pop(path)
+            if event.kind == MOVED and not _is_under(event.src_path, dir_path):
+                self._delete_original(event.src_path, event.seq)
+
+    def _rebase_pending_under(self, src_dir, dest_dir, after_seq):
+        # 이동한 디렉토리 아래의 대기 이벤트는 새 경로로 옮기고 디렉토리 이동 뒤에 처리한다
+        for path in [p for p in self._files if _is_under(p, src_dir)]:
+            event = self._files.pop(path)
+            event.path = _rebase(path, src_dir, dest_dir)
+            if event.src_path is not None and _is_under(event.src_path, src_dir):
+                event.src_path = _rebase(event.src_path, src_dir, dest_dir)
+            event.seq = next(self._seq)
+            self._files[event.path] = event
+            if event.src_path is not None:
+                self._sources.setdefault(event.src_path, set()).add(event)
+            heapq.heappush(self._heap, (event.seq, ("file", event.path)))
+            self._push_deadline(event)
+
+    def _lookup(self, key):
+        if key[0] == "directory":
+            return self._directories.get(key[1])
+        return self._files.get(key[1])
+
+    def _live(self, seq, key):
+        event = self._lookup(key)
+        return event if event is not None and event.seq == seq else None
+
+    def _remove(self, event):
+        if event.is_directory:
+            del self._directories[event.seq]
+        else:
+            del self._files[event.path]
+            if event.src_path is not None:
+                self._sources.get(event.src_path, set()).discard(event)
+        self._compact()
+
+    def _compact(self):
+        # 힙 항목은 볼 때 걸러내되, 걸러낼 항목이 너무 많이 쌓이면 다시 만든다
+        live = len(self._files) + len(self._directories)
+        if len(self._heap) + len(self._deadlines) + len(self._ready) > 4 * live + 64:
+            events = list(itertools.chain(self._files.values(), self._directories.values()))
+            self._heap = [(e.seq, self._key(e)) for e in events]
+            self._deadlines = [(e.updated_at + self.debounce, e.seq, self._key(e)) for e in events]
+            self._ready = []
+            heapq.heapify(self._heap)
+            heapq.heapify(self._deadlines)
+            self._sources = {}
+            for e in self._files.values():
+                if e.src_path is not None:
+                    self._sources.setdefault(e.src_path, set()).add(e)
+
+    def _promote(self, now):
+        """debounce가 끝난 이벤트를 _deadlines에서 _ready로 옮기고, 다음 대기 시간을 반환하는 함수"""
+        while self._deadlines:
+            deadline, seq, key = self._deadlines[0]
+            event = self._live(seq, key)
+            if event is not None and event.updated_at + self.debounce == deadline:
+                if deadline > now and not self._closed:
+                    return deadline - now
+                heapq.heappush(self._ready, (seq, key))
+            heapq.heappop(self._deadlines)
+        return None
+
+    def _first_seq(self):
+        """대기 중인 이벤트 중 가장 앞의 seq (없으면 None)"""
+        while self._heap:
+            seq, key = self._heap[0]
+            if self._live(seq, key) is not None:
+                return seq
+            heapq.heappop(self._heap)  # 합쳐졌거나 순서가 바뀐 항목
+        return None
+
+    def _blocked(self, event):
+        """처리 중인 이벤트나 앞의 대기 이벤트와 경로가 겹치는지 확인하는 함수"""
+        paths = _event_paths(event)
+        for in_flight in self._in_flight.values():
+            if not set(paths).isdisjoint(_event_paths(in_flight)):
+                return True
+        for path in paths:
+            other = self._files.get(path)
+            if other is not None and other is not event and other.seq < event.seq:
+                return True
+            for other in self._sources.get(path, ()):
+                if (
+                    other is not event
+                    and other.seq < event.seq
+                    and other.src_path == path
+                    and self._files.get(other.path) is other
+                ):
+                    return True
+        return False
+
+    def _next_ready(self):
+        """처리할 수 있는 가장 앞의 이벤트를 찾는 함수
+
+        반환: (이벤트, None), 꺼낼 이벤트가 없으면 (None, 다음 이벤트까지의 대기 시간 또는 None)
+        """
+        now = self._clock()
+        wait = self._promote(now)
+
+        # 디렉토리 이벤트가 처리 중이면 끝날 때까지 아무것도 꺼내지 않는다
+        if any(key[0] == "directory" for key in self._in_flight):
+            return None, None
+
+        # 대기 중인 디렉토리 이벤트 뒤의 이벤트는 그 디렉토리 이벤트를 앞지르지 않는다
+        barrier = next(iter(self._directories), None)
+        found = None
+        skipped = []
+        while self._ready:
+            seq, key = self._ready[0]
+            event = self._live(seq, key)
+            if event is None or (
+                not self._closed and event.updated_at + self.debounce > now
+            ):
+                # 합쳐졌거나, 다시 debounce 중인 항목 (_deadlines에 새 항목이 있다)
+                heapq.heappop(self._ready)
+                continue
+            if barrier is not None and seq > barrier:
+                break
+            if event.is_directory:
+                # 앞의 이벤트가 모두 끝난 뒤에만 꺼낸다
+                if not self._in_flight and self._first_seq() == seq:
+                    found = event
+                break
+            if self._blocked(event):
+                skipped.append(heapq.heappop(self._ready))
+                continue
+            found = event
+            break
+        for item in skipped:
+            heapq.heappush(self._ready, item)
+        if found is not None:
+            return found, None
+        return None, wait
@@ -1,3 +1,4 @@
+import threading
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
@@ -5,53 +6,76 @@ import os
 from rag.vectorDb import save
 from rag.sqlite import (
     insert_file_info,
-    insert_directory_structure,
-    update_file_info,
-    get_id_by_path,
     change_directory_path,
     change_file_path,
     delete_directory_and_subdirectories,
     initialize_database,
+    database_exists,
+    get_directory_structure,
+    get_manifest,
+    get_manifest_entry,
+    upsert_manifest,
+    upsert_file_metadata,
+    get_file_metadata,
+    delete_file_info,
+    find_id_by_path,
 )
-from rag.embedding import embedding, initialize_model
-from rag.fileops import get_file_data
+from rag.embedding import initialize_model, EMBED_BATCH_SIZE
+from rag.manifest import file_fingerprint
+from rag.filters import describe_file
+from rag.extractor import iter_text_chunks
+from rag.chunker import batched, get_index_id
+from rag.indexer import IndexingPipeline, EXTRACT_WORKERS
 from rag.vectorDb import (
     initialize_vector_db,
     insert_file_embedding,
     find_by_id,
     remove_by_id,
     delete_vector_db,
+    move_vector_db,
+    reset_vector_store,
+    get_db_name,
+    vector_store,
+    close_all_clients,
 )
-from collections import defaultdict
-import pdfplumber
-from docx import Document
-
-
-def read_pdf(file_path):
-    """PDF 파일을 읽어서 텍스트로 변환하는 함수"""
-    text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-    return text
-
-def read_word(file_path):
-    """Word 파일을 읽어서 텍스트로 변환하는 함수"""
-    text = ""
-    doc = Document(file_path)
-    for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
-
-def split_text_into_chunks(text, chunk_size=500):
-    """텍스트를 주어진 크기의 청크 배열로 분할하는 함수"""
-    return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+from event_queue import (
+    CoalescingEventQueue,
+    EVENT_DEBOUNCE,
+    EVENT_WORKERS,
+    CREATED,
+    MODIFIED,
+    DELETED,
+    MOVED,
+)
+
 
 class FileEventHandler(FileSystemEventHandler):
-    """파일 시스템 이벤트 핸들러 클래스"""
+    """파일 시스템 이벤트 핸들러 클래스
 
-    def __init__(self):
+    watchdog 스레드에서는 이벤트를 큐에 넣기만 하고, 텍스트 추출, 임베딩, DB 쓰기는
+    백그라운드 워커가 경로별로 합쳐진 이벤트를 꺼내서 처리한다.
+    """
+
+    def __init__(self, workers=EVENT_WORKERS, debounce=EVENT_DEBOUNCE):
         super().__init__()
+        self.queue = CoalescingEventQueue(debounce)
+        self.workers = [
+            threading.Thread(
+                target=self.process_events, name=f"mafm-event-{i}", daemon=True
+            )
+            for i in range(max(1, workers))
+        ]
+
+    def start(self):
+        """이벤트 처리 워커 시작 함수"""
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """남은 이벤트를 모두 처리한 뒤 워커를 종료하는 함수"""
+        self.queue.close()
+        for worker in self.workers:
+            worker.join()
 
     def is_dot_file(self, path):
         """숨김 파일인지 확인하는 함수"""
@@ -68,43 +92,18 @@ class FileEventHandler(FileSystemEventHandler):
             print("ignore deleted: " + event.src_path)
             return  # 숨김 파일과 무시할 패턴을 가진 파일은 무시
 
-        print("--deleted--")
-        print("deleting: " + event.src_path)
-
-        if event.is_directory:
-            dir_path = event.src_path
-            dir_name = os.path.basename(dir_path)
+        self.queue.put_deleted(event.src_path, event.is_directory)
 
-            db_name = dir_path + "/" + dir_name + ".db"
-            delete_vector_db(db_name)  # 디렉토리와 연결된 벡터 DB 삭제
-            delete_directory_and_subdirectories(dir_path)  # 디렉토리 정보 DB에서 삭제
-            print(f"Deleted directory and associated VectorDB: {db_name}")
-            return
-
-        file_path = event.src_path
-        dir_path = os.path.dirname(file_path)
+    def on_modified(self, event):
+        """파일 수정 이벤트 처리 함수"""
+        if (
+            event.is_directory
+            or self.is_dot_file(event.src_path)
+            or self.is_ignored_file(event.src_path)
+        ):
+            return  # 디렉토리와 숨김 파일은 무시
 
-        db_name = dir_path + "/" + os.path.basename(dir_path) + ".db"
-        id = get_id_by_path(file_path, "filesystem.db")
-        remove_by_id(id, db_name)  # 벡터 DB에서 파일 데이터 삭제
-        print(f"Deleted file: {event.src_path}")
-
-    # def on_modified(self, event):
-    #     """파일 수정 이벤트 처리 함수"""
-    #     if event.is_directory or self.is_dot_file(event.src_path) or self.is_ignored_file(event.src_path):
-    #         print("directory or dotfile modified")
-    #         return  # 디렉토리와 숨김 파일은 무시
-    #
-    #     file_src_path = event.src_path
-    #     dir_path = os.path.dirname(file_src_path)
-    #     db_name = dir_path + "/" + os.path.basename(dir_path) + ".db"
-    #
-    #
-    #     id = get_id_by_path(file_src_path, "filesystem.db")
-    #     remove_by_id(id, db_name)  # 기존 벡터 데이터 제거
-    #     save(db_name, id, get_file_data(file_src_path)[2:])  # 새로운 벡터 데이터 저장
-    #     insert_file_info(file_src_path, 0, "filesystem.db")  # 파일 정보 DB 업데이트
-    #     print(f"Modified file: {event.src_path}")
+        self.queue.put_modified(event.src_path)
 
     def on_moved(self, event):
         """파일 또는 디렉토리 이동 이벤트 처리 함수"""
@@ -116,80 +115,212 @@ class FileEventHandler(FileSystemEventHandler):
         ):
             return  # 숨김 파일은 무시
 
+        self.queue.put_moved(event.src_path, event.dest_path, event.is_directory)
+
+    def on_created(self, event):
+        """파일 생성 이벤트 처리 함수"""
+        if self.is_dot_file(event.src_path) or self.is_ignored_file(event.src_path):
+            return  # 숨김 파일과 무시할 패턴을 가진 파일은 무시
+
+        self.queue.put_created(event.src_path, event.is_directory)
+
+    def process_events(self):
+        """큐에서 합쳐진 이벤트를 꺼내 처리하는 워커 함수"""
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                if event.kind == CREATED:
+                    self.handle_created(event.path, event.is_directory)
+                elif event.kind == MODIFIED:
+                    self.handle_modified(event.path)
+                elif event.kind == DELETED:
+                    self.handle_deleted(event.path, event.is_directory)
+                elif event.kind == MOVED:
+                    self.handle_moved(event.src_path, event.path, event.is_directory)
+                    if event.modified:
+                        self.handle_modified(event.path)
+            except Exception as e:
+                print(f"Error processing {event}: {e}")
+            finally:
+                self.queue.done(event)
+
+    def handle_deleted(self, path, is_directory):
+        print("--deleted--")
+        print("deleting: " + path)
+
+        if is_directory:
+            dir_path = path
+
+            db_name = get_db_name(dir_path)
+            delete_vector_db(db_name)  # 디렉토리와 연결된 벡터 DB 삭제
+            delete_directory_and_subdirectories(dir_path)  # 디렉토리 정보 DB에서 삭제
+            print(f"Deleted directory and associated VectorDB: {db_name}")
+            return
+
+        file_path = path
+        id = find_id_by_path(file_path, "filesystem.db")
+        if id is None:
+            return  # 색인되지 않은 파일
+        db_name = get_db_name(os.path.dirname(file_path))
+        remove_by_id(id, db_name)  # 벡터 DB에서 파일 데이터 삭제
+        delete_file_info(id, "filesystem.db")  # 파일 정보와 manifest 삭제
+        print(f"Deleted file: {path}")
+
+    def handle_modified(self, path):
+        """내용이 실제로 바뀐 파일만 다시 임베딩하는 함수"""
+        if not os.path.isfile(path):
+            return
+
+        id = find_id_by_path(path, "filesystem.db")
+        if id is None:
+            self.handle_created(path, False)
+            return
+
+        size, mtime, content_hash = file_fingerprint(path)
+        entry = get_manifest_entry(id, "filesystem.db")
+        if entry is not None and entry[2] == content_hash and entry[4] == get_index_id():
+            # 내용이 같으면 (저장만 다시 한 경우 등) manifest만 갱신
+            upsert_manifest(
+                id, size, mtime, content_hash, entry[3], get_index_id(), "filesystem.db"
+            )
+            return
+
+        print("--modified--")
+        db_name = get_db_name(os.path.dirname(path))
+        remove_by_id(id, db_name)  # 기존 벡터 데이터 제거
+        self.index_file(path, id, (size, mtime, content_hash))
+        print(f"Modified file: {path}")
+
+    def handle_moved(self, src_path, dest_path, is_directory):
         print("--moved--")
 
-        if event.is_directory:
+        if is_directory:
+            move_vector_db(src_path, dest_path)  # 벡터 DB 위치 정리
             change_directory_path(
-                event.src_path, event.dest_path, "filesystem.db"
+                src_path, dest_path, "filesystem.db"
             )  # 디렉토리 경로 변경
-            print(f"Moved directory: from {event.src_path} to {event.dest_path}")
+            print(f"Moved directory: from {src_path} to {dest_path}")
         else:
-            print(f"Moved file: from {event.src_path} to {event.dest_path}")
-            self.move_file(event.src_path, event.dest_path)
+            print(f"Moved file: from {src_path} to {dest_path}")
+            self.move_file(src_path, dest_path)
 
-    def on_created(self, event):
+    def handle_created(self, path, is_directory):
         print("--created--", flush=True)
-        """파일 생성 이벤트 처리 함수"""
-        if self.is_dot_file(event.src_path) or self.is_ignored_file(event.src_path):
-            return  # 숨김 파일과 무시할 패턴을 가진 파일은 무시
 
-        absolute_file_path = event.src_path
-        dirpath = os.path.dirname(absolute_file_path)
-        dirname = os.path.basename(dirpath)
+        absolute_file_path = path
 
-        if event.is_directory:
+        if is_directory:
             print("created directory")
             try:
-                initialize_vector_db(dirpath + "/" + dirname + ".db")  # 벡터 DB 초기화
-                id = insert_file_info(absolute_file_path, 1, "filesystem.db")
-                insert_directory_structure(
-                    id, dirpath, os.path.dirname(dirpath), "filesystem.db"
-                )
+                initialize_vector_db(get_db_name(absolute_file_path))  # 벡터 DB 초기화
+                insert_file_info(absolute_file_path, 1, "filesystem.db")
             except Exception as e:
                 print(f"Error initializing vector DB for directory: {e}")
         else:
+            if not os.path.isfile(absolute_file_path):
+                return  # 처리하기 전에 사라진 파일
+
+            if find_id_by_path(absolute_file_path, "filesystem.db") is not None:
+                # 이미 색인된 경로에 다시 생성된 파일은 수정으로 처리
+                self.handle_modified(absolute_file_path)
+                return
+
             print("created file")
-            insert_file_info(
+            id = insert_file_info(
                 absolute_file_path, 0, "filesystem.db"
             )  # 파일 정보 DB에 추가
-
-            # 파일 형식에 따라 데이터를 읽고 500바이트 크기의 배열로 분할
-            if absolute_file_path.endswith(".pdf"):
-                text_content = read_pdf(absolute_file_path)
-                text_chunks = split_text_into_chunks(text_content)
-            elif absolute_file_path.endswith(".docx"):
-                text_content = read_word(absolute_file_path)
-                text_chunks = split_text_into_chunks(text_content)
-            else:
-                # 일반 텍스트 파일일 경우
-                file_chunks = get_file_data(absolute_file_path)
-                text_chunks = file_chunks[2:]  # 필요한 데이터 조정
-
-
-            # 벡터 DB에 저장
-            save(
-                dirpath + "/" + dirname + ".db",
-                get_id_by_path(absolute_file_path, "filesystem.db"),
-                text_chunks,
-            )
-            print(f"Created file: {event.src_path}")
+            self.index_file(absolute_file_path, id)
+            print(f"Created file: {path}")
+
+    def index_file(self, path, id, fingerprint=None):
+        """파일 내용을 청크로 나눠 벡터 DB에 저장하고 manifest를 기록하는 함수"""
+        size, mtime, content_hash = fingerprint or file_fingerprint(path)
+
+        # 파일을 페이지(블록) 단위로 읽으면서 토큰 수 기준의 청크로 분할하고,
+        # 청크가 모이는 대로 벡터 DB에 저장 (검색 필터용 메타데이터를 각 행에 함께 저장)
+        metadata = describe_file(path, size, mtime)
+        db_name = get_db_name(os.path.dirname(path))
+        chunk_count = 0
+        for text_chunks in batched(iter_text_chunks(path), EMBED_BATCH_SIZE):
+            save(db_name, id, text_chunks, metadata, append=chunk_count > 0)
+            chunk_count += len(text_chunks)
+        if chunk_count == 0:
+            save(db_name, id, [], metadata)
+        upsert_file_metadata([(id, metadata)], "filesystem.db")
+
+        # 다음 시작 시 다시 임베딩하지 않도록 manifest 기록
+        upsert_manifest(
+            id,
+            size,
+            mtime,
+            content_hash,
+            chunk_count,
+            get_index_id(),
+            "filesystem.db",
+        )
 
     def move_file(self, file_src_path, file_dest_path):
         """파일 이동 시 벡터 DB 업데이트 함수"""
-        dir_path = os.path.dirname(file_src_path)
-        db_name = dir_path + "/" + os.path.basename(dir_path) + ".db"
-        id = get_id_by_path(file_src_path, "filesystem.db")
-        file_data = find_by_id(id, db_name)
-        insert_file_embedding(file_data, db_name)  # 파일 임베딩 데이터 추가
-        remove_by_id(id, db_name)  # 기존 ID 데이터 제거
-        change_file_path(file_src_path, file_dest_path, db_name)  # 파일 경로 업데이트
+        id = find_id_by_path(file_src_path, "filesystem.db")
+        if id is None:
+            # 디렉토리 이동으로 이미 경로가 바뀐 경우가 아니면 새 파일로 색인
+            if find_id_by_path(file_dest_path, "filesystem.db") is None:
+                self.handle_created(file_dest_path, False)
+            return
+
+        # 목적지에 색인된 파일이 있었다면 덮어쓴 것이므로 먼저 정리
+        if find_id_by_path(file_dest_path, "filesystem.db") is not None:
+            self.handle_deleted(file_dest_path, False)
+
+        # 이름이 바뀌면서 확장자/MIME 타입이 달라졌으면 벡터 행의 메타데이터도 바꿔야 한다
+        metadata = get_file_metadata(id, "filesystem.db")
+        if metadata is not None:
+            new_metadata = describe_file(file_dest_path, metadata["size"], metadata["mtime"])
+            metadata = new_metadata if new_metadata != metadata else None
+
+        src_db_name = get_db_name(os.path.dirname(file_src_path))
+        dest_db_name = get_db_name(os.path.dirname(file_dest_path))
+        if src_db_name != dest_db_name or metadata is not None:
+            # 같은 id를 쓰므로 기존 데이터를 먼저 지운 뒤 새 디렉토리에 추가
+            file_data = find_by_id(id, src_db_name)
+            remove_by_id(id, src_db_name)  # 기존 ID 데이터 제거
+            if file_data:
+                if metadata is not None:
+                    for row in file_data:
+                        row.update(metadata)
+                insert_file_embedding(file_data, dest_db_name)  # 파일 임베딩 데이터 추가
+        if metadata is not None:
+            upsert_file_metadata([(id, metadata)], "filesystem.db")
+        change_file_path(file_src_path, file_dest_path, "filesystem.db")  # 파일 경로 업데이트
 
 
 # SQLite DB에 파일 및 디렉토리 데이터 삽입
-def start_command_c(root):
+def start_command_c(root, extract_workers=EXTRACT_WORKERS, full=False):
     # 시작 시간 기록
     start_time = time.time()
 
+    # DB에는 끝의 "/"를 뺀 경로로 저장되므로 같은 형태로 비교
+    root = os.path.normpath(root)
+
+    # 이전 색인이 남아 있으면 manifest와 비교해서 바뀐 파일만 처리
+    if (
+        not full
+        and database_exists("filesystem.db")
+        and root in get_directory_structure("filesystem.db")
+    ):
+        initialize_database("filesystem.db", reset=False)
+        print("기존 색인을 기준으로 변경된 파일만 색인합니다.")
+        pipeline = IndexingPipeline(extract_workers=extract_workers)
+        pipeline.run(
+            root,
+            manifest=get_manifest("filesystem.db"),
+            directories=get_directory_structure("filesystem.db"),
+        )
+        print(f"작업에 걸린 시간: {time.time() - start_time:.4f} 초")
+        return
+
     # SQLite DB 연결 및 초기화
     try:
         initialize_database("filesystem.db")
@@ -197,64 +328,20 @@ def start_command_c(root):
         print(f"Error initializing database: {e}")
         return
 
-    # root 디렉토리의 벡터 DB 초기화
+    # 중앙 인덱스(consolidated 모드)를 비우고 root 디렉토리의 벡터 DB 초기화
     try:
-        initialize_vector_db(root + "/" + os.path.basename(root) + ".db")
+        reset_vector_store()
+        initialize_vector_db(get_db_name(root))
     except Exception as e:
         print(f"Error initializing vector DB for root: {e}")
         return
 
-    id = insert_file_info(root, 1, "filesystem.db")
-
-    # 루트의 부모 디렉토리 찾기
-    last_slash_index = root.rfind("/")
-    if last_slash_index != -1:
-        root_parent = root[:last_slash_index]
-
-    insert_directory_structure(id, root, root_parent, "filesystem.db")
+    # 루트는 부모가 없는 최상위 항목으로 등록된다
+    insert_file_info(root, 1, "filesystem.db")
 
-    # 디렉터리 재귀 탐색
-    for dirpath, dirnames, filenames in os.walk(root):
-        # 디렉토리 정보 삽입
-        for dirname in dirnames:
-            full_path = os.path.join(dirpath, dirname)
-            print(f"디렉토리 경로: {full_path}")
-            try:
-                initialize_vector_db(full_path + "/" + dirname + ".db")
-            except Exception as e:
-                print(f"Error initializing vector DB for directory: {e}")
-                continue
-
-            id = insert_file_info(full_path, 1, "filesystem.db")
-            insert_directory_structure(id, full_path, dirpath, "filesystem.db")
-
-        # 파일 정보 삽입 및 벡터 DB에 저장
-        for filename in filenames:
-            # 비밀 파일과 .db 파일 제외
-            if filename.startswith(".") or filename.endswith(".db"):
-                continue
-
-            full_path = os.path.join(dirpath, filename)
-            print(f"Embedding 하는 파일의 절대 경로: {full_path}")
-
-            # 파일 정보 삽입
-            id = insert_file_info(full_path, 0, "filesystem.db")
-
-            # PDF 및 Word 파일 처리
-            if filename.endswith(".pdf"):
-                text_content = read_pdf(full_path)
-                text_chunks = split_text_into_chunks(text_content)
-            elif filename.endswith(".docx"):
-                text_content = read_word(full_path)
-                text_chunks = split_text_into_chunks(text_content)
-            else:
-                # 일반 텍스트 파일 처리
-                file_chunks = get_file_data(full_path)
-                text_chunks = file_chunks[2:]  # 필요한 데이터 조정
-
-            # 각 디렉토리의 벡터 DB에 해당 파일 내용을 저장
-            dirname = dirpath.split("/")[-1]
-            save(dirpath + "/" + dirname + ".db", id, text_chunks)
+    # 디렉터리 탐색, 텍스트 추출, 임베딩, DB 저장을 단계별로 병렬 처리
+    pipeline = IndexingPipeline(extract_workers=extract_workers)
+    pipeline.run(root)
 
     # 종료 시간 기록
     end_time = time.time()
@@ -264,13 +351,13 @@ def start_command_c(root):
     print(f"작업에 걸린 시간: {elapsed_time:.4f} 초")
 
 
-def start_watchdog(root_dir):
+def start_watchdog(root_dir, extract_workers=EXTRACT_WORKERS, full=False):
     """파일 시스템 감시 시작 함수"""
     initialize_model()  # 임베딩 모델 초기화
     try:
         # 해당 root 아래에 존재하는 모든 파일들을 탐색해서 sqlite db에 저장해야함.
         # start_command_python(root_dir)
-        start_command_c(root_dir)
+        start_command_c(root_dir, extract_workers, full)
         # get_file_data(root)
     except IndexError:
         print("start: missing argument")
@@ -283,13 +370,17 @@ def start_watchdog(root_dir):
     observer.schedule(event_handler, path=root_dir, recursive=True)
 
     # 파일 시스템 모니터링 시작
+    event_handler.start()
     observer.start()
     try:
         while True:
             time.sleep(1)  # 감시 유지
+            vector_store.close_idle()  # 오래 사용하지 않은 벡터 DB 클라이언트 정리
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    event_handler.stop()  # 대기 중인 이벤트 처리 후 종료
+    close_all_clients()
 
 
 import argparse
@@ -298,10 +389,22 @@ if __name__ == "__main__":
     # 명령줄 인자 파싱
     parser = argparse.ArgumentParser(description="MAFM watchdog")
     parser.add_argument("-r", "--root", help="Root directory path")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=EXTRACT_WORKERS,
+        help="Number of text extraction processes for the initial index",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Discard the existing index and re-embed every file",
+    )
     args = parser.parse_args()
 
     # 루트 디렉토리 경로가 제공되지 않으면 경고 메시지 출력
     if not args.root:
         print("Root directory path is required.")
     else:
-        start_watchdog(args.root)  # 감시 시작
+        start_watchdog(args.root, args.workers, args.full)  # 감시 시작
@@ -3,8 +3,10 @@
 #include <stdlib.h>
 #include <string.h>
 #include <unistd.h>
+#include <fcntl.h>
 #include <sys/stat.h>
 #include <dirent.h>
+#include <pthread.h>
 
 // make_soft_links: 여러 파일 경로에 대해 임시 디렉토리에 소프트 링크를 만든다.
 // 입력: paths (파일 경로 배열), num_paths (경로 개수), temp_dir (임시 디렉토리 경로)
@@ -131,8 +133,8 @@ char** get_file_data(const char* path) {
             data = temp; // 재할당된 메모리 주소로 업데이트
         }
 
-        // 새로운 조각을 위한 메모리 할당
-        data[idx] = (char *)malloc(chunkSize * sizeof(char));
+        // 새로운 조각을 위한 메모리 할당 (끝의 NUL 문자 자리 포함)
+        data[idx] = (char *)malloc((chunkSize + 1) * sizeof(char));
         if (data[idx] == NULL) {
             perror("Failed to allocate memory for chunk"); // 메모리 할당 실패 시 오류 메시지 출력
             // 이미 할당된 메모리 해제
@@ -149,12 +151,17 @@ char** get_file_data(const char* path) {
         if (bytesRead > 0) {
             if (bytesRead < chunkSize) {
                 // 만약 읽은 바이트가 chunkSize보다 적다면 메모리 크기 조정
-                char *adjusted = realloc(data[idx], bytesRead);
+                char *adjusted = realloc(data[idx], bytesRead + 1);
                 if (adjusted) {
                     data[idx] = adjusted;
                 }
             }
+            // 문자열로 읽을 수 있도록 NUL 문자로 끝낸다 (없으면 읽는 쪽이 버퍼 끝을 넘어 읽는다)
+            data[idx][bytesRead] = '\0';
             idx++;
+        } else {
+            free(data[idx]); // 읽은 내용이 없는 조각은 버린다
+            data[idx] = NULL;
         }
         if (bytesRead < chunkSize) {
             if (feof(file)) {
@@ -162,7 +169,7 @@ char** get_file_data(const char* path) {
             } else if (ferror(file)) {
                 perror("Error reading file"); // 파일 읽기 중 오류 발생 시 메시지 출력
                 // 이미 할당된 메모리 해제
-                for (int i = 0; i <= idx; i++) {
+                for (int i = 0; i < idx; i++) {
                     free(data[i]);
                 }
                 free(data);
@@ -223,7 +230,7 @@ void free_file_data_array(char*** file_data_array, int num_files) {
  * 즉, file_data_array[0][0]는 첫 번째 파일의 전체 경로를 의미한다.
  * file_data_array[i][j][k]는 단순 문자이므로 큰 의미가 없다.
 */
-void collect_file_data_recursive(const char* dir_path, int* num_files, char**** file_data_array, int depth) {
+void collect_file_data_recursive(const char* dir_path, int* num_files, int* alloc_size, char**** file_data_array, int depth) {
     if (depth > 3) {
         return;
     }
@@ -234,7 +241,6 @@ void collect_file_data_recursive(const char* dir_path, int* num_files, char****
     }
 
     struct dirent *dir;
-    int alloc_size = 4;
 
     // 동적 메모리 할당 후, 메모리 누수 방지를 위한 코드 추가
     while ((dir = readdir(d)) != NULL) {
@@ -257,21 +263,23 @@ void collect_file_data_recursive(const char* dir_path, int* num_files, char****
                     (*num_files)++; // 파일 수 증가
 
                     // 파일 수가 할당된 크기를 초과하는 경우
-                    if (*num_files > alloc_size) {
-                        alloc_size *= 2;
-                        char ***temp = realloc(*file_data_array, sizeof(char**) * alloc_size);
+                    // (할당 크기는 재귀 호출 사이에 공유해야 배열 끝을 넘어 쓰지 않는다)
+                    if (*num_files > *alloc_size) {
+                        char ***temp = realloc(*file_data_array, sizeof(char**) * *alloc_size * 2);
                         if (!temp) { // realloc 실패 시 메모리 해제
+                            (*num_files)--;
                             free_file_data(data);
                             closedir(d);
                             return;
                         }
+                        *alloc_size *= 2;
                         *file_data_array = temp;
                     }
 
                     (*file_data_array)[*num_files - 1] = data;
                 }
             } else if (S_ISDIR(st.st_mode)) {
-                collect_file_data_recursive(full_path, num_files, file_data_array, depth + 1);
+                collect_file_data_recursive(full_path, num_files, alloc_size, file_data_array, depth + 1);
             }
         }
     }
@@ -280,7 +288,429 @@ void collect_file_data_recursive(const char* dir_path, int* num_files, char****
 
 char*** get_all_file_data(const char* dir_path, int* num_files) {
     *num_files = 0;
-    char*** file_data_array = malloc(sizeof(char **) * 4);
-    collect_file_data_recursive(dir_path, num_files, &file_data_array, 1);
+    int alloc_size = 4;
+    char*** file_data_array = malloc(sizeof(char **) * alloc_size);
+    if (!file_data_array) {
+        return NULL;
+    }
+    collect_file_data_recursive(dir_path, num_files, &alloc_size, &file_data_array, 1);
     return file_data_array;
-}
\ No newline at end of file
+}
+
+// utf8_chunk_offsets: UTF-8 글자를 중간에서 자르지 않는 chunk_size 바이트 이하의 조각 경계를 계산한다
+// 입력: data, size (읽을 메모리), chunk_size (조각의 최대 크기),
+//       offsets (호출하는 쪽이 준비한 배열), max_offsets (offsets의 길이)
+// 출력: 조각 수 n. offsets[0..n]에 n + 1개의 경계(0과 size 포함)를 쓴다.
+// 조각마다 메모리를 할당하지 않는다. offsets가 모자라면 들어가는 만큼만 쓰고 조각 수를 반환하므로,
+// offsets를 NULL로 한 번 불러서 조각 수를 얻은 뒤 (n + 1)개짜리 배열로 다시 부르면 된다.
+size_t utf8_chunk_offsets(const char* data, size_t size, size_t chunk_size, size_t* offsets, size_t max_offsets) {
+    size_t count = 0;
+    size_t pos = 0;
+    if (chunk_size == 0) {
+        chunk_size = 1;
+    }
+    if (offsets && max_offsets > 0) {
+        offsets[0] = 0;
+    }
+
+    while (pos < size) {
+        size_t end = size;
+        if (size - pos > chunk_size) {
+            end = pos + chunk_size;
+            // 이어지는 바이트(10xxxxxx)이면 글자의 첫 바이트까지 되돌아간다
+            while (end > pos && ((unsigned char)data[end] & 0xC0) == 0x80) {
+                end--;
+            }
+            if (end == pos) {
+                end = pos + chunk_size; // 올바른 UTF-8이 아니면 그대로 자른다
+            }
+        }
+        count++;
+        if (offsets && count < max_offsets) {
+            offsets[count] = end;
+        }
+        pos = end;
+    }
+    return count;
+}
+
+
+// ---------------------------------------------------------------------------
+// 병렬 디렉토리 탐색
+// 워커 스레드들이 공유 디렉토리 큐에서 디렉토리를 하나씩 꺼내 읽고, 항목의 경로, 크기, 수정 시각,
+// inode, 종류를 묶음(scan_batch)에 모아 출력 큐로 내보낸다. 파일 내용은 읽지 않는다.
+// 경로는 필요한 만큼 할당하므로 길이와 깊이에 제한이 없다.
+// 디렉토리 항목이 든 묶음을 출력 큐에 넣은 뒤에 그 디렉토리를 디렉토리 큐에 넣으므로,
+// scan_next로 받는 순서에서 디렉토리는 항상 그 안의 항목보다 먼저 나온다.
+// ---------------------------------------------------------------------------
+
+#ifdef __APPLE__
+#define ST_MTIM(st) ((st).st_mtimespec)
+#else
+#define ST_MTIM(st) ((st).st_mtim)
+#endif
+
+// 출력 큐에 쌓아 둘 최대 묶음 수 (읽는 쪽이 느리면 워커가 기다린다)
+#define SCAN_MAX_PENDING_BATCHES 16
+
+// 디렉토리 경로 목록 (디렉토리 큐와 워커가 찾은 하위 디렉토리 목록에 쓴다)
+typedef struct {
+    char** items;
+    size_t len;
+    size_t capacity;
+} path_list;
+
+struct scanner {
+    pthread_mutex_t lock;
+    pthread_cond_t work_cond;   // 디렉토리 큐에 디렉토리가 들어왔거나 탐색이 끝남
+    pthread_cond_t out_cond;    // 출력 큐에 묶음이 들어왔거나 탐색이 끝남
+    pthread_cond_t space_cond;  // 출력 큐에 자리가 생김
+    path_list queue;            // 읽을 디렉토리 큐
+    size_t active;              // 디렉토리를 읽고 있는 워커 수
+    scan_batch* out_head;       // 출력 큐
+    scan_batch* out_tail;
+    size_t out_len;
+    int running;                // 아직 끝나지 않은 워커 수
+    int stopped;                // scan_close가 불림
+    char* prune_suffix;         // 이 이름으로 끝나는 디렉토리는 내보내지도 들어가지도 않는다
+    size_t batch_size;
+    pthread_t* threads;
+    int num_threads;
+};
+
+static int path_list_push(path_list* list, char* path) {
+    if (list->len == list->capacity) {
+        size_t capacity = list->capacity ? list->capacity * 2 : 64;
+        char** items = realloc(list->items, sizeof(char*) * capacity);
+        if (!items) {
+            return -1;
+        }
+        list->items = items;
+        list->capacity = capacity;
+    }
+    list->items[list->len++] = path;
+    return 0;
+}
+
+static void path_list_free(path_list* list) {
+    for (size_t i = 0; i < list->len; i++) {
+        free(list->items[i]);
+    }
+    free(list->items);
+    list->items = NULL;
+    list->len = list->capacity = 0;
+}
+
+static scan_batch* scan_batch_new(size_t batch_size) {
+    scan_batch* batch = calloc(1, sizeof(scan_batch));
+    if (!batch) {
+        return NULL;
+    }
+    batch->paths_capacity = batch_size * 64;
+    batch->paths = malloc(batch->paths_capacity);
+    batch->path_offsets = malloc(sizeof(size_t) * batch_size);
+    batch->sizes = malloc(sizeof(int64_t) * batch_size);
+    batch->mtimes_ns = malloc(sizeof(int64_t) * batch_size);
+    batch->inodes = malloc(sizeof(uint64_t) * batch_size);
+    batch->types = malloc(batch_size);
+    if (!batch->paths || !batch->path_offsets || !batch->sizes || !batch->mtimes_ns
+        || !batch->inodes || !batch->types) {
+        scan_free_batch(batch);
+        return NULL;
+    }
+    return batch;
+}
+
+// scan_free_batch: scan_next가 반환한 묶음을 해제한다
+void scan_free_batch(scan_batch* batch) {
+    if (!batch) return;
+    free(batch->paths);
+    free(batch->path_offsets);
+    free(batch->sizes);
+    free(batch->mtimes_ns);
+    free(batch->inodes);
+    free(batch->types);
+    free(batch);
+}
+
+// 묶음에 항목 하나를 추가한다. 경로는 dir + "/" + name으로 만든다.
+static int scan_batch_add(scan_batch* batch, const char* dir, size_t dir_len, const char* name,
+                          const struct stat* st, unsigned char type) {
+    size_t name_len = strlen(name);
+    int slash = dir_len > 0 && dir[dir_len - 1] != '/';
+    size_t needed = batch->paths_size + dir_len + slash + name_len + 1;
+    if (needed > batch->paths_capacity) {
+        size_t capacity = batch->paths_capacity * 2;
+        while (capacity < needed) {
+            capacity *= 2;
+        }
+        char* paths = realloc(batch->paths, capacity);
+        if (!paths) {
+            return -1;
+        }
+        batch->paths = paths;
+        batch->paths_capacity = capacity;
+    }
+
+    char* dest = batch->paths + batch->paths_size;
+    memcpy(dest, dir, dir_len);
+    if (slash) {
+        dest[dir_len] = '/';
+    }
+    memcpy(dest + dir_len + slash, name, name_len + 1);
+
+    size_t i = batch->count++;
+    batch->path_offsets[i] = batch->paths_size;
+    batch->sizes[i] = (int64_t)st->st_size;
+    batch->mtimes_ns[i] = (int64_t)ST_MTIM(*st).tv_sec * 1000000000LL + ST_MTIM(*st).tv_nsec;
+    batch->inodes[i] = (uint64_t)st->st_ino;
+    batch->types[i] = type;
+    batch->paths_size = needed;
+    return 0;
+}
+
+// 워커가 모은 묶음을 출력 큐에 넣고, 그 뒤에 찾은 하위 디렉토리를 디렉토리 큐에 넣는다 (lock을 잡은 채 호출)
+static void scan_flush_locked(scanner* s, scan_batch** batch, path_list* found) {
+    if (*batch && (*batch)->count > 0) {
+        while (s->out_len >= SCAN_MAX_PENDING_BATCHES && !s->stopped) {
+            pthread_cond_wait(&s->space_cond, &s->lock);
+        }
+        if (s->stopped) {
+            scan_free_batch(*batch);
+        } else {
+            if (s->out_tail) {
+                s->out_tail->next = *batch;
+            } else {
+                s->out_head = *batch;
+            }
+            s->out_tail = *batch;
+            s->out_len++;
+            pthread_cond_signal(&s->out_cond);
+        }
+        *batch = NULL;
+    }
+
+    for (size_t i = 0; i < found->len; i++) {
+        if (s->stopped || path_list_push(&s->queue, found->items[i]) != 0) {
+            free(found->items[i]);
+        }
+    }
+    if (found->len > 0) {
+        pthread_cond_broadcast(&s->work_cond);
+    }
+    found->len = 0;
+}
+
+// 디렉토리 하나를 읽어 항목을 묶음에 추가하고, 들어갈 하위 디렉토리를 found에 모은다
+static void scan_directory(scanner* s, const char* dir, scan_batch** batch, path_list* found) {
+    DIR* d = opendir(dir);
+    if (!d) {
+        return; // 읽을 수 없는 디렉토리(권한 등)는 건너뛴다
+    }
+    int fd = dirfd(d);
+    size_t dir_len = strlen(dir);
+    size_t prune_len = s->prune_suffix ? strlen(s->prune_suffix) : 0;
+    struct dirent* entry;
+
+    while ((entry = readdir(d)) != NULL) {
+        const char* name = entry->d_name;
+        if (strcmp(name, ".") == 0 || strcmp(name, "..") == 0) {
+            continue;
+        }
+
+        struct stat st;
+        if (fstatat(fd, name, &st, AT_SYMLINK_NOFOLLOW) != 0) {
+            continue; // 읽는 사이에 사라진 항목
+        }
+        unsigned char type = SCAN_OTHER;
+        if (S_ISREG(st.st_mode)) {
+            type = SCAN_FILE;
+        } else if (S_ISDIR(st.st_mode)) {
+            type = SCAN_DIR;
+        } else if (S_ISLNK(st.st_mode)) {
+            // 링크는 대상의 크기와 수정 시각을 쓰고, 링크된 디렉토리 안으로는 들어가지 않는다
+            struct stat target;
+            if (fstatat(fd, name, &target, 0) == 0) {
+                if (S_ISREG(target.st_mode)) {
+                    type = SCAN_LINK_FILE;
+                    st = target;
+                } else if (S_ISDIR(target.st_mode)) {
+                    type = SCAN_LINK_DIR;
+                    st = target;
+                }
+            }
+        }
+
+        if ((type == SCAN_DIR || type == SCAN_LINK_DIR) && prune_len > 0) {
+            size_t name_len = strlen(name);
+            if (name_len >= prune_len && strcmp(name + name_len - prune_len, s->prune_suffix) == 0) {
+                continue;
+            }
+        }
+
+        if (!*batch) {
+            *batch = scan_batch_new(s->batch_size);
+            if (!*batch) {
+                perror("Failed to allocate scan batch");
+                break;
+            }
+        }
+        if (scan_batch_add(*batch, dir, dir_len, name, &st, type) != 0) {
+            perror("Failed to allocate scan paths");
+            break;
+        }
+
+        if (type == SCAN_DIR) {
+            const char* path = (*batch)->paths + (*batch)->path_offsets[(*batch)->count - 1];
+            char* copy = strdup(path);
+            if (!copy || path_list_push(found, copy) != 0) {
+                free(copy);
+            }
+        }
+
+        if ((*batch)->count >= s->batch_size) {
+            pthread_mutex_lock(&s->lock);
+            scan_flush_locked(s, batch, found);
+            pthread_mutex_unlock(&s->lock);
+        }
+    }
+    closedir(d);
+}
+
+static void* scan_worker(void* arg) {
+    scanner* s = arg;
+    scan_batch* batch = NULL;
+    path_list found = {0}; // 이 워커가 찾았지만 아직 디렉토리 큐에 넣지 않은 하위 디렉토리
+    char* dir = NULL;
+
+    pthread_mutex_lock(&s->lock);
+    for (;;) {
+        if (dir) {
+            s->active--;
+            free(dir);
+            dir = NULL;
+        }
+        // 작은 디렉토리가 많을 때 묶음을 디렉토리마다 내보내지 않도록, 묶음이 찼거나
+        // 디렉토리 큐가 비어서 다른 워커가 기다릴 수 있을 때만 내보낸다
+        if (s->queue.len == 0 || s->stopped || (batch && batch->count >= s->batch_size)) {
+            scan_flush_locked(s, &batch, &found);
+        }
+        while (s->queue.len == 0 && s->active > 0 && !s->stopped) {
+            pthread_cond_wait(&s->work_cond, &s->lock);
+        }
+        if (s->queue.len == 0 || s->stopped) {
+            break;
+        }
+        dir = s->queue.items[--s->queue.len];
+        s->active++;
+        pthread_mutex_unlock(&s->lock);
+
+        scan_directory(s, dir, &batch, &found);
+
+        pthread_mutex_lock(&s->lock);
+    }
+
+    // 디렉토리 큐가 비었고 읽는 워커도 없으면 탐색이 끝난 것이다
+    pthread_cond_broadcast(&s->work_cond);
+    if (--s->running == 0) {
+        pthread_cond_broadcast(&s->out_cond);
+    }
+    pthread_mutex_unlock(&s->lock);
+    scan_free_batch(batch);
+    path_list_free(&found);
+    return NULL;
+}
+
+// scan_open: root 아래를 threads개의 스레드로 탐색하기 시작한다
+// 입력: root (탐색할 디렉토리), threads (워커 스레드 수),
+//       prune_suffix (이 이름으로 끝나는 디렉토리는 건너뛴다. NULL이면 건너뛰지 않음),
+//       batch_size (묶음 하나의 최대 항목 수)
+// 출력: scanner 핸들 (실패 시 NULL). scan_next로 결과를 받고 scan_close로 해제한다.
+// root 자신은 결과에 들어가지 않는다.
+scanner* scan_open(const char* root, int threads, const char* prune_suffix, size_t batch_size) {
+    scanner* s = calloc(1, sizeof(scanner));
+    if (!s) {
+        return NULL;
+    }
+    s->batch_size = batch_size > 0 ? batch_size : 4096;
+    s->num_threads = threads > 0 ? threads : 1;
+    s->prune_suffix = prune_suffix && prune_suffix[0] ? strdup(prune_suffix) : NULL;
+    s->threads = calloc(s->num_threads, sizeof(pthread_t));
+    char* root_copy = strdup(root);
+    if (!s->threads || !root_copy || path_list_push(&s->queue, root_copy) != 0) {
+        free(root_copy);
+        path_list_free(&s->queue);
+        free(s->threads);
+        free(s->prune_suffix);
+        free(s);
+        return NULL;
+    }
+    pthread_mutex_init(&s->lock, NULL);
+    pthread_cond_init(&s->work_cond, NULL);
+    pthread_cond_init(&s->out_cond, NULL);
+    pthread_cond_init(&s->space_cond, NULL);
+
+    pthread_mutex_lock(&s->lock);
+    int created = 0;
+    for (int i = 0; i < s->num_threads; i++) {
+        if (pthread_create(&s->threads[created], NULL, scan_worker, s) == 0) {
+            created++;
+            s->running++;
+        }
+    }
+    s->num_threads = created;
+    if (created == 0) {
+        perror("Failed to start scan threads");
+        s->stopped = 1;
+    }
+    pthread_mutex_unlock(&s->lock);
+    return s;
+}
+
+// scan_next: 다음 묶음을 기다렸다가 반환한다. 탐색이 끝났으면 NULL을 반환한다.
+// 반환한 묶음은 scan_free_batch로 해제해야 한다.
+scan_batch* scan_next(scanner* s) {
+    pthread_mutex_lock(&s->lock);
+    while (!s->out_head && s->running > 0) {
+        pthread_cond_wait(&s->out_cond, &s->lock);
+    }
+    scan_batch* batch = s->out_head;
+    if (batch) {
+        s->out_head = batch->next;
+        if (!s->out_head) {
+            s->out_tail = NULL;
+        }
+        s->out_len--;
+        batch->next = NULL;
+        pthread_cond_signal(&s->space_cond);
+    }
+    pthread_mutex_unlock(&s->lock);
+    return batch;
+}
+
+// scan_close: 탐색을 멈추고(끝나지 않았으면) 스레드와 남은 결과를 모두 해제한다
+void scan_close(scanner* s) {
+    if (!s) return;
+    pthread_mutex_lock(&s->lock);
+    s->stopped = 1;
+    pthread_cond_broadcast(&s->work_cond);
+    pthread_cond_broadcast(&s->space_cond);
+    pthread_mutex_unlock(&s->lock);
+    for (int i = 0; i < s->num_threads; i++) {
+        pthread_join(s->threads[i], NULL);
+    }
+
+    while (s->out_head) {
+        scan_batch* next = s->out_head->next;
+        scan_free_batch(s->out_head);
+        s->out_head = next;
+    }
+    path_list_free(&s->queue);
+    pthread_mutex_destroy(&s->lock);
+    pthread_cond_destroy(&s->work_cond);
+    pthread_cond_destroy(&s->out_cond);
+    pthread_cond_destroy(&s->space_cond);
+    free(s->threads);
+    free(s->prune_suffix);
+    free(s);
+}
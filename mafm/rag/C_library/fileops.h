@@ -2,11 +2,44 @@
 #define FILEOPS_H
 
 #include <stdio.h>
+#include <stdint.h>
+
+// scan_tree가 내보내는 항목 종류 (심볼릭 링크는 가리키는 대상의 종류로 나눈다)
+#define SCAN_FILE 0
+#define SCAN_DIR 1
+#define SCAN_LINK_FILE 2
+#define SCAN_LINK_DIR 3
+#define SCAN_OTHER 4
+
+// scan_next가 반환하는 항목 묶음 (scan_free_batch로 해제)
+// 항목 i의 경로는 paths + path_offsets[i]에서 시작하는 NUL로 끝나는 문자열이다.
+typedef struct scan_batch {
+    size_t count;
+    char* paths;
+    size_t paths_size;
+    size_t* path_offsets;
+    int64_t* sizes;
+    int64_t* mtimes_ns;
+    uint64_t* inodes;
+    unsigned char* types;
+    // 아래는 라이브러리 내부에서만 쓴다
+    size_t paths_capacity;
+    struct scan_batch* next;
+} scan_batch;
+
+typedef struct scanner scanner;
 
 char* make_soft_links(char** paths, int num_paths, char *temp_dir);
 char** get_file_data(const char* path);
 char*** get_all_file_data(const char* dir_path, int* num_files);
 int split_file(const char* file_path, const char* output_dir, size_t chunk_size);
 int is_image_or_video(const char* filename);
+void free_file_data(char** data);
+void free_file_data_array(char*** file_data_array, int num_files);
+size_t utf8_chunk_offsets(const char* data, size_t size, size_t chunk_size, size_t* offsets, size_t max_offsets);
+scanner* scan_open(const char* root, int threads, const char* prune_suffix, size_t batch_size);
+scan_batch* scan_next(scanner* s);
+void scan_free_batch(scan_batch* batch);
+void scan_close(scanner* s);
 
 #endif
\ No newline at end of file
@@ -0,0 +1,163 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# 근사 최근접 이웃(ANN) 인덱스
+# "auto": 컬렉션의 행 수가 ANN_MIN_ROWS 미만이면 flat(전수 검색), 이상이면 ivf (기본값)
+# "flat" / "ivf": 항상 그 인덱스를 쓴다
+#   (ANN 인덱스는 IVF만 지원한다. Milvus Lite는 float32 벡터에만 IVF_FLAT을 만들 수 있어서
+#    그 밖의 저장 형식은 flat으로 대신하고, 모르는 이름은 ivf로 대신한다)
+ANN_INDEX = os.getenv("MAFM_ANN_INDEX", "auto").lower()
+ANN_MIN_ROWS = int(os.getenv("MAFM_ANN_MIN_ROWS", "50000"))
+
+# IVF: 클러스터 수(0이면 4 * sqrt(행 수))와 검색할 클러스터 수
+ANN_NLIST = int(os.getenv("MAFM_ANN_NLIST", "0"))
+ANN_NPROBE = int(os.getenv("MAFM_ANN_NPROBE", "16"))
+
+# 마지막으로 인덱스를 만든 뒤 행 수가 이 비율만큼 늘면 다시 만든다
+ANN_REBUILD_GROWTH = float(os.getenv("MAFM_ANN_REBUILD_GROWTH", "0.2"))
+
+# 인덱스 재구성을 백그라운드 스레드에서 할지 여부 (0이면 삽입한 스레드에서 바로 만든다)
+ANN_BACKGROUND = os.getenv("MAFM_ANN_BACKGROUND", "1") not in ("", "0")
+
+
+def default_nlist(row_count):
+    return min(65536, max(16, int(4 * math.sqrt(max(row_count, 1)))))
+
+
+def choose_index(row_count, index_type=ANN_INDEX, supported=("flat", "ivf")):
+    """행 수와 설정으로 쓸 인덱스 설정을 고르는 함수
+
+    반환: {"type": "flat" | "ivf", "rows": 행 수, ivf이면 nlist와 nprobe}
+    """
+    if index_type == "auto":
+        index_type = "ivf" if row_count >= ANN_MIN_ROWS else "flat"
+    if index_type not in supported:
+        index_type = "ivf" if "ivf" in supported and index_type != "flat" else "flat"
+
+    config = {"type": index_type, "rows": row_count}
+    if index_type == "ivf":
+        nlist = ANN_NLIST or default_nlist(row_count)
+        # 클러스터에 평균 몇 개의 행은 들어가도록 행 수에 맞춰 줄인다
+        nlist = max(1, min(nlist, row_count // 8 or 1))
+        config.update(nlist=nlist, nprobe=max(1, min(ANN_NPROBE, nlist)))
+    return config
+
+
+def needs_rebuild(
+    current,
+    row_count,
+    index_type=ANN_INDEX,
+    supported=("flat", "ivf"),
+    growth=ANN_REBUILD_GROWTH,
+):
+    """현재 인덱스(current, 없으면 None)를 다시 만들어야 하는지 확인하는 함수"""
+    desired = choose_index(row_count, index_type, supported)
+    current_type = current["type"] if current else "flat"
+    if desired["type"] != current_type:
+        return True
+    if current_type == "flat" or current.get("rows") is None:
+        # rows가 None이면 저장소가 새 행도 알아서 색인한다 (Milvus의 segment별 인덱스)
+        return False
+    return row_count >= current["rows"] * (1 + growth)
+
+
+def spherical_kmeans(vectors, k, iterations=10, sample_size=None, seed=0):
+    """정규화된 벡터들을 코사인 유사도 기준으로 k개로 묶고 중심(정규화됨)을 반환하는 함수
+
+    학습은 클러스터당 최대 256개의 표본으로만 한다.
+    """
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    sample_size = min(count, sample_size or k * 256)
+    sample = np.asarray(
+        vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32
+    )
+    k = min(k, len(sample))
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1)
+        # 빈 클러스터는 임의의 표본으로 다시 시작
+        empty = norms == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / np.maximum(norms, 1e-12)[:, None]
+    return centroids
+
+
+def assign(vectors, centroids, batch_size=65536):
+    """각 벡터와 가장 가까운 중심의 번호를 반환하는 함수 (메모리를 아끼려고 나눠서 계산)"""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = np.asarray(vectors[start : start + batch_size], dtype=np.float32)
+        labels[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
+
+
+class IndexMaintainer:
+    """삽입 뒤 컬렉션의 크기를 보고 필요하면 인덱스를 다시 만드는 클래스
+
+    재구성은 스레드 하나에서 순서대로 실행하고, 같은 컬렉션의 재구성은 한 번만 예약한다.
+    재구성하는 동안에도 검색은 이전 인덱스(또는 전수 검색)로 계속된다.
+    """
+
+    def __init__(self, store, index_type=ANN_INDEX, background=ANN_BACKGROUND):
+        self.store = store
+        self.index_type = index_type
+        self.background = background
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+
+    def check(self, db_name):
+        with self._lock:
+            if db_name in self._pending:
+                return
+        try:
+            row_count = self.store.row_count(db_name)
+            current = self.store.index_info(db_name)
+        except Exception as e:
+            print(f"Error checking vector index of {db_name}: {e}")
+            return
+        supported = self.store.supported_indexes(db_name)
+        if not needs_rebuild(current, row_count, self.index_type, supported):
+            return
+
+        config = choose_index(row_count, self.index_type, supported)
+        if not self.background:
+            self._build(db_name, config)
+            return
+        with self._lock:
+            if db_name in self._pending:
+                return
+            self._pending.add(db_name)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="mafm-index"
+                )
+            self._executor.submit(self._build, db_name, config)
+
+    def _build(self, db_name, config):
+        try:
+            if self.store.build_index(db_name, config) is False:
+                print(f"{db_name}을 사용 중이라 {config['type']} 인덱스는 다음에 만듭니다.")
+                return
+            print(f"Built {config['type']} index for {db_name} ({config['rows']} rows)")
+        except Exception as e:
+            print(f"Error building vector index of {db_name}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(db_name)
+
+    def wait(self):
+        """예약된 재구성이 모두 끝날 때까지 기다리는 함수"""
+        with self._lock:
+            executor = self._executor
+        if executor is not None:
+            executor.submit(lambda: None).result()
@@ -0,0 +1,238 @@
+import bisect
+import os
+import re
+from .embedding import get_model_id, get_tokenizer
+
+# 청크 하나의 최대 토큰 수와 이웃한 청크끼리 겹치게 할 토큰 수
+# (최대 토큰 수는 모델의 입력 길이를 넘지 않게 줄인다)
+CHUNK_TOKENS = int(os.getenv("MAFM_CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP = int(os.getenv("MAFM_CHUNK_OVERLAP", "32"))
+
+# 블록 단위로 들어오는 텍스트(chunk_stream)를 이 글자 수만큼 모아서 나눈다
+STREAM_BUFFER_CHARS = int(os.getenv("MAFM_CHUNK_STREAM_BUFFER", "65536"))
+
+# 청크 설정이 바뀌면 파일을 다시 나눠서 임베딩하도록 manifest의 모델 id에 덧붙인다
+CHUNKER_ID = f"tokens={CHUNK_TOKENS}/{CHUNK_OVERLAP}"
+
+# 문단 경계(빈 줄)와 문장 경계(문장 부호 뒤의 공백, 줄바꿈)
+_PARAGRAPH = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+_SENTENCE = re.compile(r"(?<=[.!?。！？])\s+|\n\s*")
+
+# 토크나이저를 쓸 수 없을 때의 근사 토큰: 영문/숫자 단어 하나, 또는 그 밖의 글자 하나
+_APPROX_TOKEN = re.compile(r"[A-Za-z0-9_]+|\S")
+
+# 토크나이저의 model_max_length가 이보다 크면 길이 제한이 없는 것으로 본다
+_UNLIMITED_LENGTH = 100000
+
+
+def token_spans(text, tokenizer=None):
+    """텍스트의 토큰마다 (시작, 끝) 문자 위치를 반환하는 함수
+
+    tokenizer가 없으면 근사 토큰(_APPROX_TOKEN)을 쓴다.
+    """
+    if tokenizer is not None:
+        encoded = tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False,  # 모델 입력 길이보다 길다는 경고를 끈다 (청크로 나눌 것이므로)
+        )
+        return [(start, end) for start, end in encoded["offset_mapping"] if end > start]
+    return [match.span() for match in _APPROX_TOKEN.finditer(text)]
+
+
+def max_chunk_tokens(tokenizer=None, max_tokens=CHUNK_TOKENS):
+    """모델 입력 길이([CLS], [SEP] 제외)를 넘지 않는 청크의 최대 토큰 수"""
+    limit = getattr(tokenizer, "model_max_length", None)
+    if limit and limit < _UNLIMITED_LENGTH:
+        max_tokens = min(max_tokens, limit - 2)
+    return max(1, max_tokens)
+
+
+def _units(text):
+    """문장 단위의 (시작, 끝, 문단의 첫 문장인지)를 반환하는 함수"""
+    units = []
+    paragraph_start = 0
+    for paragraph_end, next_start in [
+        (m.start(), m.end()) for m in _PARAGRAPH.finditer(text)
+    ] + [(len(text), len(text))]:
+        start = paragraph_start
+        first = True
+        for match in _SENTENCE.finditer(text, paragraph_start, paragraph_end):
+            if match.start() > start:
+                units.append((start, match.start(), first))
+                first = False
+            start = match.end()
+        if paragraph_end > start:
+            units.append((start, paragraph_end, first))
+        paragraph_start = next_start
+    return units
+
+
+def _chunk_ranges(starts, units, max_tokens, overlap, chunk_start=0, chunk_end=0, unit_starts=()):
+    """문장들을 차례로 청크 범위(첫 토큰, 마지막 토큰 + 1)로 묶는 함수
+
+    starts는 토큰마다의 시작 문자 위치이다. 끝난 청크들의 범위와, 아직 채우는 중인
+    청크의 상태(chunk_start, chunk_end, 청크 안 문장들의 첫 토큰)를 반환한다.
+    """
+    ranges = []
+    unit_starts = list(unit_starts)
+
+    def flush():
+        nonlocal chunk_start, unit_starts
+        ranges.append((chunk_start, chunk_end))
+        # 끝에서 overlap 토큰 안에 들어오는 가장 앞의 문장부터 다음 청크를 시작한다
+        kept = [s for s in unit_starts if chunk_end - s <= overlap and s > chunk_start]
+        chunk_start = kept[0] if kept else chunk_end
+        unit_starts = kept
+
+    for unit_start, unit_end, paragraph in units:
+        first = bisect.bisect_left(starts, unit_start)
+        last = bisect.bisect_left(starts, unit_end)
+        count = last - first
+        if count == 0:
+            continue
+
+        if chunk_end > chunk_start:
+            length = chunk_end - chunk_start
+            if length + count > max_tokens or (paragraph and length >= max_tokens // 2):
+                flush()
+                if chunk_end - chunk_start + count > max_tokens:
+                    # 겹치는 부분까지 넣으면 넘치는 경우에는 겹치지 않게 시작한다
+                    chunk_start, unit_starts = first, []
+        if chunk_end <= chunk_start:
+            chunk_start = first
+
+        if count > max_tokens:
+            # 긴 문장은 overlap만큼 겹치는 창으로 자르고, 마지막 조각은 다음 문장과 이어 붙인다
+            step = max_tokens - overlap
+            while last - chunk_start > max_tokens:
+                chunk_end = chunk_start + max_tokens
+                ranges.append((chunk_start, chunk_end))
+                chunk_start += step
+            unit_starts = []
+        unit_starts.append(max(first, chunk_start))
+        chunk_end = last
+
+    return ranges, chunk_start, chunk_end, unit_starts
+
+
+def _chunk_buffer(text, max_tokens, overlap, tokenizer, resume=None, final=True, max_held=None):
+    """text를 청크로 나누는 함수 (chunk_text와 chunk_stream이 함께 쓴다)
+
+    resume: 이전 버퍼에서 이어받은 상태 (이어서 처리할 첫 문장의 위치, 그 문장이 문단의 첫
+            문장인지, 채우는 중인 청크 안 문장들의 시작 위치). 이 위치들은 text 안의 문자 위치이고,
+            채우는 중인 청크는 text의 처음에서 시작한다.
+    final이 False이면 뒤의 블록과 이어질 수 있는 마지막 문장은 처리하지 않고 남긴다.
+    반환: (청크 목록, 다음 버퍼로 넘길 텍스트, 다음 버퍼의 resume)
+    """
+    spans = token_spans(text, tokenizer)
+    starts = [start for start, _ in spans]
+    units = _units(text)
+    chunk_start = chunk_end = 0
+    unit_starts = []
+    if resume is not None:
+        resume_at, paragraph, unit_chars = resume
+        units = [unit for unit in units if unit[0] >= resume_at]
+        if units and units[0][0] == resume_at:
+            units[0] = (resume_at, units[0][1], paragraph)
+        chunk_end = bisect.bisect_left(starts, resume_at)
+        unit_starts = [bisect.bisect_left(starts, c) for c in unit_chars]
+
+    held = None
+    if not final:
+        if len(units) < 2 and (max_held is None or len(text) < max_held):
+            return [], text, resume  # 끝난 문장이 없으면 다음 블록을 더 모은다
+        if len(units) == 1:
+            # 문장 경계 없이 너무 길면 마지막 공백 뒤에서 나눠서 처리한다
+            split = max(text.rfind(" ", units[0][0]), text.rfind("\n", units[0][0])) + 1
+            if split <= units[0][0]:
+                split = len(text)
+            units = [(units[0][0], split, units[0][2]), (split, len(text), False)]
+        held = units.pop()
+
+    ranges, chunk_start, chunk_end, unit_starts = _chunk_ranges(
+        starts, units, max_tokens, overlap, chunk_start, chunk_end, unit_starts
+    )
+    if held is None:
+        if chunk_end > chunk_start:
+            ranges.append((chunk_start, chunk_end))
+        rest, resume = "", None
+    else:
+        # 다음 버퍼는 채우는 중인 청크의 처음(비어 있으면 남긴 문장)부터 시작한다
+        cut = spans[chunk_start][0] if chunk_end > chunk_start else held[0]
+        rest = text[cut:]
+        resume = (held[0] - cut, held[2], [spans[i][0] - cut for i in unit_starts])
+    chunks = [text[spans[first][0] : spans[last - 1][1]] for first, last in ranges]
+    return chunks, rest, resume
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=None):
+    """텍스트를 토큰 수 기준의 청크 목록으로 나누는 함수
+
+    문장을 최대 토큰 수까지 이어 붙이고, 문단이 바뀔 때 청크가 절반 넘게 찼으면 거기서
+    나눈다. 새 청크는 이전 청크의 끝 문장들(overlap 토큰 이내)로 시작해서 문맥이 이어지게
+    하고, 최대 토큰 수보다 긴 문장은 토큰 경계에서 자른다. 문자열(str)을 문자 위치로
+    자르므로 여러 바이트 글자(한글 등)가 깨지지 않는다.
+    tokenizer가 None이면 임베딩 모델의 토크나이저(get_tokenizer())를 쓴다.
+    """
+    if not text or not text.strip():
+        return []
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+    max_tokens = max_chunk_tokens(tokenizer, max_tokens)
+    overlap = max(0, min(overlap, max_tokens // 2))
+    return _chunk_buffer(text, max_tokens, overlap, tokenizer)[0]
+
+
+def chunk_stream(
+    blocks,
+    max_tokens=CHUNK_TOKENS,
+    overlap=CHUNK_OVERLAP,
+    tokenizer=None,
+    buffer_chars=STREAM_BUFFER_CHARS,
+):
+    """텍스트 블록(페이지, 문단 등)의 iterator를 받아 청크를 차례로 내보내는 generator
+
+    블록을 buffer_chars 글자까지 모아 끝난 문장들까지만 청크로 나누고, 다음 블록과 이어질
+    수 있는 마지막 문장과 채우는 중인 청크는 (문장/겹침 상태와 함께) 다음 블록들과 이어서
+    나눈다. 문서 전체를 메모리에 올리지 않고도 한 번에 나눈 것과 같은 청크를 얻는다.
+    (문장 경계 없이 buffer_chars의 4배를 넘는 텍스트는 공백에서 나눠 처리하므로 그 부분은
+    한 번에 나눈 결과와 다를 수 있다)
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+    max_tokens = max_chunk_tokens(tokenizer, max_tokens)
+    overlap = max(0, min(overlap, max_tokens // 2))
+    buffer = ""
+    resume = None
+    for block in blocks:
+        buffer += block
+        if len(buffer) < buffer_chars:
+            continue
+        chunks, buffer, resume = _chunk_buffer(
+            buffer, max_tokens, overlap, tokenizer, resume, False, buffer_chars * 4
+        )
+        yield from chunks
+    if buffer.strip():
+        yield from _chunk_buffer(buffer, max_tokens, overlap, tokenizer, resume)[0]
+
+
+def batched(chunks, size):
+    """청크 iterator를 size개씩 묶은 목록으로 내보내는 generator"""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_index_id():
+    """manifest에 기록하는 id (임베딩 모델 id와 청크 설정)
+
+    둘 중 하나라도 바뀌면 다음 색인 때 파일을 다시 나눠서 임베딩한다.
+    """
+    return f"{get_model_id()} {CHUNKER_ID}"
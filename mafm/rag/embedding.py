@@ -1,61 +1,466 @@
 from sentence_transformers import SentenceTransformer
+import importlib.util
 import os
+import platform
+import threading
+import time
 import psutil
+import torch
+from .embedding_cache import (
+    EmbeddingCache,
+    QueryEmbeddingCache,
+    EMBEDDING_CACHE_SIZE,
+    QUERY_CACHE_SIZE,
+)
 
 # 모델을 전역 변수로 초기화하여 재사용
 model = None
+model_backend = None
+MODEL_NAME = "avsolatorio/GIST-small-Embedding-v0"
+
+# 모델을 미리 받아둔 로컬 디렉토리 (지정하면 네트워크에 접근하지 않는다)
+MODEL_PATH = os.getenv("MAFM_MODEL_PATH", "")
+
+# 임베딩 백엔드: torch(fp32), torch-int8, onnx(fp32), onnx-int8
+EMBED_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+EMBED_BACKEND = os.getenv("MAFM_EMBED_BACKEND", "torch").lower()
+
+# 임베딩에 쓸 CPU 스레드 수 (0이면 라이브러리 기본값)
+EMBED_THREADS = int(os.getenv("MAFM_EMBED_THREADS", "0"))
+
+# int8 ONNX 모델을 만들 때 쓸 양자화 설정 (CPU 명령어 집합)
+ONNX_QUANTIZATION = (
+    "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+)
+
+# 청크 해시 기반 임베딩 캐시 (처음 사용할 때 연다)
+embedding_cache = None
+_embedding_cache_failed = False
+
+# 검색 질의 임베딩 LRU 캐시 (문서 청크 캐시와 별도)
+query_cache = None
+_query_cache_failed = False
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+# 청크를 나눌 때 쓰는 토크나이저 (처음 사용할 때 읽는다)
+tokenizer = None
+_tokenizer_failed = False
+_tokenizer_lock = threading.Lock()
+
+# 여러 파일의 청크를 모아서 임베딩할 때의 최대 청크 수와 (추정) 토큰 수
+EMBED_BATCH_SIZE = int(os.getenv("MAFM_EMBED_BATCH_SIZE", "64"))
+EMBED_TOKEN_BUDGET = int(os.getenv("MAFM_EMBED_TOKEN_BUDGET", "16384"))
+
+
+def _model_source():
+    """(모델 이름 또는 로컬 경로, 로컬 파일만 쓸지 여부)를 반환하는 함수"""
+    if MODEL_PATH:
+        return os.path.expanduser(MODEL_PATH), True
+    return MODEL_NAME, os.getenv("HF_HUB_OFFLINE", "") not in ("", "0")
+
+
+def _require_onnx():
+    """ONNX 백엔드에 필요한 패키지가 없으면 ImportError를 내는 함수"""
+    for package in ("optimum", "onnxruntime"):
+        if importlib.util.find_spec(package) is None:
+            raise ImportError(
+                f"{package} is not installed (pip install optimum[onnxruntime])"
+            )
+
+
+def _onnx_model_kwargs(file_name=None):
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if EMBED_THREADS > 0:
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = EMBED_THREADS
+        session_options.inter_op_num_threads = 1
+        model_kwargs["session_options"] = session_options
+    if file_name is not None:
+        model_kwargs["file_name"] = file_name
+    return model_kwargs
+
+
+def _export_onnx_int8(source, kwargs):
+    """로컬 모델 디렉토리에 동적 양자화된 int8 ONNX 모델을 만들어두는 함수"""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    if not os.path.isdir(source):
+        raise ValueError(
+            "onnx-int8 백엔드는 MAFM_MODEL_PATH에 로컬 모델 디렉토리를 지정해야 합니다."
+        )
+    print(f"int8 ONNX 모델을 만드는 중입니다: {source}")
+    fp32_model = SentenceTransformer(
+        source, backend="onnx", model_kwargs=_onnx_model_kwargs(), **kwargs
+    )
+    export_dynamic_quantized_onnx_model(
+        fp32_model, ONNX_QUANTIZATION, source, file_suffix=f"qint8_{ONNX_QUANTIZATION}"
+    )
+
+
+def load_model(backend=EMBED_BACKEND):
+    """backend에 맞는 임베딩 모델을 읽어서 반환하는 함수
+
+    - torch: PyTorch fp32 (기본값)
+    - torch-int8: PyTorch 모델의 Linear 층을 동적 양자화한 int8 (추가 의존성 없음)
+    - onnx: ONNX Runtime fp32 (optimum, onnxruntime 필요)
+    - onnx-int8: 동적 양자화된 ONNX 모델 (없으면 로컬 모델 디렉토리에 만들어서 사용)
+    """
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"unknown embedding backend: {backend}")
+
+    if EMBED_THREADS > 0:
+        torch.set_num_threads(EMBED_THREADS)
+
+    source, local_files_only = _model_source()
+    kwargs = {
+        "trust_remote_code": True,
+        "device": "cpu",
+        "local_files_only": local_files_only,
+        "config_kwargs": {
+            "use_memory_efficient_attention": False,
+            "unpad_inputs": False,
+        },
+    }
+
+    if backend.startswith("onnx"):
+        _require_onnx()
+    if backend == "onnx":
+        return SentenceTransformer(
+            source, backend="onnx", model_kwargs=_onnx_model_kwargs(), **kwargs
+        )
+    if backend == "onnx-int8":
+        file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+        if os.path.isdir(source) and not os.path.exists(
+            os.path.join(source, file_name)
+        ):
+            _export_onnx_int8(source, kwargs)
+        return SentenceTransformer(
+            source,
+            backend="onnx",
+            model_kwargs=_onnx_model_kwargs(file_name),
+            **kwargs,
+        )
+
+    loaded = SentenceTransformer(source, **kwargs)
+    if backend == "torch-int8":
+        loaded = torch.ao.quantization.quantize_dynamic(
+            loaded, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return loaded
+
 
 def initialize_model():
+    """임베딩 모델을 읽는 함수
 
-    global model
+    EMBED_BACKEND 모델을 읽지 못하면 (패키지 없음, int8 변환 실패, 모델 파일 없음 등)
+    torch로 대신 실행한다. torch 모델도 읽지 못하면 RuntimeError를 낸다
+    (모델 없이 모든 임베딩이 None이 된 채로 계속 실행되지 않도록).
+    """
+    global model, model_backend
     if model is None:
+        # 일단 1024 차원으로 실험
+        # 실험 결과가 만족스럽지 않다면 모델을 clone 한 후 8000 차원 이상으로 늘릴 예정
+        # 모델은 github에 등록되어 있음
+        # CPU로 실험
+        # GPU로 변환 시 SentenceTransformer() 메소드 뒤에 .cuda() 메소드를 붙여주면 됨
+        # 모델 초기화
+        backend = EMBED_BACKEND
         try:
+            loaded = load_model(backend)
+        except Exception as e:
+            if backend == "torch":
+                raise RuntimeError(f"임베딩 모델을 읽을 수 없습니다: {e}") from e
+            print(f"{backend} 백엔드를 쓸 수 없어 torch로 실행합니다: {e}")
+            backend = "torch"
+            try:
+                loaded = load_model(backend)
+            except Exception as e:
+                raise RuntimeError(f"임베딩 모델을 읽을 수 없습니다: {e}") from e
+        model, model_backend = loaded, backend
+        print(f"모델이 성공적으로 초기화되었습니다. (backend={model_backend})")
 
-            # 일단 1024 차원으로 실험
-            # 실험 결과가 만족스럽지 않다면 모델을 clone 한 후 8000 차원 이상으로 늘릴 예정
-            # 모델은 github에 등록되어 있음
-            # CPU로 실험
-            # GPU로 변환 시 SentenceTransformer() 메소드 뒤에 .cuda() 메소드를 붙여주면 됨
-            # 모델 초기화
-            model = SentenceTransformer(
-                # "dunzhang/stella_en_400M_v5",
-                "avsolatorio/GIST-small-Embedding-v0",  # 33
-                # "hkunlp/instructor-base",  # 110
-                trust_remote_code=True,
-                device="cpu",
-                config_kwargs={
-                    "use_memory_efficient_attention": False,
-                    "unpad_inputs": False,
-                },
-            )
 
-            # model = SentenceTransformer("sentence-transformers/all-MiniLM-L12-v1")
+def get_tokenizer():
+    """임베딩 모델의 토크나이저를 반환하는 함수 (읽을 수 없으면 None)
+
+    모델 객체의 토크나이저는 encode()가 truncation 설정을 바꾸며 쓰므로 공유하지 않고,
+    토크나이저만 따로 읽는다 (모델을 읽지 않은 텍스트 추출 프로세스에서도 쓸 수 있다).
+    """
+    global tokenizer, _tokenizer_failed
+    with _tokenizer_lock:
+        if tokenizer is None and not _tokenizer_failed:
+            try:
+                from transformers import AutoTokenizer
+
+                source, local_files_only = _model_source()
+                tokenizer = AutoTokenizer.from_pretrained(
+                    source, local_files_only=local_files_only, use_fast=True
+                )
+            except Exception as e:
+                print(f"토크나이저를 읽을 수 없어 근사 토큰 수로 청크를 나눕니다: {e}")
+                _tokenizer_failed = True
+        return tokenizer
+
+
+def get_model_id(backend=None):
+    """저장된 벡터가 어떤 모델로 만들어졌는지 구분하기 위한 id
+
+    fp32 백엔드(torch, onnx)는 같은 벡터를 만들므로 id를 공유하고, int8 백엔드는
+    벡터가 조금씩 달라지므로 id를 따로 두어 백엔드를 바꾸면 다시 임베딩되게 한다.
+    backend를 주지 않으면 실제로 읽힌 모델의 백엔드를 쓴다. EMBED_BACKEND를 읽지 못하면
+    torch로 대신 실행하므로, 설정값이 아니라 읽힌 모델을 보려고 모델을 먼저 읽는다.
+    """
+    if backend is None:
+        if model is None:
+            initialize_model()
+        backend = model_backend
+    if backend.endswith("-int8"):
+        return f"{MODEL_NAME}+{backend}"
+    return MODEL_NAME
+
+
+def get_embedding_cache():
+    """임베딩 캐시를 반환하는 함수 (비활성화되었거나 열 수 없으면 None)"""
+    global embedding_cache, _embedding_cache_failed
+    if embedding_cache is None and not _embedding_cache_failed:
+        if EMBEDDING_CACHE_SIZE <= 0:
+            _embedding_cache_failed = True
+            return None
+        try:
+            embedding_cache = EmbeddingCache()
+        except Exception as e:
+            print(f"임베딩 캐시를 열 수 없어 캐시 없이 진행합니다: {e}")
+            _embedding_cache_failed = True
+    return embedding_cache
+
+
+def get_cache_stats():
+    """임베딩 캐시의 항목 수와 hit/miss 통계를 반환하는 함수"""
+    cache = get_embedding_cache()
+    return cache.stats() if cache is not None else None
+
 
-            print("모델이 성공적으로 초기화되었습니다.")
+def get_query_cache():
+    """질의 임베딩 캐시를 반환하는 함수 (비활성화되었거나 열 수 없으면 None)"""
+    global query_cache, _query_cache_failed
+    if query_cache is None and not _query_cache_failed:
+        if QUERY_CACHE_SIZE <= 0:
+            _query_cache_failed = True
+            return None
+        try:
+            query_cache = QueryEmbeddingCache()
         except Exception as e:
-            print(f"모델 초기화 중 오류 발생: {e}")
+            print(f"질의 임베딩 캐시를 열 수 없어 캐시 없이 진행합니다: {e}")
+            _query_cache_failed = True
+    return query_cache
+
+
+def get_query_cache_stats():
+    """질의 임베딩 캐시의 항목 수와 hit/miss 통계를 반환하는 함수"""
+    cache = get_query_cache()
+    return cache.stats() if cache is not None else None
 
 
-def embedding(queries):
+def _encode(queries, batch_size):
     global model
 
     # 모델이 초기화되지 않은 경우 초기화
     if model is None:
         initialize_model()
 
+    query_embeddings = model.encode(queries, batch_size=batch_size)
+    return query_embeddings.tolist()
+
+
+def embedding(queries, batch_size=32):
     try:
         # 쿼리 임베딩
         if not isinstance(queries, list) or not all(
             isinstance(q, str) for q in queries
         ):
             raise ValueError("The input to encode() must be a list of strings.")
-        query_embeddings = model.encode(queries)
 
-        return query_embeddings.tolist()
+        cache = get_embedding_cache()
+        if cache is None:
+            return _encode(queries, batch_size)
+
+        # 캐시에 없는 텍스트만 (중복을 제거해서) encode
+        model_id = get_model_id()
+        keys = [EmbeddingCache.make_key(model_id, q) for q in queries]
+        found = cache.get_many(keys)
+        missing = {}
+        for key, q in zip(keys, queries):
+            if key not in found and key not in missing:
+                missing[key] = q
+        if missing:
+            vectors = _encode(list(missing.values()), batch_size)
+            new_items = list(zip(missing.keys(), vectors))
+            cache.put_many(new_items)
+            found.update(new_items)
+
+        return [found[key] for key in keys]
     except MemoryError as me:
         print(f"MemoryError: {me}")
     except Exception as e:
         print(f"embedding 중 오z류 발생: {e}")
         return None
+
+
+def embed_queries(queries):
+    """검색 질의를 임베딩하는 함수
+
+    문서 청크와 달리 질의는 짧고 자주 반복되므로 질의 LRU 캐시를 사용하고,
+    캐시에 있는 질의는 모델을 거치지 않는다.
+    캐시를 쓰든 쓰지 않든 정규화한 질의를 임베딩해서, 캐시 설정에 따라 검색 결과가 달라지지 않게 한다.
+    """
+    try:
+        if not isinstance(queries, list) or not all(
+            isinstance(q, str) for q in queries
+        ):
+            raise ValueError("The input to encode() must be a list of strings.")
+
+        cache = get_query_cache()
+        if cache is None:
+            return _encode([QueryEmbeddingCache.normalize(q) for q in queries], 32)
+
+        model_id = get_model_id()
+        keys = [QueryEmbeddingCache.make_key(model_id, q) for q in queries]
+        found = {}
+        missing = {}
+        for key, q in zip(keys, queries):
+            if key in found or key in missing:
+                continue
+            vector = cache.get(key)
+            if vector is None:
+                missing[key] = QueryEmbeddingCache.normalize(q)
+            else:
+                found[key] = vector
+        if missing:
+            vectors = _encode(list(missing.values()), 32)
+            for key, vector in zip(missing.keys(), vectors):
+                cache.put(key, vector)
+                found[key] = vector
+
+        return [found[key] for key in keys]
+    except MemoryError as me:
+        print(f"MemoryError: {me}")
+    except Exception as e:
+        print(f"질의 embedding 중 오류 발생: {e}")
+        return None
+
+
+def estimate_tokens(text):
+    """토크나이저를 거치지 않고 토큰 수를 대략 추정하는 함수 (UTF-8 4바이트당 1토큰)"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+class BatchEmbedder:
+    """여러 파일의 청크를 모아 한 번에 임베딩하는 클래스
+
+    add()로 (key, 청크 목록)을 쌓아두다가 청크 수가 batch_size에 도달하거나
+    추정 토큰 수가 token_budget을 넘으면 모아둔 청크를 한 번에 encode하고,
+    결과를 [(key, 청크 목록, 벡터 목록), ...] 형태로 sink에 넘긴다.
+    배치 임베딩이 실패하면 파일마다 다시 시도하고, 그래도 실패한 파일은 벡터 목록 자리에
+    None을 넣어 넘긴다 (sink가 색인되지 않은 파일로 기록할 수 있도록).
+    """
+
+    def __init__(self, sink, batch_size=EMBED_BATCH_SIZE, token_budget=EMBED_TOKEN_BUDGET):
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.token_budget = max(1, token_budget)
+        self._pending = []
+        self._pending_chunks = 0
+        self._pending_tokens = 0
+
+        # 처리량 측정용 통계
+        self.total_files = 0
+        self.failed_files = 0
+        self.total_chunks = 0
+        self.total_batches = 0
+        self.encode_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    def add(self, key, chunks):
+        tokens = sum(estimate_tokens(chunk) for chunk in chunks)
+        if self._pending and (
+            self._pending_chunks + len(chunks) > self.batch_size
+            or self._pending_tokens + tokens > self.token_budget
+        ):
+            self.flush()
+
+        self._pending.append((key, chunks))
+        self._pending_chunks += len(chunks)
+        self._pending_tokens += tokens
+
+        if (
+            self._pending_chunks >= self.batch_size
+            or self._pending_tokens >= self.token_budget
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        pending = self._pending
+        self._pending = []
+        self._pending_chunks = 0
+        self._pending_tokens = 0
+
+        texts = [chunk for _, chunks in pending for chunk in chunks]
+        vectors = self._encode(texts)
+        if vectors is None:
+            # 한 파일의 청크 때문에 배치 전체를 잃지 않도록 파일마다 다시 시도한다
+            print(f"{len(pending)}개 파일의 배치 임베딩에 실패하여 파일마다 다시 시도합니다.")
+            results = [(key, chunks, self._encode(chunks)) for key, chunks in pending]
+        else:
+            # 한 번에 계산한 벡터를 파일별로 다시 나눠서 전달
+            results = []
+            offset = 0
+            for key, chunks in pending:
+                results.append((key, chunks, vectors[offset : offset + len(chunks)]))
+                offset += len(chunks)
+
+        failed = sum(1 for _, _, file_vectors in results if file_vectors is None)
+        self.failed_files += failed
+        self.total_files += len(results) - failed
+        self.total_chunks += sum(
+            len(chunks) for _, chunks, file_vectors in results if file_vectors is not None
+        )
+        self.total_batches += 1
+        self.sink(results)
+
+    def _encode(self, texts):
+        """texts를 임베딩하는 함수 (실패하면 None)"""
+        if not texts:
+            return []
+        start = time.monotonic()
+        vectors = embedding(texts, batch_size=self.batch_size)
+        self.encode_seconds += time.monotonic() - start
+        return vectors
+
+    def chunks_per_second(self):
+        """encode에 걸린 시간 기준 초당 처리한 청크 수"""
+        if self.encode_seconds == 0:
+            return 0.0
+        return self.total_chunks / self.encode_seconds
+
+    def report(self):
+        elapsed = time.monotonic() - self.started_at
+        print(
+            f"임베딩 통계: 파일 {self.total_files}개 (실패 {self.failed_files}개), "
+            f"청크 {self.total_chunks}개, "
+            f"배치 {self.total_batches}개 (batch_size={self.batch_size}, "
+            f"token_budget={self.token_budget}), "
+            f"encode {self.chunks_per_second():.1f} chunks/sec, "
+            f"전체 {self.total_chunks / elapsed if elapsed else 0.0:.1f} chunks/sec"
+        )
+        cache_stats = get_cache_stats()
+        if cache_stats is not None:
+            print(
+                f"임베딩 캐시: 항목 {cache_stats['entries']}개, "
+                f"hit {cache_stats['hits']}, miss {cache_stats['misses']} "
+                f"(hit rate {cache_stats['hit_rate']:.1%})"
+            )
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+# 임베딩 캐시 파일 위치와 최대 항목 수 (0이면 캐시를 사용하지 않음)
+EMBEDDING_CACHE_PATH = os.path.expanduser(
+    os.getenv("MAFM_EMBEDDING_CACHE", "~/.mafm/embedding_cache.db")
+)
+EMBEDDING_CACHE_SIZE = int(os.getenv("MAFM_EMBEDDING_CACHE_SIZE", "100000"))
+
+# 질의 임베딩 캐시의 최대 항목 수 (0이면 사용하지 않음)와 저장 파일 위치 (비어 있으면 메모리에만 둔다)
+QUERY_CACHE_SIZE = int(os.getenv("MAFM_QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_PATH = os.path.expanduser(os.getenv("MAFM_QUERY_CACHE", ""))
+
+
+class EmbeddingCache:
+    """(모델 id, 청크 텍스트)의 해시를 키로 벡터를 저장하는 디스크 캐시
+
+    같은 내용의 청크(복사된 파일, 삭제 후 다시 만든 파일, 내용이 그대로인 수정 등)를
+    다시 encode하지 않도록 SQLite 파일에 float32 벡터를 저장한다.
+    항목 수가 max_entries를 넘으면 가장 오래 사용하지 않은 항목부터 지운다.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            )
+        """
+        )
+        self._connection.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used
+            ON embedding_cache (last_used)
+        """
+        )
+        self._connection.commit()
+
+        row = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM embedding_cache"
+        ).fetchone()
+        self._count = row[0]
+        # 사용 순서를 기록하기 위한 카운터 (시간 대신 사용해서 같은 시각의 순서도 구분)
+        self._clock = row[1]
+
+    @staticmethod
+    def make_key(model_id, text):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(model_id.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8", "surrogatepass"))
+        return digest.digest()
+
+    def get_many(self, keys):
+        """키 목록에 대해 캐시에 있는 벡터를 {키: 벡터} 형태로 반환하는 함수"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite 변수 개수 제한을 넘지 않도록 나눠서 조회
+            for i in range(0, len(unique_keys), 500):
+                part = unique_keys[i : i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embedding_cache "
+                    f"WHERE key IN ({', '.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                self._clock += 1
+                self._connection.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE key = ?",
+                    [(self._clock, key) for key in found],
+                )
+                self._connection.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """[(키, 벡터), ...]를 캐시에 저장하는 함수"""
+        if not items:
+            return
+        with self._lock:
+            self._clock += 1
+            before = self._connection.total_changes
+            self._connection.executemany(
+                """
+                INSERT OR IGNORE INTO embedding_cache (key, vector, last_used)
+                VALUES (?, ?, ?)
+                """,
+                [
+                    (key, array("f", vector).tobytes(), self._clock)
+                    for key, vector in items
+                ],
+            )
+            self._count += self._connection.total_changes - before
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        overflow = self._count - self.max_entries
+        if overflow <= 0:
+            return
+        # 매번 지우지 않도록 한도의 10%만큼 여유를 두고 지운다
+        overflow += self.max_entries // 10
+        self._connection.execute(
+            """
+            DELETE FROM embedding_cache WHERE key IN (
+                SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?
+            )
+            """,
+            (overflow,),
+        )
+        self._count = self._connection.execute(
+            "SELECT COUNT(*) FROM embedding_cache"
+        ).fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class QueryEmbeddingCache:
+    """검색 질의의 임베딩을 보관하는 메모리 LRU 캐시
+
+    한 번의 검색에서 여러 멤버 에이전트가 같은(또는 공백만 다른) 질의를 임베딩하고,
+    사용자도 같은 검색을 반복하므로 정규화한 질의 텍스트와 모델 id를 키로 벡터를 재사용한다.
+    문서 청크 캐시(EmbeddingCache)와는 분리되어 있으며, path를 주면 같은 형식의
+    SQLite 파일에 저장해서 다음 실행에서도 사용한다.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, path=QUERY_CACHE_PATH):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = EmbeddingCache(path, max_entries) if path else None
+
+    @staticmethod
+    def normalize(text):
+        """유니코드 정규화 후 앞뒤 공백을 없애고 연속된 공백을 하나로 합친 질의"""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    @staticmethod
+    def make_key(model_id, text):
+        return EmbeddingCache.make_key(model_id, QueryEmbeddingCache.normalize(text))
+
+    def get(self, key):
+        """캐시된 벡터를 반환하는 함수 (없으면 None)"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+        if self._store is not None:
+            vector = self._store.get_many([key]).get(key)
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, vector)
+        return vector
+
+    def put(self, key, vector):
+        with self._lock:
+            self._remember(key, vector)
+        if self._store is not None:
+            self._store.put_many([(key, vector)])
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
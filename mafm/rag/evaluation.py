@@ -0,0 +1,309 @@
+import os
+import time
+import numpy as np
+from .ann import choose_index
+from .chunker import chunk_text, max_chunk_tokens, token_spans
+from .embedding import EMBED_BACKENDS, embed_queries, get_tokenizer, load_model
+from .extractor import read_file
+from .sqlite import connection_manager
+
+
+def sample_chunks(sample_size, db_name="filesystem.db"):
+    """전문 검색 인덱스(file_chunk)에 저장된 청크 텍스트를 무작위로 sample_size개 가져오는 함수"""
+    with connection_manager.connect(db_name) as connection:
+        rows = connection.execute(
+            "SELECT content FROM file_chunk ORDER BY RANDOM() LIMIT ?",
+            (sample_size,),
+        ).fetchall()
+    return [content for (content,) in rows if content and content.strip()]
+
+
+def make_queries(chunks, query_words=8):
+    """각 청크의 앞부분 몇 단어를 검색 질의처럼 쓰는 함수"""
+    return [" ".join(chunk.split()[:query_words]) for chunk in chunks]
+
+
+def nearest_neighbors(query_vectors, corpus_vectors, k):
+    """질의마다 코사인 유사도가 높은 코퍼스 항목의 인덱스 k개를 반환하는 함수"""
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    corpus = np.asarray(corpus_vectors, dtype=np.float32)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_at_k(reference, candidate, k):
+    """기준(fp32) 결과의 상위 k개 중 후보 결과의 상위 k개에도 들어간 비율의 평균"""
+    if not len(reference):
+        return 0.0
+    total = 0.0
+    for expected, found in zip(reference, candidate):
+        expected = set(list(expected)[:k])
+        if expected:
+            total += len(expected & set(list(found)[:k])) / len(expected)
+    return total / len(reference)
+
+
+def _encode_with(backend, chunks, queries, batch_size):
+    """backend 모델로 코퍼스와 질의를 임베딩하고 (코퍼스 벡터, 질의 벡터, 초당 청크 수)를 반환"""
+    model = load_model(backend)
+    model.encode(chunks[:batch_size], batch_size=batch_size)  # 워밍업
+    start = time.monotonic()
+    corpus_vectors = model.encode(chunks, batch_size=batch_size)
+    elapsed = time.monotonic() - start
+    query_vectors = model.encode(queries, batch_size=batch_size)
+    return corpus_vectors, query_vectors, len(chunks) / elapsed if elapsed else 0.0
+
+
+def evaluate_backends(
+    backends,
+    sample_size=500,
+    k=10,
+    query_words=8,
+    batch_size=32,
+    db_name="filesystem.db",
+):
+    """색인된 청크로 각 백엔드의 recall@k(fp32 torch 기준)와 처리량을 비교하는 함수
+
+    반환: {백엔드: {"recall": recall@k, "chunks_per_sec": 초당 청크 수}}
+    """
+    chunks = sample_chunks(sample_size, db_name)
+    if not chunks:
+        print("평가할 청크가 없습니다. 먼저 파일을 색인하세요.")
+        return {}
+    queries = make_queries(chunks, query_words)
+
+    corpus_vectors, query_vectors, speed = _encode_with(
+        "torch", chunks, queries, batch_size
+    )
+    reference = nearest_neighbors(query_vectors, corpus_vectors, k)
+    results = {"torch": {"recall": 1.0, "chunks_per_sec": speed}}
+
+    for backend in backends:
+        if backend == "torch":
+            continue
+        try:
+            corpus_vectors, query_vectors, speed = _encode_with(
+                backend, chunks, queries, batch_size
+            )
+        except Exception as e:
+            print(f"{backend} 백엔드를 평가할 수 없습니다: {e}")
+            continue
+        # 질의와 코퍼스 모두 후보 백엔드로 임베딩한 결과를 fp32 결과와 비교
+        candidate = nearest_neighbors(query_vectors, corpus_vectors, k)
+        results[backend] = {
+            "recall": recall_at_k(reference, candidate, k),
+            "chunks_per_sec": speed,
+        }
+    return results
+
+
+def _timed_search(store, location, query_vectors, k, search_params):
+    """질의를 하나씩 검색해서 (질의별 상위 k개 id, 질의별 지연 시간(ms))을 반환하는 함수"""
+    found, latencies = [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        hits = store.search(location, [vector], k, search_params=search_params)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append([id for id, _ in hits])
+    return found, latencies
+
+
+def index_report(
+    location,
+    probes=(1, 2, 4, 8, 16, 32, 64),
+    sample_size=200,
+    k=10,
+    query_words=8,
+    build=None,
+    store=None,
+    db_name="filesystem.db",
+):
+    """벡터 저장 위치(location)의 ANN 인덱스를 전수 검색과 비교하는 함수
+
+    색인된 청크로 만든 질의를 전수 검색({"exact": True})한 결과를 기준으로, IVF의 검색
+    파라미터(nprobe)마다 recall@k와 질의당 지연 시간을 잰다.
+    build가 "ivf"이면 먼저 그 인덱스를 만든다.
+    반환: [{"params": 검색 파라미터, "recall": recall@k, "mean_ms": 평균, "p95_ms": p95}, ...]
+    (첫 항목이 전수 검색)
+    """
+    if store is None:
+        from .vectorDb import vector_store as store
+
+    if build:
+        config = choose_index(
+            store.row_count(location), build, store.supported_indexes(location)
+        )
+        store.build_index(location, config)
+
+    chunks = sample_chunks(sample_size, db_name)
+    if not chunks:
+        print("평가할 청크가 없습니다. 먼저 파일을 색인하세요.")
+        return []
+    query_vectors = embed_queries(make_queries(chunks, query_words))
+
+    reference, latencies = _timed_search(
+        store, location, query_vectors, k, {"exact": True}
+    )
+    results = [
+        {
+            "params": {"exact": True},
+            "recall": 1.0,
+            "mean_ms": float(np.mean(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
+    ]
+
+    index = store.index_info(location)
+    if index is None:
+        print(f"{location}에 ANN 인덱스가 없어 전수 검색만 측정했습니다.")
+        return results
+    for nprobe in sorted({min(n, index["nlist"]) for n in probes}):
+        found, latencies = _timed_search(
+            store, location, query_vectors, k, {"nprobe": nprobe}
+        )
+        results.append(
+            {
+                "params": {"nprobe": nprobe},
+                "recall": recall_at_k(reference, found, k),
+                "mean_ms": float(np.mean(latencies)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+            }
+        )
+    return results
+
+
+def _legacy_chunks(file_path, text, size=500):
+    """예전 방식의 청크: 일반 텍스트는 500바이트, PDF/DOCX는 500글자씩 자른다"""
+    if file_path.endswith((".pdf", ".docx")):
+        return [text[i : i + size] for i in range(0, len(text), size)]
+    data = text.encode("utf-8")
+    return [
+        data[i : i + size].decode("utf-8", errors="replace")
+        for i in range(0, len(data), size)
+    ]
+
+
+def chunk_report(paths):
+    """파일들을 예전 방식(고정 크기)과 토큰 기준 청크로 나눠 MB당 청크 수를 비교하는 함수
+
+    paths: 파일 또는 디렉토리 경로 목록
+    반환: {"files", "megabytes", 방식("legacy", "tokens")마다
+           {"chunks": 청크 수, "per_mb": MB당 청크 수, "mean_tokens": 청크당 평균 토큰 수,
+            "truncated": 모델 입력 길이를 넘어 잘리는 청크 수}}
+    """
+    tokenizer = get_tokenizer()
+    limit = max_chunk_tokens(tokenizer, max_tokens=1 << 30)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                files.extend(os.path.join(dirpath, name) for name in filenames)
+        else:
+            files.append(path)
+
+    total_bytes = 0
+    counts = {"legacy": [], "tokens": []}
+    for file_path in files:
+        try:
+            text = read_file(file_path)
+        except Exception as e:
+            print(f"{file_path}을(를) 읽을 수 없습니다: {e}")
+            continue
+        if not text.strip():
+            continue
+        total_bytes += len(text.encode("utf-8"))
+        for method, chunks in (
+            ("legacy", _legacy_chunks(file_path, text)),
+            ("tokens", chunk_text(text, tokenizer=tokenizer)),
+        ):
+            counts[method].extend(len(token_spans(chunk, tokenizer)) for chunk in chunks)
+
+    megabytes = total_bytes / (1 << 20)
+    report = {"files": len(files), "megabytes": megabytes}
+    for method, tokens in counts.items():
+        report[method] = {
+            "chunks": len(tokens),
+            "per_mb": len(tokens) / megabytes if megabytes else 0.0,
+            "mean_tokens": float(np.mean(tokens)) if tokens else 0.0,
+            "truncated": sum(count > limit for count in tokens),
+        }
+    return report
+
+
+import argparse
+
+if __name__ == "__main__":
+    # mafm 디렉토리에서 python -m rag.evaluation으로 실행
+    parser = argparse.ArgumentParser(description="MAFM retrieval quality checks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backends_parser = subparsers.add_parser(
+        "backends", help="Compare embedding backends against the fp32 baseline"
+    )
+    backends_parser.add_argument(
+        "-b",
+        "--backends",
+        nargs="+",
+        default=[backend for backend in EMBED_BACKENDS if backend != "torch"],
+        choices=EMBED_BACKENDS,
+    )
+    backends_parser.add_argument("-n", "--samples", type=int, default=500)
+
+    index_parser = subparsers.add_parser(
+        "index", help="Compare the ANN index of a vector store against exact search"
+    )
+    index_parser.add_argument("location", help="vector store path (e.g. dir/dir.db)")
+    index_parser.add_argument(
+        "-p", "--probes", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    index_parser.add_argument("-n", "--samples", type=int, default=200)
+    index_parser.add_argument("--build", choices=["ivf"])
+
+    chunks_parser = subparsers.add_parser(
+        "chunks", help="Compare fixed-size and token-aware chunking (chunks per MB)"
+    )
+    chunks_parser.add_argument("paths", nargs="+", help="files or directories")
+
+    for sub in (backends_parser, index_parser):
+        sub.add_argument("-k", type=int, default=10)
+        sub.add_argument("--db", default="filesystem.db")
+    args = parser.parse_args()
+
+    if args.command == "backends":
+        results = evaluate_backends(args.backends, args.samples, args.k, db_name=args.db)
+        baseline = results.get("torch", {}).get("chunks_per_sec") or 0.0
+        for backend, result in results.items():
+            speedup = result["chunks_per_sec"] / baseline if baseline else 0.0
+            print(
+                f"{backend:<11} recall@{args.k} {result['recall']:.3f}  "
+                f"{result['chunks_per_sec']:.1f} chunks/sec ({speedup:.2f}x)"
+            )
+    elif args.command == "chunks":
+        report = chunk_report(args.paths)
+        print(f"파일 {report['files']}개, 텍스트 {report['megabytes']:.2f} MB")
+        for method in ("legacy", "tokens"):
+            result = report[method]
+            print(
+                f"{method:<7} {result['chunks']} chunks  {result['per_mb']:.1f} chunks/MB  "
+                f"평균 {result['mean_tokens']:.1f} 토큰  잘리는 청크 {result['truncated']}개"
+            )
+    else:
+        results = index_report(
+            args.location,
+            args.probes,
+            args.samples,
+            args.k,
+            build=args.build,
+            db_name=args.db,
+        )
+        for result in results:
+            params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+            print(
+                f"{params:<12} recall@{args.k} {result['recall']:.3f}  "
+                f"mean {result['mean_ms']:.2f} ms  p95 {result['p95_ms']:.2f} ms"
+            )
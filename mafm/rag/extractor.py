@@ -0,0 +1,195 @@
+import codecs
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+from docx import Document
+from .chunker import chunk_stream
+
+# 텍스트를 추출하지 않는 미디어 파일 확장자 (C 라이브러리의 is_image_or_video와 같은 목록)
+MEDIA_EXTENSIONS = (".jpg", ".png", ".mp4", ".avi", ".mp3")
+
+# 파일 앞부분의 이 크기 안에 NUL 바이트가 있으면 바이너리 파일로 보고 건너뛴다
+BINARY_CHECK_SIZE = 8192
+
+# 일반 텍스트 파일을 한 번에 읽는 크기
+TEXT_BLOCK_SIZE = 1 << 20
+
+# 문서 하나에서 추출할 최대 페이지 수와 최대 텍스트 크기(UTF-8 바이트). 넘는 부분은 버린다
+MAX_PAGES = int(os.getenv("MAFM_MAX_PAGES", "2000"))
+MAX_TEXT_BYTES = int(os.getenv("MAFM_MAX_TEXT_BYTES", str(32 << 20)))
+
+# 이보다 페이지가 많은 PDF는 PDF_RANGE_PAGES 페이지씩 나눠 PDF_WORKERS개 프로세스에서 추출한다
+# (색인 파이프라인의 추출 프로세스 안에서는 이미 파일 단위로 병렬이므로 나누지 않는다)
+PDF_PARALLEL_PAGES = int(os.getenv("MAFM_PDF_PARALLEL_PAGES", "64"))
+PDF_RANGE_PAGES = max(1, int(os.getenv("MAFM_PDF_RANGE_PAGES", "16")))
+PDF_WORKERS = int(os.getenv("MAFM_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# 페이지 범위 추출용 프로세스 풀 (처음 사용할 때 만든다)
+_pdf_pool = None
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        # 감시 스레드 등이 돌고 있는 프로세스를 fork하지 않도록 spawn으로 띄운다
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_pool
+
+
+def _page_text(page):
+    text = page.extract_text() or ""  # 글자가 없는 (스캔한) 페이지는 None을 반환한다
+    page.close()  # 페이지의 파싱 결과를 캐시에서 비운다
+    return text + "\n"
+
+
+def read_pdf_pages(file_path, start, stop):
+    """PDF의 [start, stop) 페이지 텍스트 목록을 반환하는 함수 (페이지 범위 작업)"""
+    with pdfplumber.open(file_path, pages=range(start + 1, stop + 1)) as pdf:
+        return [_page_text(page) for page in pdf.pages]
+
+
+def iter_pdf(file_path, max_pages=MAX_PAGES):
+    """PDF 파일의 텍스트를 페이지마다 내보내는 generator"""
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+        if page_count > max_pages:
+            print(f"{file_path}: {page_count}쪽 중 앞의 {max_pages}쪽만 추출합니다.")
+            page_count = max_pages
+
+        parallel = (
+            page_count > PDF_PARALLEL_PAGES
+            and PDF_WORKERS > 1
+            and multiprocessing.parent_process() is None
+        )
+        if not parallel:
+            for page in pdf.pages[:page_count]:
+                yield _page_text(page)
+            return
+
+    # 페이지 범위를 순서대로 제출하되, 처리 중인 범위는 워커 수의 두 배까지만 둔다
+    pool = _get_pdf_pool()
+    ranges = deque(
+        (start, min(start + PDF_RANGE_PAGES, page_count))
+        for start in range(0, page_count, PDF_RANGE_PAGES)
+    )
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < PDF_WORKERS * 2:
+                pending.append(pool.submit(read_pdf_pages, file_path, *ranges.popleft()))
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_word(file_path):
+    """Word 파일의 텍스트를 문단마다 내보내는 generator"""
+    doc = Document(file_path)
+    for paragraph in doc.paragraphs:
+        yield paragraph.text + "\n"
+
+
+def _read_blocks(file_path, block_size):
+    """파일 내용을 block_size 바이트씩 내보내는 generator
+
+    버퍼 하나에 차례로 읽어(readinto) 그 조각(memoryview)을 내보내므로 블록마다 새로
+    할당하지 않는다. 조각은 다음 조각을 요청하기 전까지만 유효하다.
+    감시 중인 파일은 읽는 도중 잘리거나 다시 쓰일 수 있으므로 mmap하지 않는다
+    (매핑한 파일이 잘리면 그 부분을 읽을 때 프로세스가 SIGBUS로 죽는다).
+    """
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                return
+            block = view[:size]
+            try:
+                yield block
+            finally:
+                block.release()
+
+
+def iter_text(file_path, block_size=TEXT_BLOCK_SIZE):
+    """일반 텍스트 파일을 블록 단위로 UTF-8 디코딩해서 내보내는 generator
+
+    블록 경계에 걸친 여러 바이트 글자는 다음 블록과 이어서 디코딩한다.
+    (UTF-8이 아닌 바이트는 U+FFFD로 바꾼다)
+    미디어 파일과 바이너리 파일은 아무것도 내보내지 않는다.
+    """
+    if file_path.lower().endswith(MEDIA_EXTENSIONS):
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    blocks = _read_blocks(file_path, block_size)
+    try:
+        for i, block in enumerate(blocks):
+            if i == 0 and b"\0" in bytes(block[:BINARY_CHECK_SIZE]):
+                return
+            yield decoder.decode(block)
+    finally:
+        blocks.close()
+    yield decoder.decode(b"", final=True)
+
+
+def iter_file_text(file_path, max_bytes=MAX_TEXT_BYTES):
+    """파일 형식에 따라 텍스트를 블록(페이지, 문단) 단위로 내보내는 generator
+
+    내보낸 텍스트가 max_bytes(UTF-8 기준)를 넘으면 거기서 멈춘다.
+    """
+    if file_path.endswith(".pdf"):
+        blocks = iter_pdf(file_path)
+    elif file_path.endswith(".docx"):
+        blocks = iter_word(file_path)
+    else:
+        # 일반 텍스트 파일일 경우
+        blocks = iter_text(file_path)
+
+    remaining = max_bytes
+    try:
+        for block in blocks:
+            size = len(block.encode("utf-8"))
+            if size > remaining:
+                # 글자 중간에서 자르지 않도록 바이트로 자른 뒤 잘린 글자는 버린다
+                yield block.encode("utf-8")[:remaining].decode("utf-8", errors="ignore")
+                print(f"{file_path}: 텍스트가 {max_bytes}바이트를 넘어 뒷부분은 추출하지 않습니다.")
+                return
+            remaining -= size
+            yield block
+    finally:
+        blocks.close()
+
+
+def read_file(file_path):
+    """파일 형식에 따라 텍스트 전체를 읽는 함수"""
+    return "".join(iter_file_text(file_path))
+
+
+def read_pdf(file_path):
+    """PDF 파일을 읽어서 텍스트로 변환하는 함수"""
+    return "".join(iter_pdf(file_path))
+
+
+def read_word(file_path):
+    """Word 파일을 읽어서 텍스트로 변환하는 함수"""
+    return "".join(iter_word(file_path))
+
+
+def read_text(file_path):
+    """일반 텍스트 파일을 읽어서 텍스트로 변환하는 함수 (미디어/바이너리 파일은 빈 문자열)"""
+    return "".join(iter_text(file_path))
+
+
+def iter_text_chunks(file_path):
+    """파일을 블록 단위로 읽으면서 토큰 수 기준의 청크를 차례로 내보내는 generator"""
+    return chunk_stream(iter_file_text(file_path))
+
+
+def extract_text_chunks(file_path):
+    """파일 형식에 따라 데이터를 읽고 토큰 수 기준의 청크 배열로 분할하는 함수 (rag/chunker.py)"""
+    return list(iter_text_chunks(file_path))
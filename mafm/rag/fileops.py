@@ -1,6 +1,11 @@
 import ctypes
+import os
+from collections import namedtuple
 
-lib = ctypes.CDLL("./rag/C_library/libfileops.so")
+# 실행 위치와 상관없이 이 파일 옆의 C_library에서 공유 라이브러리를 읽는다
+lib = ctypes.CDLL(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "C_library", "libfileops.so")
+)
 
 lib.make_soft_links.argtypes = [
     ctypes.POINTER(ctypes.c_char_p),
@@ -18,22 +23,144 @@ def make_soft_links(paths, temp_dir):
     return result.decode("utf-8")
 
 
-lib.get_file_data.argtypes = [ctypes.c_char_p]
-lib.get_file_data.restype = ctypes.POINTER(ctypes.c_char_p)
+lib.utf8_chunk_offsets.argtypes = [
+    ctypes.c_void_p,
+    ctypes.c_size_t,
+    ctypes.c_size_t,
+    ctypes.POINTER(ctypes.c_size_t),
+    ctypes.c_size_t,
+]
+lib.utf8_chunk_offsets.restype = ctypes.c_size_t
+lib.is_image_or_video.argtypes = [ctypes.c_char_p]
+lib.is_image_or_video.restype = ctypes.c_int
+
+
+def utf8_chunk_offsets(data, chunk_size):
+    """버퍼(bytes, bytearray 등)를 UTF-8 글자를 자르지 않는 chunk_size 바이트 이하 조각으로 나눈 경계 목록 (0과 끝 포함)"""
+    size = len(data)
+    if not size:
+        return [0]
+    if isinstance(data, bytes):
+        address = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+    else:
+        address = ctypes.addressof((ctypes.c_char * size).from_buffer(data))
+    count = lib.utf8_chunk_offsets(address, size, chunk_size, None, 0)
+    offsets = (ctypes.c_size_t * (count + 1))()
+    lib.utf8_chunk_offsets(address, size, chunk_size, offsets, count + 1)
+    return list(offsets)
 
 
-def get_file_data(path):
-    result = lib.get_file_data(path.encode("utf-8"))
-    data_list = []
-    idx = 0
+def get_file_data(path, chunk_size=500):
+    """[파일 경로, 파일 이름, 내용 조각, ...]을 반환하는 함수
 
-    while result[idx] is not None:
-        string = ctypes.string_at(result[idx]).decode("utf-8")
-        data_list.append(string)
-        idx += 1
+    파일을 버퍼 하나에 읽어 UTF-8 글자를 자르지 않는 chunk_size 바이트 이하의 조각으로
+    나눈다 (읽는 도중 파일이 잘려도 안전하도록 mmap하지 않는다).
+    이미지/영상 파일은 경로와 이름만 반환한다.
+    """
+    data_list = [path, os.path.basename(path)]
+    if lib.is_image_or_video(path.encode("utf-8")):
+        return data_list
+    with open(path, "rb", buffering=0) as f:
+        buffer = bytearray(os.fstat(f.fileno()).st_size)
+        size = f.readinto(buffer)  # 그 사이 파일이 줄었으면 읽은 만큼만 쓴다
+    view = memoryview(buffer)[:size]
+    offsets = utf8_chunk_offsets(view, chunk_size)
+    for start, end in zip(offsets, offsets[1:]):
+        data_list.append(str(view[start:end], "utf-8", errors="replace"))
     return data_list
 
 
+# scan_tree가 내보내는 항목 종류 (fileops.h의 SCAN_*)
+SCAN_FILE, SCAN_DIR, SCAN_LINK_FILE, SCAN_LINK_DIR, SCAN_OTHER = range(5)
+
+
+class _ScanBatch(ctypes.Structure):
+    _fields_ = [
+        ("count", ctypes.c_size_t),
+        ("paths", ctypes.c_void_p),
+        ("paths_size", ctypes.c_size_t),
+        ("path_offsets", ctypes.POINTER(ctypes.c_size_t)),
+        ("sizes", ctypes.POINTER(ctypes.c_int64)),
+        ("mtimes_ns", ctypes.POINTER(ctypes.c_int64)),
+        ("inodes", ctypes.POINTER(ctypes.c_uint64)),
+        ("types", ctypes.POINTER(ctypes.c_ubyte)),
+    ]
+
+
+lib.scan_open.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t]
+lib.scan_open.restype = ctypes.c_void_p
+lib.scan_next.argtypes = [ctypes.c_void_p]
+lib.scan_next.restype = ctypes.POINTER(_ScanBatch)
+lib.scan_free_batch.argtypes = [ctypes.POINTER(_ScanBatch)]
+lib.scan_free_batch.restype = None
+lib.scan_close.argtypes = [ctypes.c_void_p]
+lib.scan_close.restype = None
+
+
+class ScanEntry(namedtuple("ScanEntry", "path type size mtime_ns inode")):
+    """scan_tree가 내보내는 항목 (링크는 대상 파일/디렉토리의 크기와 수정 시각)"""
+
+    __slots__ = ()
+
+    @property
+    def is_dir(self):
+        return self.type in (SCAN_DIR, SCAN_LINK_DIR)
+
+    @property
+    def is_file(self):
+        return self.type in (SCAN_FILE, SCAN_LINK_FILE)
+
+    @property
+    def mtime(self):
+        """os.stat()의 st_mtime과 같은 값 (초 단위 float)"""
+        seconds, nanoseconds = divmod(self.mtime_ns, 1_000_000_000)
+        return seconds + nanoseconds * 1e-9
+
+
+def scan_tree(root, threads=4, prune_suffix=None, batch_size=4096):
+    """root 아래의 모든 항목을 C 라이브러리의 스레드 풀로 탐색해 묶음(ScanEntry 목록)으로 내보내는 generator
+
+    파일 내용은 읽지 않고 경로, 종류, 크기, 수정 시각, inode만 모은다. 디렉토리는 항상
+    그 안의 항목보다 먼저 나오고, 그 밖의 순서는 정해져 있지 않다. 깊이와 경로 길이에
+    제한이 없고, 링크된 디렉토리 안으로는 들어가지 않는다 (os.walk와 같음).
+    이름이 prune_suffix로 끝나는 디렉토리는 내보내지도 들어가지도 않는다.
+    """
+    handle = lib.scan_open(
+        os.fsencode(root),
+        threads,
+        os.fsencode(prune_suffix) if prune_suffix else None,
+        batch_size,
+    )
+    if not handle:
+        raise OSError(f"Failed to scan directory: {root}")
+    try:
+        while True:
+            result = lib.scan_next(handle)
+            if not result:
+                return
+            try:
+                batch = result.contents
+                count = batch.count
+                paths = ctypes.string_at(batch.paths, batch.paths_size).split(b"\0")
+                entries = list(
+                    map(
+                        ScanEntry._make,
+                        zip(
+                            map(os.fsdecode, paths[:count]),
+                            batch.types[:count],
+                            batch.sizes[:count],
+                            batch.mtimes_ns[:count],
+                            batch.inodes[:count],
+                        ),
+                    )
+                )
+            finally:
+                lib.scan_free_batch(result)
+            yield entries
+    finally:
+        lib.scan_close(handle)
+
+
 lib.get_all_file_data.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_int)]
 lib.get_all_file_data.restype = ctypes.POINTER(ctypes.POINTER(ctypes.c_char_p))
 
@@ -0,0 +1,170 @@
+import json
+import mimetypes
+import os
+import re
+import time
+from datetime import datetime
+
+_SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+_AGE_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+_CONDITION = re.compile(r"^(ext|mime|size|modified)\s*(=|<=|>=|<|>)\s*(.+)$")
+
+
+def describe_file(file_path, size, mtime):
+    """색인할 때 파일마다 저장하는 메타데이터 (벡터 행의 스칼라 필드와 file_metadata 테이블에 같이 저장)"""
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    mime_type = mimetypes.guess_type(file_path, strict=False)[0] or ""
+    return {
+        "extension": extension,
+        "mime_type": mime_type,
+        "size": int(size),
+        "mtime": float(mtime),
+    }
+
+
+def _parse_size(value):
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([BKMG]?)B?", value.strip().upper())
+    if match is None:
+        raise ValueError(f"invalid size: {value}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def _parse_time(value, now):
+    """'7d', '12h' 같은 기간(현재로부터 얼마 전) 또는 'YYYY-MM-DD' 날짜를 시각(초)으로 바꾸는 함수"""
+    value = value.strip()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([mhdw])", value)
+    if match is not None:
+        return now - float(match.group(1)) * _AGE_UNITS[match.group(2)]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"invalid time: {value}")
+
+
+class SearchFilter:
+    """검색할 파일을 메타데이터로 좁히는 조건
+
+    벡터 검색에서는 Milvus filter 식으로, 전문 검색에서는 SQL 조건으로 바뀌어
+    점수를 계산하기 전에 후보를 줄인다. 메타데이터가 없는 (이 기능 이전에 색인된) 파일은
+    조건이 있으면 검색되지 않는다.
+    - extensions: 확장자 목록 (점 없이, 소문자)
+    - mime_type: MIME 타입. "image/"처럼 "/"로 끝나면 접두어로 비교한다.
+    - min_size / max_size: 바이트 단위 크기 범위
+    - modified_after / modified_before: 수정 시각(초) 범위
+    """
+
+    def __init__(
+        self,
+        extensions=None,
+        mime_type=None,
+        min_size=None,
+        max_size=None,
+        modified_after=None,
+        modified_before=None,
+    ):
+        self.extensions = [ext.lstrip(".").lower() for ext in extensions or []]
+        self.mime_type = mime_type
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+
+    @classmethod
+    def parse(cls, conditions, now=None):
+        """'ext=pdf,docx', 'mime=image/', 'size<1M', 'modified>7d' 같은 조건 목록으로 필터를 만드는 함수
+
+        modified>7d는 '최근 7일 안에 수정된', modified<2024-01-01은 '그 날짜 전에 수정된'을 뜻한다.
+        """
+        now = time.time() if now is None else now
+        search_filter = cls()
+        for condition in conditions:
+            match = _CONDITION.match(condition.strip())
+            if match is None:
+                raise ValueError(f"invalid filter: {condition}")
+            key, op, value = match.groups()
+            if key == "ext" and op == "=":
+                search_filter.extensions += [
+                    ext.lstrip(".").lower() for ext in value.split(",") if ext
+                ]
+            elif key == "mime" and op == "=":
+                search_filter.mime_type = value.strip()
+            elif key == "size" and op in ("<", "<="):
+                search_filter.max_size = _parse_size(value)
+            elif key == "size" and op in (">", ">="):
+                search_filter.min_size = _parse_size(value)
+            elif key == "modified" and op in (">", ">="):
+                # 기간이면 "그 기간 안에", 날짜면 "그 날짜 이후"
+                search_filter.modified_after = _parse_time(value, now)
+            elif key == "modified" and op in ("<", "<="):
+                search_filter.modified_before = _parse_time(value, now)
+            else:
+                raise ValueError(f"invalid filter: {condition}")
+        return search_filter
+
+    def is_empty(self):
+        return not (
+            self.extensions
+            or self.mime_type
+            or self.min_size is not None
+            or self.max_size is not None
+            or self.modified_after is not None
+            or self.modified_before is not None
+        )
+
+    def to_expression(self):
+        """Milvus filter 식으로 바꾸는 함수 (조건이 없으면 빈 문자열)"""
+        terms = []
+        if self.extensions:
+            terms.append(f"extension in {json.dumps(self.extensions)}")
+        if self.mime_type:
+            if self.mime_type.endswith("/"):
+                terms.append(f"mime_type like {json.dumps(self.mime_type + '%')}")
+            else:
+                terms.append(f"mime_type == {json.dumps(self.mime_type)}")
+        if self.min_size is not None:
+            terms.append(f"size >= {int(self.min_size)}")
+        if self.max_size is not None:
+            terms.append(f"size <= {int(self.max_size)}")
+        if self.modified_after is not None:
+            terms.append(f"mtime >= {float(self.modified_after)}")
+        if self.modified_before is not None:
+            terms.append(f"mtime <= {float(self.modified_before)}")
+        return " and ".join(terms)
+
+    def to_sql(self, alias="m"):
+        """file_metadata 테이블(alias)에 대한 SQL 조건과 인자를 반환하는 함수"""
+        terms = []
+        params = []
+        if self.extensions:
+            terms.append(
+                f"{alias}.extension IN ({', '.join('?' * len(self.extensions))})"
+            )
+            params += self.extensions
+        if self.mime_type:
+            if self.mime_type.endswith("/"):
+                terms.append(f"{alias}.mime_type LIKE ?")
+                params.append(self.mime_type + "%")
+            else:
+                terms.append(f"{alias}.mime_type = ?")
+                params.append(self.mime_type)
+        if self.min_size is not None:
+            terms.append(f"{alias}.size >= ?")
+            params.append(int(self.min_size))
+        if self.max_size is not None:
+            terms.append(f"{alias}.size <= ?")
+            params.append(int(self.max_size))
+        if self.modified_after is not None:
+            terms.append(f"{alias}.mtime >= ?")
+            params.append(float(self.modified_after))
+        if self.modified_before is not None:
+            terms.append(f"{alias}.mtime <= ?")
+            params.append(float(self.modified_before))
+        return " AND ".join(terms), params
+
+
+def combine_expressions(*expressions):
+    """빈 식을 빼고 Milvus filter 식들을 and로 묶는 함수"""
+    expressions = [f"({expr})" for expr in expressions if expr]
+    if len(expressions) == 1:
+        return expressions[0][1:-1]
+    return " and ".join(expressions)
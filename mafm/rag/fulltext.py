@@ -0,0 +1,139 @@
+import json
+import os
+import re
+import sqlite3
+from .sqlite import connection_manager, transaction
+
+# Reciprocal Rank Fusion 상수 (클수록 순위가 낮은 결과의 영향이 커진다)
+RRF_K = int(os.getenv("MAFM_RRF_K", "60"))
+
+# 파일 수 대비 가져올 청크 수의 배율 (한 파일의 청크 여러 개가 함께 걸리는 경우를 대비)
+CHUNKS_PER_FILE = 4
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def add_chunks(rows, db_name="filesystem.db"):
+    """[(파일 id, 청크 텍스트[, 재채점용 벡터 blob]), ...]를 전문 검색 인덱스에 추가하는 함수"""
+    rows = [
+        (file_id, text, vector[0] if vector else None)
+        for file_id, text, *vector in rows
+        if text
+    ]
+    if not rows:
+        return
+    with transaction(db_name) as connection:
+        connection.executemany(
+            "INSERT INTO file_chunk (file_id, content, vector) VALUES (?, ?, ?)", rows
+        )
+
+
+def remove_files(file_ids, db_name="filesystem.db"):
+    """파일들의 청크 텍스트를 전문 검색 인덱스에서 지우는 함수"""
+    with transaction(db_name) as connection:
+        connection.executemany(
+            "DELETE FROM file_chunk WHERE file_id = ?",
+            [(file_id,) for file_id in file_ids],
+        )
+
+
+def build_match_query(query):
+    """사용자 질의를 FTS5 MATCH 식으로 바꾸는 함수 (검색할 단어가 없으면 None)
+
+    공백으로 나눈 각 단어를 구문(phrase)으로 감싸서 FTS5 문법 문자를 그대로 검색하고,
+    report_v2.pdf 같은 식별자는 토크나이저와 같은 단위로 나눠 연속된 구문으로 찾는다.
+    단어들은 OR로 묶고 순위는 BM25에 맡긴다.
+    """
+    phrases = []
+    for term in query.split():
+        tokens = _TOKEN.findall(term)
+        if tokens:
+            phrases.append('"' + " ".join(tokens) + '"')
+    if not phrases:
+        return None
+    return " OR ".join(dict.fromkeys(phrases))
+
+
+def lexical_rankings(
+    query, top_k, dir_ids=None, search_filter=None, db_name="filesystem.db"
+):
+    """청크 내용과 파일 이름에 대한 BM25 순위를 [[(파일 id, 점수), ...], ...]로 반환하는 함수
+
+    dir_ids를 주면 그 디렉토리들에 직접 속한 파일만, search_filter(SearchFilter)를 주면
+    메타데이터 조건에 맞는 파일만 검색한다. 점수는 부호를 바꾼 BM25 값이라 클수록 잘 맞는다.
+    """
+    match = build_match_query(query)
+    if match is None or top_k <= 0:
+        return []
+
+    scope = ""
+    params = [match]
+    if dir_ids is not None:
+        scope = "AND f.parent_id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(dir_ids)))
+    if search_filter is not None and not search_filter.is_empty():
+        clause, filter_params = search_filter.to_sql("m")
+        scope += f" AND f.id IN (SELECT m.file_id FROM file_metadata m WHERE {clause})"
+        params += filter_params
+
+    try:
+        with connection_manager.connect(db_name) as connection:
+            # bm25()는 집계 함수 안에서 쓸 수 없으므로 청크 순위를 먼저 구한 뒤 파일별로 묶는다
+            content = connection.execute(
+                f"""
+                SELECT file_id, MIN(score) FROM (
+                    SELECT c.file_id AS file_id, chunk_fts.rank AS score
+                    FROM chunk_fts
+                    JOIN file_chunk c ON c.id = chunk_fts.rowid
+                    JOIN file_info f ON f.id = c.file_id
+                    WHERE chunk_fts MATCH ? {scope}
+                    ORDER BY chunk_fts.rank
+                    LIMIT ?
+                )
+                GROUP BY file_id
+                ORDER BY MIN(score)
+                LIMIT ?
+                """,
+                params + [top_k * CHUNKS_PER_FILE, top_k],
+            ).fetchall()
+            names = connection.execute(
+                f"""
+                SELECT f.id, name_fts.rank
+                FROM name_fts
+                JOIN file_info f ON f.id = name_fts.rowid
+                WHERE name_fts MATCH ? AND f.is_dir = 0 {scope}
+                ORDER BY name_fts.rank
+                LIMIT ?
+                """,
+                params + [top_k],
+            ).fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Error searching full-text index: {e}")
+        return []
+
+    return [
+        [(id, -score) for id, score in ranking]
+        for ranking in (content, names)
+        if ranking
+    ]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """여러 순위 목록을 Reciprocal Rank Fusion으로 합치는 함수
+
+    rankings: [[(id, 점수), ...], ...] (각 목록은 점수 내림차순)
+    반환: [(id, RRF 점수), ...] RRF 점수 내림차순
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, (id, _) in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def lexical_search(
+    query, top_k, dir_ids=None, search_filter=None, db_name="filesystem.db"
+):
+    """모델 없이 청크 내용과 파일 이름만으로 검색해서 [(파일 id, 점수), ...]를 반환하는 함수"""
+    rankings = lexical_rankings(query, top_k, dir_ids, search_filter, db_name)
+    return reciprocal_rank_fusion(rankings)[:top_k]
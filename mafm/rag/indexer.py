@@ -0,0 +1,363 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .chunker import get_index_id
+from .embedding import BatchEmbedder
+from .extractor import extract_text_chunks
+from .filters import describe_file
+from .manifest import file_fingerprint, is_unchanged, reusable_hash
+from .sqlite import (
+    insert_file_infos,
+    get_ids_by_paths,
+    upsert_manifest,
+    upsert_manifests,
+    upsert_file_metadata,
+    delete_file_info,
+    delete_directory_and_subdirectories,
+)
+from .vectorDb import (
+    initialize_vector_db,
+    insert_embeddings,
+    get_db_name,
+    remove_by_id,
+    delete_vector_db,
+)
+
+try:
+    from .fileops import scan_tree
+except (OSError, AttributeError):
+    # C 라이브러리를 빌드하지 않았거나 예전 빌드이면 os.walk로 탐색한다 (rag/C_library/Makefile)
+    scan_tree = None
+
+# 텍스트 추출 프로세스 수와 단계 사이 큐의 최대 크기
+EXTRACT_WORKERS = int(os.getenv("MAFM_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PIPELINE_QUEUE_SIZE = int(os.getenv("MAFM_PIPELINE_QUEUE_SIZE", "256"))
+
+# 디렉토리 탐색(C 라이브러리의 scan_tree) 스레드 수 (0이면 os.walk로 탐색)
+SCAN_THREADS = int(os.getenv("MAFM_SCAN_THREADS", "8"))
+
+# 큐의 끝을 알리는 값
+_DONE = object()
+
+
+def _extract(file_path, old_hash=None):
+    """프로세스 풀에서 실행되는 텍스트 추출 작업
+
+    (청크 목록, 크기, 수정 시각, 내용 해시)를 반환한다.
+    내용 해시가 old_hash와 같으면 추출을 생략하고 청크 목록 대신 None을 반환한다.
+    """
+    size, mtime, content_hash = file_fingerprint(file_path)
+    if content_hash == old_hash:
+        return None, size, mtime, content_hash
+
+    try:
+        text_chunks = extract_text_chunks(file_path)
+    except Exception as e:
+        print(f"Error extracting text from {file_path}: {e}")
+        text_chunks = []
+    return text_chunks, size, mtime, content_hash
+
+
+def is_in_tree(path, root):
+    """path가 root 자신이거나 root 아래의 경로인지 확인하는 함수"""
+    return path == root or path.startswith(root.rstrip("/") + "/")
+
+
+def is_indexed_file(filename):
+    """색인 대상 파일인지 확인하는 함수 (숨김 파일과 .db 파일 제외)"""
+    return not (filename.startswith(".") or filename.endswith(".db"))
+
+
+class IndexingPipeline:
+    """scan → extract → embed → write 단계로 나눈 병렬 색인 파이프라인
+
+    - scan: 디렉토리를 탐색하고(C 라이브러리의 스레드 풀) 파일마다 추출 작업을 제출한다.
+    - extract: 프로세스 풀에서 PDF/DOCX/텍스트 파일을 청크로 분할한다.
+    - embed: 하나의 스레드가 BatchEmbedder로 여러 파일의 청크를 모아 임베딩한다.
+    - write: 하나의 스레드가 SQLite와 벡터 DB 쓰기를 모두 담당한다.
+
+    단계 사이의 큐는 queue_size로 크기가 제한되어 있어서, 뒤 단계가 느리면 앞 단계가
+    대기하므로 메모리 사용량이 일정하게 유지된다.
+
+    이전 색인의 manifest가 주어지면 새로 생기거나 바뀐 파일만 다시 임베딩하고,
+    사라진 파일과 디렉토리는 DB에서 제거한다.
+    """
+
+    def __init__(self, extract_workers=EXTRACT_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+        self.extract_workers = max(1, extract_workers)
+        self.queue_size = max(1, queue_size)
+        # 제출된 추출 작업(future)을 순서대로 담는 큐
+        self._extract_queue = queue.Queue(maxsize=self.queue_size)
+        # writer가 처리할 작업을 담는 큐
+        self._write_queue = queue.Queue(maxsize=self.queue_size)
+        self.embedder = BatchEmbedder(self._write_queue.put)
+        self.model_id = get_index_id()
+        self.manifest = {}
+        self.known_directories = set()
+
+        # 처리 결과 통계
+        self.directories = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.failed = 0
+
+    def run(self, root, manifest=None, directories=None):
+        """root 아래의 디렉토리와 파일을 색인하는 함수
+
+        root 디렉토리 자체는 호출하는 쪽에서 미리 등록해야 한다.
+        manifest: get_manifest()의 결과. 주어지면 바뀐 파일만 처리한다.
+        directories: 이미 등록된 디렉토리 경로 목록
+        """
+        start_time = time.time()
+        # DB에는 다른 root의 색인도 있으므로 root 아래의 항목만 비교한다
+        # (그렇지 않으면 다른 root의 파일과 디렉토리가 사라진 것으로 보고 지워진다)
+        self.manifest = {
+            path: entry
+            for path, entry in (manifest or {}).items()
+            if is_in_tree(path, root)
+        }
+        self.known_directories = {
+            path for path in directories or [] if is_in_tree(path, root)
+        }
+        context = multiprocessing.get_context()
+        with ProcessPoolExecutor(
+            max_workers=self.extract_workers, mp_context=context
+        ) as pool:
+            if context.get_start_method() == "fork":
+                # fork 방식은 첫 제출 시 모든 워커를 만들기 때문에,
+                # 다른 스레드가 락을 잡은 상태로 fork되지 않도록 스레드 시작 전에 워커를 띄운다
+                pool.submit(os.getpid).result()
+
+            embed_thread = threading.Thread(target=self._embed_loop, name="mafm-embed")
+            write_thread = threading.Thread(target=self._write_loop, name="mafm-write")
+            embed_thread.start()
+            write_thread.start()
+            try:
+                self._scan(root, pool)
+            finally:
+                self._extract_queue.put(_DONE)
+                embed_thread.join()
+                write_thread.join()
+
+        self.embedder.report()
+        print(
+            f"색인 완료: 새 디렉토리 {self.directories}개, 새 파일 {self.added}개, "
+            f"변경 {self.updated}개, 유지 {self.unchanged}개, 삭제 {self.removed}개, "
+            f"실패 {self.failed}개, "
+            f"{time.time() - start_time:.4f} 초 (추출 워커 {self.extract_workers}개)"
+        )
+
+    def _walk(self, root):
+        """root 아래의 (경로, 디렉토리인지, 크기, 수정 시각)을 내보내는 generator
+
+        디렉토리는 항상 그 안의 항목보다 먼저 나온다. C 라이브러리가 있으면 스레드 풀로
+        탐색하면서 크기와 수정 시각도 함께 모으고, 없으면 os.walk로 탐색한다 (크기와 수정
+        시각은 None). <이름>.db 디렉토리는 numpy 벡터 저장소이므로 들어가지 않는다.
+        """
+        if scan_tree is not None and SCAN_THREADS > 0:
+            for batch in scan_tree(root, SCAN_THREADS, prune_suffix=".db"):
+                for entry in batch:
+                    if entry.is_dir:
+                        yield entry.path, True, None, None
+                    elif entry.is_file:
+                        yield entry.path, False, entry.size, entry.mtime
+            return
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.endswith(".db")]
+            for dirname in dirnames:
+                yield os.path.join(dirpath, dirname), True, None, None
+            for filename in filenames:
+                yield os.path.join(dirpath, filename), False, None, None
+
+    def _scan(self, root, pool):
+        seen_directories = {root}
+        seen_files = set()
+        for full_path, is_dir, size, mtime in self._walk(root):
+            if is_dir:
+                seen_directories.add(full_path)
+                if full_path in self.known_directories:
+                    continue
+                # 디렉토리는 추출/임베딩이 필요 없으므로 바로 writer로 보낸다.
+                # 이 디렉토리의 파일보다 항상 먼저 큐에 들어가므로 등록 순서가 보장된다.
+                self._write_queue.put(("directory", full_path))
+                continue
+
+            if not is_indexed_file(os.path.basename(full_path)):
+                continue
+            seen_files.add(full_path)
+
+            # 크기와 수정 시각이 manifest와 같으면 파일을 읽지 않고 건너뛴다
+            entry = self.manifest.get(full_path)
+            if entry is not None:
+                if size is None:
+                    try:
+                        stat = os.stat(full_path)
+                    except OSError:
+                        continue
+                    size, mtime = stat.st_size, stat.st_mtime
+                if is_unchanged(entry, size, mtime, self.model_id):
+                    self.unchanged += 1
+                    continue
+
+            future = pool.submit(_extract, full_path, reusable_hash(entry, self.model_id))
+            self._extract_queue.put((full_path, os.path.dirname(full_path), future))
+
+        # 사라진 디렉토리는 가장 위의 디렉토리만 지우면 하위 디렉토리까지 함께 정리된다
+        removed_directories = self.known_directories - seen_directories
+        for dir_path in sorted(removed_directories):
+            if os.path.dirname(dir_path) not in removed_directories:
+                self._write_queue.put(("remove_directory", dir_path))
+
+        for full_path, entry in self.manifest.items():
+            if full_path in seen_files:
+                continue
+            if os.path.dirname(full_path) in removed_directories:
+                continue
+            self._write_queue.put(("remove_file", full_path, entry[0]))
+
+    def _embed_loop(self):
+        while True:
+            item = self._extract_queue.get()
+            if item is _DONE:
+                break
+            full_path, dirpath, future = item
+            try:
+                text_chunks, size, mtime, content_hash = future.result()
+                key = (full_path, dirpath, size, mtime, content_hash)
+                if text_chunks is None:
+                    # 내용이 같으므로 manifest만 갱신
+                    self._write_queue.put(("touch", key))
+                else:
+                    self.embedder.add(key, text_chunks)
+            except Exception as e:
+                # 한 파일의 오류로 파이프라인이 멈추지 않도록 계속 큐를 비운다
+                print(f"Error embedding {full_path}: {e}")
+        try:
+            self.embedder.flush()
+        except Exception as e:
+            print(f"Error in embedding stage: {e}")
+        finally:
+            self._write_queue.put(_DONE)
+
+    def _write_loop(self):
+        pending = None
+        while True:
+            item = pending if pending is not None else self._write_queue.get()
+            pending = None
+            if item is _DONE:
+                break
+            try:
+                if isinstance(item, list):
+                    self._write_files(item)
+                elif item[0] == "directory":
+                    # 연달아 들어온 디렉토리는 한 트랜잭션으로 등록
+                    directories = [item[1]]
+                    pending = self._take_directories(directories)
+                    self._write_directories(directories)
+                elif item[0] == "touch":
+                    self._touch_file(item[1])
+                elif item[0] == "remove_file":
+                    self._remove_file(item[1], item[2])
+                elif item[0] == "remove_directory":
+                    self._remove_directory(item[1])
+            except Exception as e:
+                print(f"Error in write stage: {e}")
+
+    def _take_directories(self, directories):
+        """큐에 이어서 들어 있는 디렉토리 작업을 꺼내 모으고, 다음 작업을 반환하는 함수"""
+        while True:
+            try:
+                item = self._write_queue.get_nowait()
+            except queue.Empty:
+                return None
+            if isinstance(item, tuple) and item[0] == "directory":
+                directories.append(item[1])
+            else:
+                return item
+
+    def _write_directories(self, directories):
+        for full_path in directories:
+            print(f"디렉토리 경로: {full_path}")
+            initialize_vector_db(get_db_name(full_path))
+        insert_file_infos([(full_path, 1) for full_path in directories], "filesystem.db")
+        self.directories += len(directories)
+
+    def _write_files(self, results):
+        # 임베딩에 실패한 파일은 파일 정보만 등록하고 manifest는 남기지 않아 다음 색인 때 다시 시도한다
+        failed = [key[0] for key, _, vectors in results if vectors is None]
+        if failed:
+            existing = get_ids_by_paths(failed, "filesystem.db")
+            insert_file_infos(
+                [(path, 0) for path in failed if path not in existing], "filesystem.db"
+            )
+            for path in failed:
+                print(f"임베딩에 실패하여 색인하지 못한 파일: {path}")
+            self.failed += len(failed)
+            results = [result for result in results if result[2] is not None]
+            if not results:
+                return
+
+        # 파일 정보를 한 번에 등록해서 id를 받은 뒤, 벡터를 db별로 모아서 삽입
+        existing = get_ids_by_paths([key[0] for key, _, _ in results], "filesystem.db")
+        new_paths = [key[0] for key, _, _ in results if key[0] not in existing]
+        new_ids = dict(
+            zip(
+                new_paths,
+                insert_file_infos([(path, 0) for path in new_paths], "filesystem.db"),
+            )
+        )
+
+        rows = []
+        manifest_rows = []
+        metadata = {}
+        for (full_path, dirpath, size, mtime, content_hash), chunks, vectors in results:
+            print(f"Embedding 하는 파일의 절대 경로: {full_path}")
+            db_name = get_db_name(dirpath)
+            if full_path in new_ids:
+                id = new_ids[full_path]
+                self.added += 1
+            else:
+                # 바뀐 파일은 id를 유지하고 이전 벡터만 지운다
+                id = existing[full_path]
+                self._remove_vectors(id, db_name)
+                self.updated += 1
+            rows.append(((db_name, id), chunks, vectors))
+            manifest_rows.append(
+                (id, size, mtime, content_hash, len(chunks), self.model_id)
+            )
+            metadata[id] = describe_file(full_path, size, mtime)
+
+        insert_embeddings(rows, metadata)
+        upsert_file_metadata(list(metadata.items()), "filesystem.db")
+        upsert_manifests(manifest_rows, "filesystem.db")
+
+    def _touch_file(self, key):
+        full_path, _, size, mtime, content_hash = key
+        id, _, _, _, chunk_count, _ = self.manifest[full_path]
+        upsert_manifest(
+            id, size, mtime, content_hash, chunk_count, self.model_id, "filesystem.db"
+        )
+        self.unchanged += 1
+
+    def _remove_file(self, full_path, id):
+        print(f"삭제된 파일 정리: {full_path}")
+        self._remove_vectors(id, get_db_name(os.path.dirname(full_path)))
+        delete_file_info(id, "filesystem.db")
+        self.removed += 1
+
+    def _remove_directory(self, dir_path):
+        print(f"삭제된 디렉토리 정리: {dir_path}")
+        delete_vector_db(get_db_name(dir_path))
+        delete_directory_and_subdirectories(dir_path)
+
+    def _remove_vectors(self, id, db_name):
+        try:
+            remove_by_id(id, db_name)
+        except Exception as e:
+            print(f"Error removing vectors of {id} from {db_name}: {e}")
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+# 해시 계산 시 한 번에 읽는 크기
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(file_path):
+    """파일 내용의 해시를 계산하는 함수"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path):
+    """파일의 (크기, 수정 시각, 내용 해시)를 반환하는 함수"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime, hash_file(file_path)
+
+
+def is_unchanged(entry, size, mtime, model_id):
+    """manifest 항목과 현재 파일 상태를 비교해서 다시 색인할 필요가 없는지 확인하는 함수
+
+    entry: get_manifest()의 값 (id, 크기, 수정 시각, 해시, 청크 수, 모델 id)
+    크기와 수정 시각이 같으면 내용 해시는 비교하지 않는다.
+    """
+    _, old_size, old_mtime, _, _, old_model_id = entry
+    return old_model_id == model_id and old_size == size and old_mtime == mtime
+
+
+def reusable_hash(entry, model_id):
+    """내용 해시만 같으면 임베딩을 재사용할 수 있는 경우 이전 해시를 반환하는 함수"""
+    if entry is None or entry[5] != model_id:
+        return None
+    return entry[3]
@@ -0,0 +1,550 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+from .ann import assign, spherical_kmeans
+from .quantization import VECTOR_DIMENSION
+from .vector_store import VectorStore
+
+# 삭제 표시(tombstone)된 행이 전체의 이 비율을 넘으면 파일을 다시 써서 정리한다
+COMPACT_RATIO = float(os.getenv("MAFM_NUMPY_COMPACT_RATIO", "0.5"))
+
+# filter 식의 항 하나: 필드 연산자 값 (값은 JSON 목록, 문자열 또는 숫자)
+_TERM = re.compile(
+    r"(\w+)\s*(in|like|==|<=|>=|<|>)\s*"
+    r"(\[[^\]]*\]|\"(?:[^\"\\]|\\.)*\"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)"
+)
+# 항 사이에 올 수 있는 것: 괄호, 공백과 and
+_GLUE = re.compile(r"^[\s()]*(?:and[\s()]*)?$")
+
+# 배열 파일 이름과 자료형 (<이름>.<세대>.<확장자>)
+_ARRAYS = {
+    "vectors": ("f32", np.float32),
+    "norms": ("f32", np.float32),
+    "ids": ("i64", np.int64),
+    "dir_ids": ("i64", np.int64),
+    "alive": ("u8", np.uint8),
+}
+
+# IVF 인덱스 파일 (<이름>.<버전>.<확장자>): 클러스터 중심, 클러스터 순서로 정렬한 행 번호,
+# 클러스터마다 행 번호 목록이 시작하는 위치
+_INDEX_ARRAYS = {
+    "centroids": ("f32", np.float32),
+    "lists": ("i64", np.int64),
+    "offsets": ("i64", np.int64),
+}
+
+
+def parse_expression(expression):
+    """filter 식을 [(필드, 연산자, 값), ...]로 나누는 함수 (and로 묶은 비교만 지원)"""
+    terms = []
+    position = 0
+    for match in _TERM.finditer(expression or ""):
+        if not _GLUE.match(expression[position : match.start()]):
+            raise ValueError(f"unsupported filter expression: {expression}")
+        field, op, value = match.groups()
+        terms.append((field, op, json.loads(value)))
+        position = match.end()
+    if not _GLUE.match((expression or "")[position:]):
+        raise ValueError(f"unsupported filter expression: {expression}")
+    return terms
+
+
+def _like(pattern):
+    """Milvus/SQL의 like 패턴(%, _)을 정규식으로 바꾸는 함수"""
+    parts = (
+        ".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern
+    )
+    return re.compile("".join(parts) + r"\Z", re.DOTALL)
+
+
+class _Collection:
+    """저장 위치 하나의 메모리 맵 배열과 행 필드
+
+    meta.json의 count가 유효한 행 수이고, 배열 파일은 세대(generation)마다 따로 만든다.
+    삽입은 파일 끝에 덧붙인 뒤 meta.json을 바꾸고, 정리(compaction)는 새 세대의 파일을
+    다 쓴 뒤 meta.json을 바꾸므로, 다른 프로세스는 meta.json만 보고 일관된 상태를 읽는다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.count = 0
+        self.deleted = 0
+        self.generation = 0
+        self.fields_size = 0
+        self.arrays = {}
+        self.fields = []
+        self._fields_offset = 0
+        self._columns = {}
+        self.index = None
+        self.index_arrays = {}
+        self._index_stamp = None
+
+    def file(self, name, generation=None):
+        generation = self.generation if generation is None else generation
+        if name == "fields":
+            return os.path.join(self.path, f"fields.{generation}.jsonl")
+        return os.path.join(self.path, f"{name}.{generation}.{_ARRAYS[name][0]}")
+
+    def index_file(self, name, version):
+        return os.path.join(self.path, f"{name}.{version}.{_INDEX_ARRAYS[name][0]}")
+
+    def refresh(self):
+        """meta.json이나 index.json이 바뀌었으면 배열을 다시 매핑하는 함수"""
+        self._refresh_rows()
+        self._refresh_index()
+
+    def _refresh_rows(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        stat = os.stat(meta_path)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self.stamp:
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        if meta["generation"] != self.generation:
+            self.fields = []
+            self._fields_offset = 0
+        self.count = meta["count"]
+        self.deleted = meta["deleted"]
+        self.generation = meta["generation"]
+        self.fields_size = meta["fields_size"]
+        self.arrays = {}
+        for name, (_, dtype) in _ARRAYS.items():
+            shape = (self.count, VECTOR_DIMENSION) if name == "vectors" else (self.count,)
+            if self.count == 0:
+                self.arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                # 복사 없이 파일을 그대로 매핑한다 (다른 프로세스의 삭제 표시도 바로 보인다)
+                self.arrays[name] = np.memmap(
+                    self.file(name), dtype=dtype, mode="r", shape=shape
+                )
+        self._columns = {}
+        self.stamp = stamp
+
+    def _refresh_index(self):
+        index_path = os.path.join(self.path, "index.json")
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            self.index, self.index_arrays, self._index_stamp = None, {}, None
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self._index_stamp:
+            return
+        with open(index_path) as f:
+            index = json.load(f)
+        arrays = {
+            name: np.memmap(self.index_file(name, index["version"]), dtype=dtype, mode="r")
+            for name, (_, dtype) in _INDEX_ARRAYS.items()
+        }
+        arrays["centroids"] = arrays["centroids"].reshape(-1, VECTOR_DIMENSION)
+        self.index, self.index_arrays, self._index_stamp = index, arrays, stamp
+
+    def current_index(self):
+        """지금 세대의 행으로 만든 인덱스이면 그 설정을, 아니면 None을 반환하는 함수
+
+        인덱스를 만든 뒤 덧붙인 행(rows 이후)은 검색할 때 따로 전수 비교한다.
+        정리(compaction)로 세대가 바뀌면 행 번호가 달라지므로 인덱스를 다시 만들어야 한다.
+        """
+        index = self.index
+        if index and index["generation"] == self.generation and index["rows"] <= self.count:
+            return index
+        return None
+
+    def load_fields(self):
+        """행 필드(JSON lines)를 아직 읽지 않은 부분만 읽는 함수"""
+        if len(self.fields) < self.count:
+            with open(self.file("fields"), "rb") as f:
+                f.seek(self._fields_offset)
+                while len(self.fields) < self.count:
+                    self.fields.append(json.loads(f.readline()))
+                self._fields_offset = f.tell()
+        return self.fields[: self.count]
+
+    def column(self, field, numeric):
+        """필드 값을 배열로 반환하는 함수 (없는 값은 숫자면 nan, 아니면 None)"""
+        if field == "id":
+            return self.arrays["ids"]
+        if field == "dir_id":
+            return self.arrays["dir_ids"]
+        key = (field, numeric)
+        if key not in self._columns:
+            values = [row.get(field) for row in self.load_fields()]
+            if numeric:
+                self._columns[key] = np.array(
+                    [
+                        value
+                        if isinstance(value, (int, float)) and not isinstance(value, bool)
+                        else np.nan
+                        for value in values
+                    ],
+                    dtype=np.float64,
+                )
+            else:
+                self._columns[key] = np.array(values, dtype=object)
+        return self._columns[key]
+
+    def match(self, expression):
+        """filter 식에 맞고 삭제되지 않은 행의 bool 배열을 반환하는 함수"""
+        mask = self.arrays["alive"].astype(bool)
+        for field, op, value in parse_expression(expression):
+            numeric = op in ("<", "<=", ">", ">=") or (
+                op in ("in", "==") and field in ("id", "dir_id")
+            )
+            column = self.column(field, numeric)
+            if op == "in" or op == "==":
+                values = value if op == "in" else [value]
+                if numeric:
+                    mask &= np.isin(column, values)
+                else:
+                    allowed = set(values)
+                    mask &= np.fromiter(
+                        (item in allowed for item in column), dtype=bool, count=len(column)
+                    )
+            elif op == "like":
+                pattern = _like(value)
+                mask &= np.fromiter(
+                    (isinstance(item, str) and bool(pattern.match(item)) for item in column),
+                    dtype=bool,
+                    count=len(column),
+                )
+            elif op == "<":
+                mask &= column < value
+            elif op == "<=":
+                mask &= column <= value
+            elif op == ">":
+                mask &= column > value
+            else:
+                mask &= column >= value
+        return mask
+
+
+def _top(scores, rows, ids, limit):
+    """점수가 높은 행 limit개를 [(파일 id, 점수), ...]로 반환하는 함수"""
+    k = min(limit, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(ids[rows[i]]), float(scores[i])) for i in top]
+
+
+class NumpyVectorStore(VectorStore):
+    """메모리 맵 float32 행렬로 벡터를 저장하는 프로세스 내 저장소
+
+    저장 위치(db_name)는 디렉토리이고, 정규화된 벡터 행렬, 원래 노름, 파일 id, dir_id,
+    삭제 표시 배열과 행 필드(JSON lines)를 파일로 둔다. 파일을 매핑만 하므로 여는 데
+    읽기 단계가 없고, 검색은 (filter로 고른) 행렬과 질의 벡터의 곱 한 번으로 끝난다.
+    삭제는 삭제 표시만 하고, 삭제된 행이 많아지면 새 세대의 파일로 다시 쓴다.
+    행이 많아지면 IVF 인덱스(클러스터 중심과 클러스터별 행 번호)를 만들어, 질의와 가까운
+    클러스터의 행만 비교한다 (rag/ann.py).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {}
+
+    def _get(self, db_name):
+        with self._lock:
+            collection = self._collections.get(db_name)
+            if collection is None:
+                collection = _Collection(db_name)
+                self._collections[db_name] = collection
+            collection.refresh()
+            return collection
+
+    @contextmanager
+    def _writing(self, db_name):
+        """다른 프로세스와 겹치지 않게 쓰기 잠금을 잡고 최신 상태의 컬렉션을 빌려주는 함수"""
+        with self._lock:
+            with open(os.path.join(db_name, "lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield self._get(db_name)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_meta(self, collection, count, deleted, generation, fields_size):
+        meta_path = os.path.join(collection.path, "meta.json")
+        temp_path = meta_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                {
+                    "count": count,
+                    "deleted": deleted,
+                    "generation": generation,
+                    "fields_size": fields_size,
+                },
+                f,
+            )
+        os.replace(temp_path, meta_path)
+        collection.refresh()
+
+    def has_collection(self, db_name):
+        return os.path.exists(os.path.join(db_name, "meta.json"))
+
+    def create_collection(self, db_name, with_dir_id=False):
+        self.drop_collection(db_name)
+        if os.path.isfile(db_name):
+            os.remove(db_name)  # 다른 저장소 구현이 남긴 파일
+        os.makedirs(db_name, exist_ok=True)
+        collection = _Collection(db_name)
+        for name in list(_ARRAYS) + ["fields"]:
+            open(collection.file(name, 0), "wb").close()
+        self._write_meta(collection, 0, 0, 0, 0)
+
+    def drop_collection(self, db_name):
+        self.release(db_name)
+        if not self.has_collection(db_name):
+            return False
+        shutil.rmtree(db_name)
+        return True
+
+    def insert(self, db_name, rows):
+        if not rows:
+            return {"insert_count": 0}
+        vectors = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        vectors = vectors / np.maximum(norms, 1e-12)[:, None]
+        new_arrays = {
+            "vectors": vectors,
+            "norms": norms,
+            "ids": np.asarray([row["id"] for row in rows], dtype=np.int64),
+            "dir_ids": np.asarray([row.get("dir_id", -1) for row in rows], dtype=np.int64),
+            "alive": np.ones(len(rows), dtype=np.uint8),
+        }
+        fields = [
+            {key: value for key, value in row.items() if key not in ("id", "vector")}
+            for row in rows
+        ]
+
+        with self._writing(db_name) as collection:
+            count = collection.count
+            for name, array in new_arrays.items():
+                path = collection.file(name)
+                # 이전에 중간에 멈춘 쓰기가 남긴 부분은 잘라내고 덧붙인다
+                row_size = array.itemsize * (VECTOR_DIMENSION if name == "vectors" else 1)
+                os.truncate(path, count * row_size)
+                with open(path, "ab") as f:
+                    f.write(np.ascontiguousarray(array).tobytes())
+            fields_path = collection.file("fields")
+            os.truncate(fields_path, collection.fields_size)
+            with open(fields_path, "ab") as f:
+                for row in fields:
+                    f.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                fields_size = f.tell()
+            self._write_meta(
+                collection,
+                count + len(rows),
+                collection.deleted,
+                collection.generation,
+                fields_size,
+            )
+        return {"insert_count": len(rows)}
+
+    def search(self, db_name, query_vectors, limit, expression="", search_params=None):
+        if not query_vectors:
+            return []
+        search_params = search_params or {}
+        with self._lock:
+            collection = self._get(db_name)
+            mask = collection.match(expression)
+            vectors = collection.arrays["vectors"]
+            ids = collection.arrays["ids"]
+            index = None if search_params.get("exact") else collection.current_index()
+            index_arrays = collection.index_arrays
+
+        candidates = np.flatnonzero(mask)
+        if min(limit, len(candidates)) <= 0:
+            return [[] for _ in query_vectors]
+
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if index is not None:
+            nprobe = max(1, min(search_params.get("nprobe", index["nprobe"]), index["nlist"]))
+            # filter로 남은 행이 클러스터를 찾아 비교할 행 수보다 적으면 전수 비교가 더 싸다
+            if len(candidates) > len(mask) * nprobe / index["nlist"]:
+                return [
+                    self._search_ivf(
+                        query, index, index_arrays, nprobe, mask, vectors, ids, limit
+                    )
+                    for query in queries
+                ]
+
+        if len(candidates) == len(mask):
+            scores = vectors @ queries.T
+        else:
+            scores = vectors[candidates] @ queries.T
+        return [_top(column, candidates, ids, limit) for column in scores.T]
+
+    def _search_ivf(self, query, index, index_arrays, nprobe, mask, vectors, ids, limit):
+        """질의와 가까운 nprobe개 클러스터의 행과 인덱스 이후에 덧붙인 행만 비교하는 함수"""
+        centroids = index_arrays["centroids"]
+        offsets = index_arrays["offsets"]
+        lists = index_arrays["lists"]
+        probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = [lists[offsets[c] : offsets[c + 1]] for c in probes]
+        rows.append(np.arange(index["rows"], len(mask), dtype=np.int64))
+        # 행 번호 순서로 읽어야 메모리 맵을 앞에서부터 차례로 읽는다
+        rows = np.sort(np.concatenate(rows))
+        rows = rows[mask[rows]]
+        return _top(vectors[rows] @ query, rows, ids, limit)
+
+    def query(self, db_name, expression):
+        with self._lock:
+            collection = self._get(db_name)
+            indexes = np.flatnonzero(collection.match(expression))
+            fields = collection.load_fields() if len(indexes) else []
+            arrays = collection.arrays
+        return [
+            {
+                **fields[i],
+                "id": int(arrays["ids"][i]),
+                "vector": (arrays["vectors"][i] * arrays["norms"][i]).tolist(),
+            }
+            for i in indexes
+        ]
+
+    def delete(self, db_name, expression):
+        with self._writing(db_name) as collection:
+            indexes = np.flatnonzero(collection.match(expression))
+            if len(indexes):
+                alive = np.memmap(
+                    collection.file("alive"),
+                    dtype=np.uint8,
+                    mode="r+",
+                    shape=(collection.count,),
+                )
+                alive[indexes] = 0
+                alive.flush()
+                del alive
+                deleted = collection.deleted + len(indexes)
+                if deleted > collection.count * COMPACT_RATIO:
+                    self._compact(collection)
+                else:
+                    self._write_meta(
+                        collection,
+                        collection.count,
+                        deleted,
+                        collection.generation,
+                        collection.fields_size,
+                    )
+        return {"delete_count": len(indexes)}
+
+    def _compact(self, collection):
+        """삭제되지 않은 행만 새 세대의 파일로 다시 쓰는 함수 (쓰기 잠금 안에서 호출)"""
+        keep = np.flatnonzero(collection.arrays["alive"])
+        fields = collection.load_fields()
+        old_generation = collection.generation
+        generation = old_generation + 1
+        for name in _ARRAYS:
+            array = collection.arrays[name][keep] if len(keep) else collection.arrays[name][:0]
+            with open(collection.file(name, generation), "wb") as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+        with open(collection.file("fields", generation), "wb") as f:
+            for i in keep:
+                f.write((json.dumps(fields[i], ensure_ascii=False) + "\n").encode("utf-8"))
+            fields_size = f.tell()
+        self._write_meta(collection, len(keep), 0, generation, fields_size)
+
+        # 이전 세대 파일을 매핑하고 있는 프로세스는 지워진 뒤에도 그대로 읽을 수 있다
+        for name in list(_ARRAYS) + ["fields"]:
+            path = collection.file(name, old_generation)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def supported_indexes(self, db_name):
+        return ("flat", "ivf")
+
+    def row_count(self, db_name):
+        """삭제 표시된 행까지 포함한 행 수 (인덱스 뒤에 덧붙인 행의 비율을 보려고)"""
+        with self._lock:
+            return self._get(db_name).count
+
+    def index_info(self, db_name):
+        with self._lock:
+            index = self._get(db_name).current_index()
+        if index is None:
+            return None
+        return {key: index[key] for key in ("type", "rows", "nlist", "nprobe")}
+
+    def build_index(self, db_name, config):
+        """클러스터링은 잠금 없이 하고, 그동안 세대가 바뀌지 않았을 때만 인덱스를 바꾼다
+
+        클러스터링하는 동안 덧붙인 행은 인덱스 뒤의 행으로 검색된다.
+        """
+        with self._lock:
+            collection = self._get(db_name)
+            count, generation = collection.count, collection.generation
+            vectors = collection.arrays["vectors"]
+
+        arrays = None
+        if config["type"] == "ivf" and count:
+            centroids = spherical_kmeans(vectors, min(config["nlist"], count))
+            labels = assign(vectors, centroids)
+            sizes = np.bincount(labels, minlength=len(centroids))
+            arrays = {
+                "centroids": centroids.astype(np.float32),
+                "lists": np.argsort(labels, kind="stable").astype(np.int64),
+                "offsets": np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+            }
+
+        with self._writing(db_name) as collection:
+            if collection.generation != generation:
+                print(f"Skipped vector index of {db_name}: rows were compacted while building")
+                return
+            index = None
+            if arrays is not None:
+                index = {
+                    "type": "ivf",
+                    "rows": count,
+                    "nlist": len(arrays["centroids"]),
+                    "nprobe": max(1, min(config["nprobe"], len(arrays["centroids"]))),
+                    "generation": generation,
+                }
+            self._replace_index(collection, index, arrays)
+
+    def _replace_index(self, collection, index, arrays):
+        """새 버전의 인덱스 파일을 쓰고 index.json을 바꾸는 함수 (쓰기 잠금 안에서 호출)"""
+        old = collection.index
+        index_path = os.path.join(collection.path, "index.json")
+        if index is None:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+        else:
+            index["version"] = old["version"] + 1 if old else 1
+            for name, array in arrays.items():
+                with open(collection.index_file(name, index["version"]), "wb") as f:
+                    f.write(np.ascontiguousarray(array).tobytes())
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(index, f)
+            os.replace(index_path + ".tmp", index_path)
+        collection.refresh()
+
+        # 이전 버전을 매핑하고 있는 프로세스는 지워진 뒤에도 그대로 읽을 수 있다
+        if old:
+            for name in _INDEX_ARRAYS:
+                path = collection.index_file(name, old["version"])
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def release(self, db_name):
+        with self._lock:
+            self._collections.pop(db_name, None)
+
+    def release_under(self, dir_path):
+        prefix = dir_path.rstrip("/") + "/"
+        with self._lock:
+            for name in [n for n in self._collections if n.startswith(prefix)]:
+                self._collections.pop(name, None)
+
+    def close_all(self):
+        with self._lock:
+            self._collections.clear()
@@ -0,0 +1,127 @@
+import json
+import os
+import numpy as np
+from .sqlite import connection_manager
+
+# 벡터 DB에 저장할 벡터 형식
+# "float32": 임베딩을 그대로 저장한다 (기본값)
+# "float16": 반정밀도로 저장한다 (1/2 크기)
+# "binary": 차원마다 부호 1비트만 저장하고 해밍 거리로 검색한다 (1/32 크기)
+VECTOR_ENCODINGS = ("float32", "float16", "binary")
+VECTOR_ENCODING = os.getenv("MAFM_VECTOR_ENCODING", "float32").lower()
+VECTOR_DIMENSION = 384
+
+# 압축해서 저장할 때 1차 검색 후보를 원래 정밀도의 벡터로 다시 점수 매길지 여부
+# 켜져 있으면 float32 벡터를 file_chunk 테이블(SQLite)에 같이 저장하고,
+# 1차 검색에서는 후보를 RESCORE_FACTOR배 더 가져온다.
+RESCORE = os.getenv("MAFM_RESCORE", "1") not in ("", "0")
+RESCORE_FACTOR = max(1, int(os.getenv("MAFM_RESCORE_FACTOR", "4")))
+
+
+def is_compressed(encoding=VECTOR_ENCODING):
+    return encoding != "float32"
+
+
+def rescoring_enabled(encoding=VECTOR_ENCODING):
+    return RESCORE and is_compressed(encoding)
+
+
+def encode_vector(vector, encoding=VECTOR_ENCODING):
+    """float 벡터를 벡터 DB에 저장(검색)할 형식으로 바꾸는 함수"""
+    if encoding == "float32":
+        return vector
+    array = np.asarray(vector, dtype=np.float32)
+    if encoding == "float16":
+        return array.astype(np.float16)
+    if encoding == "binary":
+        return np.packbits(array > 0).tobytes()
+    raise ValueError(f"unknown vector encoding: {encoding}")
+
+
+def decode_vector(value, encoding=VECTOR_ENCODING):
+    """벡터 DB에서 읽은 값을 float 벡터(list)로 되돌리는 함수
+
+    float16은 거의 그대로 복원되지만, binary는 부호만 남으므로 ±1로 복원된다.
+    이미 float 벡터이면 그대로 반환한다.
+    """
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], bytes):
+        value = value[0]  # Milvus는 float16/binary 벡터를 bytes 하나의 목록으로 반환한다
+    if isinstance(value, (bytes, bytearray)):
+        if encoding == "float16":
+            return np.frombuffer(value, dtype=np.float16).astype(np.float32).tolist()
+        if encoding == "binary":
+            bits = np.unpackbits(np.frombuffer(value, dtype=np.uint8))
+            return (bits.astype(np.float32) * 2 - 1).tolist()
+        raise ValueError(f"cannot decode {encoding} vector from bytes")
+    return np.asarray(value, dtype=np.float32).tolist()
+
+
+def similarity_from_distance(distance, encoding=VECTOR_ENCODING):
+    """벡터 DB의 거리를 코사인 유사도와 같은 방향(클수록 가까움)의 점수로 바꾸는 함수
+
+    binary 형식의 해밍 거리 d는 부호 벡터 사이의 코사인 1 - 2d/차원으로 바꾼다.
+    """
+    if encoding == "binary":
+        return 1.0 - 2.0 * distance / VECTOR_DIMENSION
+    return distance
+
+
+def to_blob(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_blob(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def get_chunk_vectors(file_id, db_name="filesystem.db"):
+    """파일의 청크별 원래 정밀도의 벡터를 {청크 텍스트: 벡터(list)}로 반환하는 함수"""
+    with connection_manager.connect(db_name) as connection:
+        rows = connection.execute(
+            "SELECT content, vector FROM file_chunk WHERE file_id = ? AND vector IS NOT NULL",
+            (file_id,),
+        ).fetchall()
+    return {content: from_blob(blob).tolist() for content, blob in rows}
+
+
+def rescore(
+    query_vector, candidates, aggregate="max", hit_counts=None, db_name="filesystem.db"
+):
+    """1차 검색 후보 파일들을 file_chunk에 저장된 원래 정밀도의 벡터로 다시 점수 매기는 함수
+
+    candidates: [(파일 id, 1차 점수), ...]
+    aggregate가 "max"이면 가장 가까운 청크의 코사인 유사도를, "sum"이면 1차 검색에서
+    걸린 청크 수(hit_counts)만큼 가까운 청크들의 유사도 합을 파일 점수로 쓴다.
+    저장된 벡터가 없는 파일은 1차 점수를 그대로 쓴다.
+    반환: {파일 id: 점수}
+    """
+    scores = dict(candidates)
+    if not scores:
+        return scores
+
+    with connection_manager.connect(db_name) as connection:
+        rows = connection.execute(
+            """
+            SELECT file_id, vector FROM file_chunk
+            WHERE file_id IN (SELECT value FROM json_each(?)) AND vector IS NOT NULL
+            """,
+            (json.dumps(list(scores)),),
+        ).fetchall()
+    if not rows:
+        return scores
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    matrix = np.stack([from_blob(blob) for _, blob in rows])
+    similarities = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1), 1e-12)
+
+    by_file = {}
+    for (file_id, _), similarity in zip(rows, similarities.tolist()):
+        by_file.setdefault(file_id, []).append(similarity)
+    for file_id, values in by_file.items():
+        if aggregate == "sum":
+            count = (hit_counts or {}).get(file_id, 1)
+            scores[file_id] = sum(sorted(values, reverse=True)[:count])
+        else:
+            scores[file_id] = max(values)
+    return scores
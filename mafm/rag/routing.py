@@ -0,0 +1,168 @@
+import os
+import threading
+import numpy as np
+from .embedding import embed_queries
+from .sqlite import connection_manager, transaction, get_paths_by_ids
+
+# 질의마다 감독자에게 넘길 후보 디렉토리 수
+ROUTING_TOP_K = int(os.getenv("MAFM_ROUTING_TOP_K", "8"))
+
+
+def _to_blob(vector):
+    return np.asarray(vector, dtype=np.float64).tobytes()
+
+
+def _from_blob(blob):
+    return np.frombuffer(blob, dtype=np.float64)
+
+
+def _apply_directory(connection, dir_id, chunk_count, vector_sum):
+    """디렉토리 요약에 (청크 수, 벡터 합)을 더하거나 빼는 함수"""
+    row = connection.execute(
+        "SELECT chunk_count, vector_sum FROM directory_summary WHERE dir_id = ?",
+        (dir_id,),
+    ).fetchone()
+    if row is not None:
+        chunk_count += row[0]
+        vector_sum = vector_sum + _from_blob(row[1])
+
+    if chunk_count <= 0:
+        connection.execute("DELETE FROM directory_summary WHERE dir_id = ?", (dir_id,))
+        return
+    connection.execute(
+        """
+        INSERT OR REPLACE INTO directory_summary (dir_id, chunk_count, vector_sum)
+        VALUES (?, ?, ?)
+        """,
+        (dir_id, chunk_count, _to_blob(vector_sum)),
+    )
+
+
+def _remove_file(connection, file_id):
+    row = connection.execute(
+        "SELECT dir_id, chunk_count, vector_sum FROM file_summary WHERE file_id = ?",
+        (file_id,),
+    ).fetchone()
+    if row is None:
+        return
+    _apply_directory(connection, row[0], -row[1], -_from_blob(row[2]))
+    connection.execute("DELETE FROM file_summary WHERE file_id = ?", (file_id,))
+
+
+def add_file_vectors(dir_id, vectors_by_file, db_name="filesystem.db", append=False):
+    """파일들의 청크 벡터를 dir_id 디렉토리의 요약에 더하는 함수
+
+    vectors_by_file: {file_id: [벡터, ...]}
+    이미 요약이 있는 파일은 이전 값을 먼저 빼고 새 값으로 바꾼다.
+    append가 True이면 이전 값에 이어서 더한다 (청크를 나눠서 저장하는 경우).
+    """
+    with transaction(db_name) as connection:
+        for file_id, vectors in vectors_by_file.items():
+            chunk_count = len(vectors)
+            vector_sum = np.asarray(vectors, dtype=np.float64).sum(axis=0) if chunk_count else 0.0
+            if append:
+                row = connection.execute(
+                    "SELECT chunk_count, vector_sum FROM file_summary WHERE file_id = ?",
+                    (file_id,),
+                ).fetchone()
+                if row is not None:
+                    chunk_count += row[0]
+                    vector_sum = vector_sum + _from_blob(row[1])
+            _remove_file(connection, file_id)
+            if not chunk_count:
+                continue
+            connection.execute(
+                """
+                INSERT INTO file_summary (file_id, dir_id, chunk_count, vector_sum)
+                VALUES (?, ?, ?, ?)
+                """,
+                (file_id, dir_id, chunk_count, _to_blob(vector_sum)),
+            )
+            _apply_directory(connection, dir_id, chunk_count, vector_sum)
+
+
+def remove_file_vectors(file_ids, db_name="filesystem.db"):
+    """파일들의 벡터를 원래 속해 있던 디렉토리의 요약에서 빼는 함수"""
+    with transaction(db_name) as connection:
+        for file_id in file_ids:
+            _remove_file(connection, file_id)
+
+
+class DirectoryRouter:
+    """디렉토리마다 청크 벡터의 중심(centroid)으로 질의와 가까운 디렉토리를 고르는 라우팅 인덱스
+
+    디렉토리 요약(벡터 합)은 삽입/삭제 때마다 SQLite에 갱신되고, 라우터는 db가 바뀐
+    경우에만 정규화된 중심 행렬을 다시 읽는다. 질의 한 번은 행렬-벡터 곱 한 번이다.
+    """
+
+    def __init__(self, db_name="filesystem.db"):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._generation = None
+        self._dir_ids = np.empty(0, dtype=np.int64)
+        self._centroids = np.empty((0, 0), dtype=np.float32)
+
+    def _load(self):
+        generation = connection_manager.generation(self.db_name)
+        if generation == self._generation:
+            return
+        with connection_manager.connect(self.db_name) as connection:
+            rows = connection.execute(
+                "SELECT dir_id, vector_sum FROM directory_summary"
+            ).fetchall()
+
+        dir_ids = []
+        centroids = []
+        for dir_id, blob in rows:
+            vector = _from_blob(blob)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                dir_ids.append(dir_id)
+                centroids.append(vector / norm)
+        self._dir_ids = np.asarray(dir_ids, dtype=np.int64)
+        self._centroids = np.asarray(centroids, dtype=np.float32)
+        self._generation = generation
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._dir_ids)
+
+    def top_k(self, query_vector, k=ROUTING_TOP_K):
+        """질의 벡터와 코사인 유사도가 높은 디렉토리를 [(경로, 점수), ...]로 반환하는 함수"""
+        with self._lock:
+            self._load()
+            dir_ids, centroids = self._dir_ids, self._centroids
+        if not len(dir_ids) or k <= 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = centroids @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        paths = get_paths_by_ids(dir_ids[top].tolist(), self.db_name)
+        return [
+            (path, float(scores[i])) for path, i in zip(paths, top) if path is not None
+        ]
+
+
+directory_router = DirectoryRouter()
+
+
+def route_directories(query, k=ROUTING_TOP_K):
+    """질의 문장과 가까운 디렉토리 경로 목록을 반환하는 함수 (라우팅 정보가 없으면 빈 목록)"""
+    try:
+        if not len(directory_router):
+            return []
+        query_vectors = embed_queries([query])
+        if not query_vectors:
+            return []
+        return [path for path, _ in directory_router.top_k(query_vectors[0], k)]
+    except Exception as e:
+        print(f"Error routing query to directories: {e}")
+        return []
@@ -1,244 +1,920 @@
+import atexit
 import sqlite3
 import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 # sqlite는 서버 기반 데이터베이스가 아니다.
 # 서버 기반 데이터 베이스(MySQL, PostgreSQL)와는 다르게, 서버가 없는 내장형 데이터베이스이다.
 # 데이터베이스 파일은 하나의 독립적인 파일로 구성된다.
 
+# 메모리에 유지할 id ↔ 경로 매핑의 최대 개수
+PATH_CACHE_SIZE = int(os.getenv("MAFM_PATH_CACHE_SIZE", "100000"))
 
-def initialize_database(db_name="filesystem.db"):
-    # 기존에 db가 존재하면 날림
-    if os.path.exists(db_name):
-        os.remove(db_name)
+# 한 번의 IN (...) 쿼리에 넣을 최대 변수 개수
+_MAX_VARIABLES = 500
 
-    # 데이터베이스 파일에 연결
-    connection = sqlite3.connect("filesystem.db")
 
-    # 커서 생성
-    # 커서는 SQL 문을 실행하고 결과를 처리하는 데 사용되는 객체이다.
-    # cursor.execute() 메소드를 사용해서 데이터베이스에 대한 SQL 쿼리를 실행할 수 있다.
-    cursor = connection.cursor()
+class PathCache:
+    """file_info의 id ↔ 경로 매핑을 LRU 방식으로 유지하는 캐시"""
+
+    def __init__(self, max_entries=PATH_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._paths = OrderedDict()  # id -> 경로
+        self._ids = {}  # 경로 -> id
+
+    def get_path(self, id):
+        path = self._paths.get(id)
+        if path is not None:
+            self._paths.move_to_end(id)
+        return path
+
+    def get_id(self, path):
+        id = self._ids.get(path)
+        if id is not None:
+            self._paths.move_to_end(id)
+        return id
+
+    def put(self, id, path):
+        old_path = self._paths.pop(id, None)
+        if old_path is not None:
+            self._ids.pop(old_path, None)
+        self._paths[id] = path
+        self._ids[path] = id
+        while len(self._paths) > self.max_entries:
+            _, evicted = self._paths.popitem(last=False)
+            self._ids.pop(evicted, None)
+
+    def discard(self, id):
+        path = self._paths.pop(id, None)
+        if path is not None:
+            self._ids.pop(path, None)
+
+    def clear(self):
+        self._paths.clear()
+        self._ids.clear()
+
+    def __len__(self):
+        return len(self._paths)
+
+
+class _Database:
+    __slots__ = ("connection", "cache", "depth", "data_version", "generation")
+
+    def __init__(self, connection, cache):
+        self.connection = connection
+        self.cache = cache
+        self.depth = 0
+        self.data_version = None
+        # 이 프로세스나 다른 프로세스의 commit이 확인될 때마다 증가하는 값
+        self.generation = 0
 
-    # 첫 번째 테이블(file_info) 생성
-    cursor.execute(
+
+class SQLiteConnectionManager:
+    """db 파일마다 하나의 연결을 열어두고 여러 스레드가 공유하도록 하는 클래스
+
+    호출마다 연결을 열고 행마다 commit하는 대신, WAL 모드로 연 연결을 재사용하고
+    transaction()으로 여러 쓰기를 하나의 트랜잭션으로 묶는다. 연결은 RLock으로
+    보호되므로 한 번에 한 스레드만 사용한다.
+
+    db마다 id ↔ 경로 캐시(PathCache)를 함께 관리한다. 이 프로세스의 쓰기는 각 함수에서
+    캐시를 갱신하고, 다른 프로세스(observer와 shell)의 쓰기는 PRAGMA data_version이
+    바뀐 것을 보고 캐시를 비운다.
+    """
+
+    def __init__(self, cache_size=PATH_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        # 절대 경로 -> _Database
+        self._databases = {}
+
+    def _open(self, db_name):
+        key = os.path.abspath(db_name)
+        database = self._databases.get(key)
+        if database is None:
+            # 트랜잭션은 직접 관리하므로 autocommit 모드로 연다
+            connection = sqlite3.connect(
+                key, check_same_thread=False, isolation_level=None, timeout=30
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # 디렉토리 삭제 시 하위 항목과 manifest가 함께 지워지도록 외래 키를 켠다
+            connection.execute("PRAGMA foreign_keys=ON")
+            database = _Database(connection, PathCache(self.cache_size))
+            self._databases[key] = database
+
+        if database.depth == 0:
+            # 다른 연결에서 commit이 있었으면 캐시가 오래된 것일 수 있다
+            version = database.connection.execute("PRAGMA data_version").fetchone()[0]
+            if version != database.data_version:
+                database.cache.clear()
+                database.data_version = version
+                database.generation += 1
+        return database
+
+    @contextmanager
+    def connect(self, db_name):
+        """db_name의 공유 연결을 빌려주는 컨텍스트 매니저 (조회와 단일 쓰기용)"""
+        with self._lock:
+            yield self._open(db_name).connection
+
+    @contextmanager
+    def transaction(self, db_name):
+        """블록 안의 쓰기를 하나의 트랜잭션으로 묶는 컨텍스트 매니저
+
+        중첩되면 안쪽 블록은 savepoint가 되어, 가장 바깥 블록이 끝날 때 한 번만 commit한다.
         """
-        CREATE TABLE IF NOT EXISTS file_info (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_path TEXT NOT NULL,
-            is_dir INTEGER NOT NULL
-        )
+        with self._lock:
+            database = self._open(db_name)
+            connection = database.connection
+            savepoint = f"mafm_{database.depth}"
+            if database.depth == 0:
+                connection.execute("BEGIN IMMEDIATE")
+            else:
+                connection.execute(f"SAVEPOINT {savepoint}")
+            database.depth += 1
+            try:
+                yield connection
+            except BaseException:
+                database.depth -= 1
+                if database.depth == 0:
+                    connection.execute("ROLLBACK")
+                else:
+                    connection.execute(f"ROLLBACK TO {savepoint}")
+                    connection.execute(f"RELEASE {savepoint}")
+                # 되돌린 쓰기가 캐시에 반영되어 있을 수 있다
+                database.cache.clear()
+                raise
+            else:
+                database.depth -= 1
+                if database.depth == 0:
+                    connection.execute("COMMIT")
+                    database.generation += 1
+                else:
+                    connection.execute(f"RELEASE {savepoint}")
+
+    def cache(self, db_name):
+        """db_name의 id ↔ 경로 캐시 (connect/transaction 블록 안에서 사용)"""
+        with self._lock:
+            return self._open(db_name).cache
+
+    def generation(self, db_name):
+        """db 내용이 바뀔 때마다 증가하는 값 (db에서 만든 메모리 캐시의 무효화 확인용)"""
+        with self._lock:
+            return self._open(db_name).generation
+
+    def close(self, db_name):
+        with self._lock:
+            database = self._databases.pop(os.path.abspath(db_name), None)
+            if database is not None:
+                database.connection.close()
+
+    def close_all(self):
+        with self._lock:
+            while self._databases:
+                _, database = self._databases.popitem()
+                try:
+                    database.connection.close()
+                except Exception as e:
+                    print(f"Error closing SQLite connection: {e}")
+
+
+connection_manager = SQLiteConnectionManager()
+
+
+def close_all_connections():
+    """열려 있는 모든 SQLite 연결을 닫는 종료 훅"""
+    connection_manager.close_all()
+
+
+atexit.register(close_all_connections)
+
+
+def transaction(db_name="filesystem.db"):
+    """여러 쓰기 함수를 하나의 트랜잭션으로 묶을 때 사용하는 컨텍스트 매니저"""
+    return connection_manager.transaction(db_name)
+
+
+def _chunks(items):
+    for i in range(0, len(items), _MAX_VARIABLES):
+        yield items[i : i + _MAX_VARIABLES]
+
+
+# file_info는 (부모 id, 이름) 트리로 경로를 저장한다.
+# - 부모가 등록되지 않은 최상위 항목(색인 root)은 parent_id가 NULL이고 name에 절대 경로를 저장한다.
+# - 그 외 항목은 부모 디렉토리의 id와 자신의 이름만 저장하고, 전체 경로는 조회할 때 조립한다.
+# 디렉토리 이동은 한 행의 parent_id/name 수정이고, 하위 트리 삭제는 parent_id 외래 키의
+# ON DELETE CASCADE가 (parent_id, name) 인덱스를 따라 처리한다.
+_CREATE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS file_info (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parent_id INTEGER REFERENCES file_info (id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        is_dir INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_file_info_parent_name
+    ON file_info (parent_id, name)
+    """,
+    # 마지막으로 색인한 시점의 파일 상태를 기록해서, 재시작 시 바뀐 파일만 다시 임베딩한다
     """
+    CREATE TABLE IF NOT EXISTS file_manifest (
+        file_id INTEGER PRIMARY KEY REFERENCES file_info (id) ON DELETE CASCADE,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        content_hash TEXT NOT NULL,
+        chunk_count INTEGER NOT NULL,
+        model_id TEXT NOT NULL
     )
+    """,
+    # 검색 필터용 파일 메타데이터 (rag/filters.py), 벡터 행에도 같은 값이 스칼라 필드로 저장된다
+    """
+    CREATE TABLE IF NOT EXISTS file_metadata (
+        file_id INTEGER PRIMARY KEY REFERENCES file_info (id) ON DELETE CASCADE,
+        extension TEXT NOT NULL,
+        mime_type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL
+    )
+    """,
+    # 디렉토리 라우팅 인덱스 (rag/routing.py)
+    # 파일마다 청크 벡터의 합을 기록하고, 디렉토리마다 직접 속한 파일들의 합을 유지한다
+    """
+    CREATE TABLE IF NOT EXISTS file_summary (
+        file_id INTEGER PRIMARY KEY REFERENCES file_info (id) ON DELETE CASCADE,
+        dir_id INTEGER NOT NULL,
+        chunk_count INTEGER NOT NULL,
+        vector_sum BLOB NOT NULL
+    )
+    """,
+    # 디렉토리가 추가/이동/삭제될 때마다 증가하는 버전 (쉘이 캐시한 agent graph의 무효화용)
+    """
+    CREATE TABLE IF NOT EXISTS mafm_metadata (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS directory_summary (
+        dir_id INTEGER PRIMARY KEY REFERENCES file_info (id) ON DELETE CASCADE,
+        chunk_count INTEGER NOT NULL,
+        vector_sum BLOB NOT NULL
+    )
+    """,
+    # 전문 검색 인덱스 (rag/fulltext.py)
+    # 벡터 DB에 저장한 청크 텍스트를 file_chunk에 같이 저장하고, FTS5 테이블은 file_chunk와
+    # file_info(파일 이름)를 외부 content로 사용한다. 삭제는 외래 키의 CASCADE를 따라 트리거로 반영된다.
+    # vector는 벡터 DB에 압축해서 저장할 때 재채점에 쓰는 float32 벡터다 (rag/quantization.py)
+    """
+    CREATE TABLE IF NOT EXISTS file_chunk (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id INTEGER NOT NULL REFERENCES file_info (id) ON DELETE CASCADE,
+        content TEXT NOT NULL,
+        vector BLOB
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_file_chunk_file_id ON file_chunk (file_id)
+    """,
+)
 
-    # 두 번째 테이블(directory_structure) 생성
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS directory_structure (
-            record_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            id TEXT NOT NULL,
-            dir_path TEXT NOT NULL,
-            parent_dir_path TEXT
-        )
+_CREATE_FTS_TABLES = (
     """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
+        content, content='file_chunk', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
     )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS name_fts USING fts5(
+        name, content='file_info', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_chunk_ai AFTER INSERT ON file_chunk BEGIN
+        INSERT INTO chunk_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_chunk_ad AFTER DELETE ON file_chunk BEGIN
+        INSERT INTO chunk_fts (chunk_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_info_ai AFTER INSERT ON file_info BEGIN
+        INSERT INTO name_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_info_ad AFTER DELETE ON file_info BEGIN
+        INSERT INTO name_fts (name_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS file_info_au AFTER UPDATE OF name ON file_info BEGIN
+        INSERT INTO name_fts (name_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO name_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+)
 
-    # 변경 사항 저장
-    connection.commit()
-    connection.close()
 
+def initialize_database(db_name="filesystem.db", reset=True):
+    # 기존에 db가 존재하면 날림 (reset=False이면 기존 데이터를 유지하고 없는 테이블만 생성)
+    if reset:
+        connection_manager.close(db_name)
+        for path in (db_name, db_name + "-wal", db_name + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
 
-# CREATE 함수 - 데이터 삽입
-def insert_file_info(file_path, is_dir, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
+    # 데이터베이스 파일에 연결
+    with connection_manager.transaction(db_name) as connection:
+        # 커서 생성
+        # 커서는 SQL 문을 실행하고 결과를 처리하는 데 사용되는 객체이다.
+        # cursor.execute() 메소드를 사용해서 데이터베이스에 대한 SQL 쿼리를 실행할 수 있다.
+        cursor = connection.cursor()
+
+        # file_path 열을 가진 이전 스키마는 트리 스키마로 옮긴다
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(file_info)")]
+        if "file_path" in columns:
+            _migrate_path_table(cursor)
+
+        for statement in _CREATE_TABLES:
+            cursor.execute(statement)
+        _create_fts_tables(cursor)
+
+        # vector 열이 없던 이전 file_chunk 테이블에는 열을 추가한다
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(file_chunk)")]
+        if "vector" not in columns:
+            cursor.execute("ALTER TABLE file_chunk ADD COLUMN vector BLOB")
+
+        # db를 새로 만들어도 이전 db의 버전과 겹치지 않도록 현재 시각(ms)에서 시작한다
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO mafm_metadata (key, value)
+            VALUES ('directory_version', ?)
+            """,
+            (int(time.time() * 1000),),
+        )
+
+    connection_manager.cache(db_name).clear()
+
+
+def _create_fts_tables(cursor):
+    """전문 검색용 FTS5 테이블과 트리거를 만드는 함수 (FTS5가 없는 SQLite에서는 건너뛴다)"""
+    has_name_index = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'name_fts'"
+    ).fetchone()
+    try:
+        for statement in _CREATE_FTS_TABLES:
+            cursor.execute(statement)
+    except sqlite3.OperationalError as e:
+        print(f"Full-text index is not available: {e}")
+        return
+    if not has_name_index:
+        # 이미 등록된 파일 이름도 검색되도록 처음 만들 때 다시 색인한다
+        cursor.execute("INSERT INTO name_fts (name_fts) VALUES ('rebuild')")
+
+
+def _bump_directory_version(connection):
+    connection.execute(
+        "UPDATE mafm_metadata SET value = value + 1 WHERE key = 'directory_version'"
+    )
+
+
+def get_directory_version(db_name="filesystem.db"):
+    """디렉토리 구성이 바뀔 때마다 달라지는 버전을 반환하는 함수"""
+    with connection_manager.connect(db_name) as connection:
+        row = connection.execute(
+            "SELECT value FROM mafm_metadata WHERE key = 'directory_version'"
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _migrate_path_table(cursor):
+    """file_info(file_path)와 directory_structure 테이블을 (부모 id, 이름) 트리로 옮기는 함수
+
+    벡터 DB가 file_info의 id를 참조하므로 id는 그대로 유지한다.
+    같은 경로가 여러 번 등록되어 있으면 가장 먼저 등록된 행만 남긴다.
+    """
+    rows = cursor.execute(
+        "SELECT id, file_path, is_dir FROM file_info ORDER BY length(file_path), id"
+    ).fetchall()
+    manifest_rows = []
+    if cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_manifest'"
+    ).fetchone():
+        manifest_rows = cursor.execute(
+            """
+            SELECT file_id, size, mtime, content_hash, chunk_count, model_id
+            FROM file_manifest
+            """
+        ).fetchall()
+
+    cursor.execute("DROP TABLE IF EXISTS file_manifest")
+    cursor.execute("DROP TABLE IF EXISTS directory_structure")
+    cursor.execute("DROP TABLE file_info")
+    for statement in _CREATE_TABLES:
+        cursor.execute(statement)
+
+    # 경로 길이 순서로 넣으므로 부모 디렉토리가 항상 먼저 등록된다
+    ids = {}
+    for id, file_path, is_dir in rows:
+        path = os.path.normpath(file_path)
+        if path in ids:
+            continue
+        parent_id = ids.get(os.path.dirname(path))
+        name = os.path.basename(path) if parent_id is not None else path
+        cursor.execute(
+            "INSERT INTO file_info (id, parent_id, name, is_dir) VALUES (?, ?, ?, ?)",
+            (id, parent_id, name, is_dir),
+        )
+        ids[path] = id
+
+    kept_ids = set(ids.values())
+    cursor.executemany(
         """
-        INSERT INTO file_info (file_path, is_dir)
-        VALUES (?, ?)
+        INSERT INTO file_manifest
+            (file_id, size, mtime, content_hash, chunk_count, model_id)
+        VALUES (?, ?, ?, ?, ?, ?)
         """,
-        (file_path, is_dir),
+        [row for row in manifest_rows if row[0] in kept_ids],
     )
-    cursor.execute("SELECT last_insert_rowid()")
-    rows = cursor.fetchall()
-    connection.commit()
-    connection.close()
-    return rows[0][0]
 
 
-def insert_directory_structure(id, dir_path, parent_dir_path, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        INSERT INTO directory_structure (id, dir_path, parent_dir_path)
-        VALUES (?, ?, ?)
-    """,
-        (id, dir_path, parent_dir_path),
+def database_exists(db_name="filesystem.db"):
+    """색인 데이터가 들어 있는 데이터베이스가 있는지 확인하는 함수"""
+    if not os.path.exists(db_name):
+        return False
+    with connection_manager.connect(db_name) as connection:
+        row = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'file_info'"
+        ).fetchone()
+    return row is not None
+
+
+# 트리 조회 함수
+def _find_ids(connection, cache, paths):
+    """정규화된 경로 목록의 id를 {경로: id}로 반환하는 함수 (등록되지 않은 경로는 제외)
+
+    부모 디렉토리의 id를 먼저 찾은 뒤, 부모별로 이름을 모아서 한 번에 조회한다.
+    디렉토리의 id는 캐시에 남으므로 보통 파일 하나에 한 번의 인덱스 조회로 끝난다.
+    """
+    ids = {}
+    by_parent = {}
+    for path in dict.fromkeys(paths):
+        id = cache.get_id(path)
+        if id is not None:
+            ids[path] = id
+        else:
+            by_parent.setdefault(os.path.dirname(path), []).append(path)
+    if not by_parent:
+        return ids
+
+    parent_ids = _find_ids(
+        connection,
+        cache,
+        [parent for parent, children in by_parent.items() if children != [parent]],
+    )
+
+    top_level = []
+    for parent, children in by_parent.items():
+        parent_id = parent_ids.get(parent)
+        if parent_id is None:
+            top_level.extend(children)
+            continue
+        names = {os.path.basename(path): path for path in children}
+        for part in _chunks(list(names)):
+            rows = connection.execute(
+                f"SELECT name, id FROM file_info "
+                f"WHERE parent_id = ? AND name IN ({', '.join('?' * len(part))})",
+                [parent_id, *part],
+            ).fetchall()
+            for name, id in rows:
+                ids[names[name]] = id
+                cache.put(id, names[name])
+
+    # 부모가 등록되지 않은 경로는 최상위 항목일 수 있다
+    for part in _chunks(top_level):
+        rows = connection.execute(
+            f"SELECT name, id FROM file_info "
+            f"WHERE parent_id IS NULL AND name IN ({', '.join('?' * len(part))})",
+            part,
+        ).fetchall()
+        for path, id in rows:
+            ids[path] = id
+            cache.put(id, path)
+    return ids
+
+
+def _path_of(id, rows, paths, cache=None):
+    """rows({id: (부모 id, 이름)})를 따라 올라가며 id의 전체 경로를 조립하는 함수"""
+    chain = []
+    path = None
+    while id is not None:
+        path = paths.get(id)
+        if path is None and cache is not None:
+            path = cache.get_path(id)
+        if path is not None:
+            break
+        if id not in rows:
+            return None  # 부모가 지워진 항목
+        parent_id, name = rows[id]
+        chain.append((id, name))
+        id = parent_id
+
+    for child_id, name in reversed(chain):
+        path = name if path is None else os.path.join(path, name)
+        paths[child_id] = path
+        if cache is not None:
+            cache.put(child_id, path)
+    return path
+
+
+def _materialize(connection, cache, ids):
+    """id 목록의 전체 경로를 {id: 경로}로 반환하는 함수
+
+    캐시에 없는 id와 그 조상을 트리의 한 단계씩 묶어서 조회한다.
+    """
+    paths = {}
+    rows = {}
+    missing = []
+    for id in dict.fromkeys(ids):
+        path = cache.get_path(id)
+        if path is None:
+            missing.append(id)
+        else:
+            paths[id] = path
+
+    while missing:
+        parents = []
+        for part in _chunks(missing):
+            fetched = connection.execute(
+                f"SELECT id, parent_id, name FROM file_info "
+                f"WHERE id IN ({', '.join('?' * len(part))})",
+                part,
+            ).fetchall()
+            for id, parent_id, name in fetched:
+                rows[id] = (parent_id, name)
+                if (
+                    parent_id is not None
+                    and parent_id not in rows
+                    and cache.get_path(parent_id) is None
+                ):
+                    parents.append(parent_id)
+        missing = list(dict.fromkeys(parents))
+
+    for id in list(rows):
+        _path_of(id, rows, paths, cache)
+    return paths
+
+
+def _all_paths(connection, where=""):
+    """조건에 맞는 모든 항목의 전체 경로를 한 번의 조회로 조립하는 함수"""
+    rows = {
+        id: (parent_id, name)
+        for id, parent_id, name in connection.execute(
+            f"SELECT id, parent_id, name FROM file_info {where}"
+        )
+    }
+    paths = {}
+    for id in rows:
+        _path_of(id, rows, paths)
+    return paths
+
+
+def _move(connection, cache, id, dest_path):
+    """항목 하나를 dest_path로 옮기는 함수 (하위 항목은 부모 id를 따라 함께 옮겨진다)"""
+    dest_path = os.path.normpath(dest_path)
+    parent = os.path.dirname(dest_path)
+    parent_id = None
+    if parent != dest_path:
+        parent_id = _find_ids(connection, cache, [parent]).get(parent)
+    name = os.path.basename(dest_path) if parent_id is not None else dest_path
+    connection.execute(
+        "UPDATE file_info SET parent_id = ?, name = ? WHERE id = ?",
+        (parent_id, name, id),
     )
-    connection.commit()
-    connection.close()
+
+
+# CREATE 함수 - 데이터 삽입
+def insert_file_info(file_path, is_dir, db_name="filesystem.db"):
+    """파일 정보를 등록하고 id를 반환하는 함수 (이미 등록된 경로면 기존 id를 반환)"""
+    return insert_file_infos([(file_path, is_dir)], db_name)[0]
+
+
+def insert_file_infos(rows, db_name="filesystem.db"):
+    """[(경로, is_dir), ...]를 한 트랜잭션으로 등록하고 같은 순서의 id 목록을 반환하는 함수
+
+    부모 디렉토리가 먼저 등록되어야 하므로, 목록 안에서 부모가 함께 등록되는 항목은
+    부모를 넣은 다음 단계에서 넣는다.
+    """
+    if not rows:
+        return []
+    paths = [os.path.normpath(file_path) for file_path, _ in rows]
+    is_dirs = {path: is_dir for path, (_, is_dir) in zip(paths, rows)}
+    with connection_manager.transaction(db_name) as connection:
+        cache = connection_manager.cache(db_name)
+        ids = {}
+        pending = list(is_dirs)
+        while pending:
+            ids.update(_find_ids(connection, cache, pending))
+            pending = [path for path in pending if path not in ids]
+            if not pending:
+                break
+
+            waiting = set(pending)
+            parent_ids = _find_ids(
+                connection,
+                cache,
+                [os.path.dirname(path) for path in pending if os.path.dirname(path) != path],
+            )
+            ready = []
+            for path in pending:
+                parent = os.path.dirname(path)
+                if parent in waiting and parent != path:
+                    continue
+                parent_id = parent_ids.get(parent)
+                name = os.path.basename(path) if parent_id is not None else path
+                ready.append((parent_id, name, is_dirs[path]))
+            connection.executemany(
+                "INSERT INTO file_info (parent_id, name, is_dir) VALUES (?, ?, ?)",
+                ready,
+            )
+            if any(is_dir for _, _, is_dir in ready):
+                _bump_directory_version(connection)
+    return [ids[path] for path in paths]
 
 
 # READ 함수 - 데이터 조회
 def get_file_info(db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM file_info")
-    rows = cursor.fetchall()
-    connection.close()
-    return rows
+    """등록된 모든 항목을 [(id, 경로, is_dir), ...]로 반환하는 함수"""
+    with connection_manager.connect(db_name) as connection:
+        paths = _all_paths(connection)
+        rows = connection.execute("SELECT id, is_dir FROM file_info").fetchall()
+    return [(id, paths[id], is_dir) for id, is_dir in rows if paths.get(id)]
 
 
 def get_path_by_id(id, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute("SELECT file_path FROM file_info WHERE id = ?", (id,))
-    rows = cursor.fetchall()
-    connection.close()
-    file_path = rows[0][0]
+    file_path = get_paths_by_ids([id], db_name)[0]
+    if file_path is None:
+        raise IndexError(f"No file_info row with id {id}")
     return file_path
 
 
+def get_paths_by_ids(ids, db_name="filesystem.db"):
+    """id 목록에 대응하는 경로 목록을 같은 순서로 반환하는 함수 (없는 id는 None)"""
+    with connection_manager.connect(db_name) as connection:
+        paths = _materialize(connection, connection_manager.cache(db_name), ids)
+    return [paths.get(id) for id in ids]
+
+
 def get_id_by_path(path, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute("SELECT id FROM file_info WHERE file_path = ?", (path,))
-    rows = cursor.fetchall()
-    connection.close()
-    print("rows ========", rows)
-    file_path = rows[0][0]
-    return file_path
+    id = find_id_by_path(path, db_name)
+    if id is None:
+        raise IndexError(f"No file_info row for {path}")
+    return id
 
 
-def get_directory_structure(db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute("SELECT dir_path FROM directory_structure")
-    rows = cursor.fetchall()
-    connection.close()
-    ret_list = []
-    for row in rows:
-        ret_list.append(row[0])
-    return ret_list
+def find_id_by_path(path, db_name="filesystem.db"):
+    """경로의 id를 반환하는 함수 (없으면 None)"""
+    return get_ids_by_paths([path], db_name).get(path)
 
 
-# UPDATE 함수 - 데이터 수정
-def update_file_info(id, new_file_path, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        UPDATE file_info
-        SET file_path = ?
-        WHERE id = ?
-    """,
-        (new_file_path, id),
-    )
-    connection.commit()
-    connection.close()
+def get_ids_by_paths(paths, db_name="filesystem.db"):
+    """경로 목록에 대해 등록된 경로만 {경로: id}로 반환하는 함수"""
+    normalized = {path: os.path.normpath(path) for path in paths}
+    with connection_manager.connect(db_name) as connection:
+        ids = _find_ids(
+            connection, connection_manager.cache(db_name), list(normalized.values())
+        )
+    return {path: ids[norm] for path, norm in normalized.items() if norm in ids}
 
 
-def update_directory_structure(record_id, new_dir_path, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        UPDATE file_info
-        SET dir_path = ?
-        WHERE record_id = ?
-    """,
-        (new_dir_path, record_id),
-    )
-    connection.commit()
-    connection.close()
+def get_manifest(db_name="filesystem.db"):
+    """색인된 파일들의 manifest를 {경로: (id, 크기, 수정 시각, 해시, 청크 수, 모델 id)}로 반환하는 함수
 
+    manifest가 없는 파일(감시 중 추가되었지만 기록되지 않은 파일 등)은 크기/시각을 -1로 채운다.
+    청크가 있는데 라우팅 요약이 없는 파일(라우팅 인덱스 도입 전에 색인된 파일)과 검색 필터용
+    메타데이터가 없는 파일(메타데이터 도입 전에 색인된 파일)은 다시 임베딩되도록 해시도 비운다.
+    """
+    with connection_manager.connect(db_name) as connection:
+        paths = _all_paths(connection)
+        rows = connection.execute(
+            """
+            SELECT f.id, m.size, m.mtime, m.content_hash, m.chunk_count, m.model_id,
+                   s.file_id IS NOT NULL, d.file_id IS NOT NULL
+            FROM file_info f
+            LEFT JOIN file_manifest m ON m.file_id = f.id
+            LEFT JOIN file_summary s ON s.file_id = f.id
+            LEFT JOIN file_metadata d ON d.file_id = f.id
+            WHERE f.is_dir = 0
+            """
+        ).fetchall()
+    manifest = {}
+    for (
+        id,
+        size,
+        mtime,
+        content_hash,
+        chunk_count,
+        model_id,
+        has_summary,
+        has_metadata,
+    ) in rows:
+        if not paths.get(id):
+            continue
+        if size is None or (chunk_count and not has_summary) or not has_metadata:
+            size, mtime, content_hash = -1, -1, None
+        manifest[paths[id]] = (id, size, mtime, content_hash, chunk_count or 0, model_id)
+    return manifest
+
+
+def get_manifest_entry(file_id, db_name="filesystem.db"):
+    """파일 하나의 manifest를 (크기, 수정 시각, 해시, 청크 수, 모델 id)로 반환하는 함수 (없으면 None)"""
+    with connection_manager.connect(db_name) as connection:
+        return connection.execute(
+            """
+            SELECT size, mtime, content_hash, chunk_count, model_id
+            FROM file_manifest WHERE file_id = ?
+            """,
+            (file_id,),
+        ).fetchone()
 
-# DELETE 함수 - 데이터 삭제
-def delete_file_info(record_id, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        DELETE FROM file_info
-        WHERE record_id = ?
-    """,
-        (record_id,),
+
+def upsert_manifest(
+    file_id, size, mtime, content_hash, chunk_count, model_id, db_name="filesystem.db"
+):
+    upsert_manifests(
+        [(file_id, size, mtime, content_hash, chunk_count, model_id)], db_name
     )
-    connection.commit()
-    connection.close()
 
 
-def change_directory_path(dir_src_path, dir_dest_path, db_name="filesystem.db"):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        UPDATE directory_structure
-        SET dir_path = ?
-        WHERE dir_path = ?
-    """,
-        (dir_dest_path, dir_src_path),
-    )
-    cursor.execute(
-        """
-        SELECT file_path FROM file_info WHERE file_path LIKE ?
-        """,
-        (f"{dir_src_path}%",),
-    )
-    rows = cursor.fetchall()
+def upsert_manifests(rows, db_name="filesystem.db"):
+    """[(file_id, 크기, 수정 시각, 해시, 청크 수, 모델 id), ...]를 한 트랜잭션으로 기록하는 함수"""
+    if not rows:
+        return
+    with connection_manager.transaction(db_name) as connection:
+        connection.executemany(
+            """
+            INSERT OR REPLACE INTO file_manifest
+                (file_id, size, mtime, content_hash, chunk_count, model_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
 
-    # 각 레코드에 대해 dir_path를 업데이트합니다.
-    for (file_path,) in rows:
-        new_file_path = file_path.replace(dir_src_path, dir_dest_path, 1)
-        cursor.execute(
+
+def upsert_file_metadata(rows, db_name="filesystem.db"):
+    """[(파일 id, describe_file()의 결과), ...]를 file_metadata에 저장하는 함수"""
+    if not rows:
+        return
+    with connection_manager.transaction(db_name) as connection:
+        connection.executemany(
             """
-            UPDATE file_info
-            SET file_path = ?
-            WHERE file_path = ?
+            INSERT OR REPLACE INTO file_metadata (file_id, extension, mime_type, size, mtime)
+            VALUES (?, ?, ?, ?, ?)
             """,
-            (new_file_path, file_path),
+            [
+                (id, meta["extension"], meta["mime_type"], meta["size"], meta["mtime"])
+                for id, meta in rows
+            ],
         )
-    connection.commit()
-    connection.close()
 
 
-def change_file_path(file_src_path, file_dest_path, db_name):
-    connection = sqlite3.connect(db_name)
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        UPDATE file_info
-        SET file_path = ?
-        WHERE file_path = ?
-        """,
-        (file_dest_path, file_src_path),
-    )
-    connection.commit()
-    connection.close()
+def get_file_metadata(file_id, db_name="filesystem.db"):
+    """파일의 메타데이터를 describe_file()과 같은 형태로 반환하는 함수 (없으면 None)"""
+    with connection_manager.connect(db_name) as connection:
+        row = connection.execute(
+            "SELECT extension, mime_type, size, mtime FROM file_metadata WHERE file_id = ?",
+            (file_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(("extension", "mime_type", "size", "mtime"), row))
 
 
-def delete_directory_and_subdirectories(dir_path):
-    connection = sqlite3.connect("filesystem.db")
-    cursor = connection.cursor()
+def delete_manifest(file_id, db_name="filesystem.db"):
+    with connection_manager.transaction(db_name) as connection:
+        connection.execute("DELETE FROM file_manifest WHERE file_id = ?", (file_id,))
 
-    # directory_structure 테이블에서 dir_path가 포함된 모든 레코드 삭제
-    cursor.execute(
-        """
-        DELETE FROM directory_structure
-        WHERE dir_path LIKE ?
-        """,
-        (f"{dir_path}%",),
-    )
 
-    # file_info 테이블에서 file_path가 dir_path로 시작하는 모든 레코드 삭제
-    cursor.execute(
-        """
-        DELETE FROM file_info
-        WHERE file_path LIKE ?
+def _is_directory(connection, id):
+    row = connection.execute("SELECT is_dir FROM file_info WHERE id = ?", (id,)).fetchone()
+    return bool(row and row[0] == 1)
+
+
+def get_directory_id(dir_path, db_name="filesystem.db"):
+    """디렉토리 경로의 id를 반환하는 함수 (없으면 None)"""
+    id = find_id_by_path(dir_path, db_name)
+    if id is None:
+        return None
+    with connection_manager.connect(db_name) as connection:
+        return id if _is_directory(connection, id) else None
+
+
+def get_subdirectory_ids(dir_path, db_name="filesystem.db"):
+    """디렉토리 자신과 모든 하위 디렉토리의 id 목록을 반환하는 함수"""
+    id = get_directory_id(dir_path, db_name)
+    if id is None:
+        return []
+    with connection_manager.connect(db_name) as connection:
+        rows = connection.execute(
+            """
+            WITH RECURSIVE subtree(id) AS (
+                SELECT ?
+                UNION ALL
+                SELECT f.id FROM file_info f
+                JOIN subtree s ON f.parent_id = s.id
+                WHERE f.is_dir = 1
+            )
+            SELECT id FROM subtree
+            """,
+            (id,),
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def get_directory_structure(db_name="filesystem.db"):
+    """등록된 모든 디렉토리의 경로 목록을 반환하는 함수"""
+    with connection_manager.connect(db_name) as connection:
+        # 디렉토리의 부모는 항상 디렉토리이므로 디렉토리 행만으로 경로를 조립할 수 있다
+        paths = _all_paths(connection, "WHERE is_dir = 1")
+    ret_list = []
+    for path in paths.values():
+        ret_list.append(path)
+    return ret_list
+
+
+# UPDATE 함수 - 데이터 수정
+def update_file_info(id, new_file_path, db_name="filesystem.db"):
+    with connection_manager.transaction(db_name) as connection:
+        cache = connection_manager.cache(db_name)
+        _move(connection, cache, id, new_file_path)
+        # 디렉토리라면 하위 항목의 경로도 바뀌므로 캐시를 모두 비운다
+        cache.clear()
+        if _is_directory(connection, id):
+            _bump_directory_version(connection)
+
+
+# DELETE 함수 - 데이터 삭제
+def delete_file_info(record_id, db_name="filesystem.db"):
+    # manifest와 (디렉토리라면) 하위 항목은 외래 키로 함께 삭제된다
+    with connection_manager.transaction(db_name) as connection:
+        if _is_directory(connection, record_id):
+            _bump_directory_version(connection)
+        connection.execute(
+            """
+            DELETE FROM file_info
+            WHERE id = ?
         """,
-        (f"{dir_path}%",),
-    )
+            (record_id,),
+        )
+        connection_manager.cache(db_name).discard(record_id)
+
+
+def change_directory_path(dir_src_path, dir_dest_path, db_name="filesystem.db"):
+    """디렉토리 경로를 바꾸는 함수
+
+    하위 항목은 부모 id만 참조하므로 디렉토리 한 행만 수정하면 된다.
+    """
+    with connection_manager.transaction(db_name) as connection:
+        cache = connection_manager.cache(db_name)
+        src_path = os.path.normpath(dir_src_path)
+        id = _find_ids(connection, cache, [src_path]).get(src_path)
+        if id is None:
+            return
+        _move(connection, cache, id, dir_dest_path)
+        cache.clear()
+        _bump_directory_version(connection)
+
+
+def change_file_path(file_src_path, file_dest_path, db_name="filesystem.db"):
+    with connection_manager.transaction(db_name) as connection:
+        cache = connection_manager.cache(db_name)
+        src_path = os.path.normpath(file_src_path)
+        id = _find_ids(connection, cache, [src_path]).get(src_path)
+        if id is None:
+            return
+        _move(connection, cache, id, file_dest_path)
+        cache.put(id, os.path.normpath(file_dest_path))
+
+
+def delete_directory_and_subdirectories(dir_path, db_name="filesystem.db"):
+    with connection_manager.transaction(db_name) as connection:
+        cache = connection_manager.cache(db_name)
+        path = os.path.normpath(dir_path)
+        id = _find_ids(connection, cache, [path]).get(path)
+        if id is not None:
+            # 하위 디렉토리, 파일, manifest는 parent_id 외래 키를 따라 함께 삭제된다
+            connection.execute("DELETE FROM file_info WHERE id = ?", (id,))
+            _bump_directory_version(connection)
+        cache.clear()
 
-    # 변경 사항을 커밋
-    conn.commit()
     print(f"Deleted all records related to {dir_path} and its subdirectories.")
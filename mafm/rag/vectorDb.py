@@ -1,74 +1,207 @@
-import ast
-import gc
+import atexit
 import os
-from pymilvus import (
-    MilvusClient,
-    connections,
-    Collection,
-    FieldSchema,
-    CollectionSchema,
-    DataType,
+from concurrent.futures import ThreadPoolExecutor
+from .ann import IndexMaintainer
+from .embedding import embedding, embed_queries
+from .routing import add_file_vectors, remove_file_vectors
+from .fulltext import (
+    CHUNKS_PER_FILE,
+    add_chunks,
+    remove_files,
+    lexical_rankings,
+    reciprocal_rank_fusion,
 )
-from .embedding import embedding
-from .sqlite import get_path_by_id
+from .filters import combine_expressions
+from .quantization import (
+    RESCORE_FACTOR,
+    is_compressed,
+    rescoring_enabled,
+    to_blob,
+    get_chunk_vectors,
+    rescore,
+)
+from .vector_store import COLLECTION_NAME, get_vector_store
+from .sqlite import (
+    get_paths_by_ids,
+    get_directory_id,
+    get_subdirectory_ids,
+    get_directory_structure,
+)
+
+# 벡터 저장 방식
+# "directory": 디렉토리마다 <디렉토리>/<디렉토리 이름>.db 파일을 만든다 (기본값)
+# "consolidated": INDEX_DIR 아래의 고정된 개수의 샤드 파일에 모든 벡터를 저장하고,
+#                 각 행의 dir_id 필드(디렉토리의 file_info id)로 디렉토리를 구분한다
+VECTOR_STORAGE_MODE = os.getenv("MAFM_VECTOR_STORAGE", "directory")
+INDEX_DIR = os.path.expanduser(os.getenv("MAFM_INDEX_DIR", "~/.mafm/index"))
+INDEX_SHARDS = max(1, int(os.getenv("MAFM_INDEX_SHARDS", "1")))
+
+# 직접 검색(msearch)에서 반환할 파일 수와 동시에 검색할 디렉토리 인덱스 수
+SEARCH_LIMIT = int(os.getenv("MAFM_SEARCH_LIMIT", "10"))
+SEARCH_WORKERS = int(os.getenv("MAFM_SEARCH_WORKERS", "8"))
+
+# 디렉토리 단위 검색(search)에서 질의마다 반환할 파일 수와 최소 점수 (설정하지 않으면 거르지 않음)
+SEARCH_TOP_K = int(os.getenv("MAFM_SEARCH_TOP_K", "2"))
+SEARCH_THRESHOLD = (
+    float(os.environ["MAFM_SEARCH_THRESHOLD"])
+    if os.getenv("MAFM_SEARCH_THRESHOLD")
+    else None
+)
+# 검색 방식
+# "hybrid": 벡터 검색과 전문 검색(BM25)을 함께 실행하고 Reciprocal Rank Fusion으로 합친다 (기본값)
+# "vector": 벡터 검색만 사용한다
+# "lexical": 전문 검색만 사용한다 (임베딩 모델을 거치지 않는다)
+SEARCH_MODE = os.getenv("MAFM_SEARCH_MODE", "hybrid")
 
 
-def delete_db_lock_file(db_name):
-    dir_path = os.path.dirname(db_name)
-    base_name = os.path.basename(db_name)
+# 벡터 DB 저장소 (MAFM_VECTOR_BACKEND)
+vector_store = get_vector_store()
 
-    lock_file = f"{dir_path}/.{base_name}.lock"
-    if os.path.exists(lock_file):
-        os.remove(lock_file)
-    else:
-        print(f"No lock file found for {lock_file}")
+# 삽입 뒤 컬렉션 크기에 맞춰 ANN 인덱스를 (다시) 만든다 (MAFM_ANN_INDEX)
+index_maintainer = IndexMaintainer(vector_store)
+
+
+def close_all_clients():
+    """열려 있는 모든 벡터 DB 클라이언트(파일)를 닫는 종료 훅"""
+    vector_store.close_all()
+
+
+atexit.register(close_all_clients)
+
+
+def get_db_name(dir_path):
+    """디렉토리에 대응하는 벡터 DB 이름을 반환하는 함수"""
+    return dir_path + "/" + os.path.basename(dir_path) + ".db"
+
+
+def is_consolidated():
+    return VECTOR_STORAGE_MODE == "consolidated"
+
+
+def get_shard_db_name(dir_id):
+    """디렉토리 id가 속하는 중앙 인덱스 샤드 파일 경로를 반환하는 함수"""
+    return os.path.join(INDEX_DIR, f"mafm_index_{dir_id % INDEX_SHARDS}.db")
+
+
+def _resolve(db_name):
+    """디렉토리 db_name을 실제 저장 위치 (db 파일, dir_id)로 변환하는 함수
+
+    directory 모드에서는 db_name을 그대로 사용하고 dir_id는 None이다.
+    consolidated 모드에서 디렉토리가 등록되어 있지 않으면 (None, None)을 반환한다.
+    """
+    if not is_consolidated():
+        return db_name, None
+
+    dir_id = get_directory_id(os.path.dirname(db_name))
+    if dir_id is None:
+        return None, None
+    shard_db = get_shard_db_name(dir_id)
+    _ensure_shard_collection(shard_db)
+    return shard_db, dir_id
+
+
+def _ensure_shard_collection(shard_db):
+    os.makedirs(os.path.dirname(shard_db), exist_ok=True)
+    if vector_store.has_collection(shard_db):
+        return
+
+    # 디렉토리 구분을 위해 dir_id 스칼라 필드를 추가한 컬렉션
+    # (Milvus Lite는 partition key를 지원하지 않으므로 filter로 디렉토리를 구분한다)
+    vector_store.create_collection(shard_db, with_dir_id=True)
+
+
+def reset_vector_store():
+    """consolidated 모드에서 모든 샤드의 컬렉션을 비우는 함수 (전체 재색인 시 사용)"""
+    if not is_consolidated():
+        return
+
+    for shard in range(INDEX_SHARDS):
+        shard_db = os.path.join(INDEX_DIR, f"mafm_index_{shard}.db")
+        if not os.path.exists(shard_db):
+            continue
+        try:
+            vector_store.drop_collection(shard_db)
+        except Exception as e:
+            print(f"Error resetting vector store shard {shard_db}: {e}")
+
+
+def move_vector_db(dir_src_path, dir_dest_path):
+    """디렉토리 이동 시 벡터 DB를 새 위치에 맞게 정리하는 함수
+
+    consolidated 모드에서는 dir_id가 그대로 유지되므로 할 일이 없다.
+    directory 모드에서는 이동 전 경로로 열린 클라이언트를 닫고,
+    디렉토리 이름이 바뀐 경우 <새 이름>.db로 파일 이름을 맞춘다.
+    """
+    if is_consolidated():
+        return
+
+    vector_store.release(get_db_name(dir_src_path))
+    vector_store.release_under(dir_src_path)
+
+    src_name = os.path.basename(dir_src_path) + ".db"
+    old_db = os.path.join(dir_dest_path, src_name)
+    new_db = get_db_name(dir_dest_path)
+    if old_db != new_db and os.path.exists(old_db):
+        os.rename(old_db, new_db)
+        old_lock = os.path.join(dir_dest_path, f".{src_name}.lock")
+        if os.path.exists(old_lock):
+            os.remove(old_lock)
 
 
 def initialize_vector_db(db_name):
-    client = None
+    if is_consolidated():
+        # 중앙 인덱스는 한 번만 만들고, 새 디렉토리는 dir_id로만 구분한다
+        for shard in range(INDEX_SHARDS):
+            _ensure_shard_collection(
+                os.path.join(INDEX_DIR, f"mafm_index_{shard}.db")
+            )
+        return
+
     try:
-        # Milvus에 연결
-        client = MilvusClient(db_name)
+        # 컬렉션 생성 => RDB의 테이블과 비슷한 개념 (이미 있으면 지우고 새로 만든다)
+        vector_store.create_collection(db_name)
         print(f"Connected to {db_name}")
-
-        # 컬렉션 스키마 정의 => RDB의 테이블과 비슷한 개념
-        if client.has_collection(collection_name="demo_collection"):
-            client.drop_collection(collection_name="demo_collection")
-
-        client.create_collection(
-            collection_name="demo_collection",
-            dimension=384,  #  384 Adjust dimension as needed
-        )
     except Exception as e:
         print(f"Error initializing vector DB for {db_name}: {e}")
-    finally:
-        if client is not None:
-            client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
 
 
 def delete_vector_db(db_name):
+    if is_consolidated():
+        # 하위 디렉토리까지 포함한 dir_id를 샤드별로 모아서 삭제
+        dir_ids_by_shard = {}
+        for dir_id in get_subdirectory_ids(os.path.dirname(db_name)):
+            dir_ids_by_shard.setdefault(get_shard_db_name(dir_id), []).append(dir_id)
+        for shard_db, dir_ids in dir_ids_by_shard.items():
+            try:
+                _ensure_shard_collection(shard_db)
+                vector_store.delete(
+                    shard_db, f"dir_id in [{', '.join(map(str, dir_ids))}]"
+                )
+                print(f"Deleted vectors of {db_name} from {shard_db}")
+            except Exception as e:
+                print(f"Error deleting vectors of {db_name} from {shard_db}: {e}")
+        return
+
     try:
-        client = MilvusClient(db_name)
-        if client.has_collection(collection_name="demo_collection"):
-            client.drop_collection(collection_name="demo_collection")
-            print(f"Collection 'demo_collection' in {db_name} has been deleted.")
+        if vector_store.drop_collection(db_name):
+            print(f"Collection '{COLLECTION_NAME}' in {db_name} has been deleted.")
         else:
-            print(f"Collection 'demo_collection' does not exist in {db_name}")
+            print(f"Collection '{COLLECTION_NAME}' does not exist in {db_name}")
     except Exception as e:
         print(f"Error deleting collection in {db_name}: {e}")
     finally:
-        client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
+        vector_store.release(db_name)
 
 
-def save(db_name, id, queries):
+def save(db_name, id, queries, metadata=None, append=False):
+    """청크들을 임베딩해서 저장하는 함수 (metadata: describe_file()의 결과로, 각 행에 함께 저장)
+
+    append가 True이면 같은 파일의 앞선 청크들에 이어서 저장한다 (청크를 나눠서 저장하는 경우).
+    """
     try:
-        client = MilvusClient(db_name)
-        if not client.has_collection(collection_name="demo_collection"):
-            print(f"Collection 'demo_collection' does not exist in {db_name}")
+        target_db, dir_id = _resolve(db_name)
+        if target_db is None or not vector_store.has_collection(target_db):
+            print(f"Collection '{COLLECTION_NAME}' does not exist in {db_name}")
             return
 
         # 쿼리 임베딩
@@ -79,10 +212,19 @@ def save(db_name, id, queries):
             {"id": id, "vector": query_embeddings[i], "word": queries[i]}
             for i in range(len(query_embeddings))
         ]
+        if metadata:
+            for row in data:
+                row.update(metadata)
+        if dir_id is not None:
+            for row in data:
+                row["dir_id"] = dir_id
 
         # 데이터 삽입
-        res = client.insert(collection_name="demo_collection", data=data)
+        res = vector_store.insert(target_db, data)
         print(res)
+        index_maintainer.check(target_db)
+        _update_routing(db_name, dir_id, {id: query_embeddings}, append)
+        _update_fulltext(data, query_embeddings)
 
     except MemoryError as me:
         print(f"MemoryError: {me}")
@@ -90,21 +232,30 @@ def save(db_name, id, queries):
         print(f"ValueError: {ve}")
     except Exception as e:
         print(f"Error occurred during saving data to Milvus: {e}")
-    finally:
-        client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
 
 
 def insert_file_embedding(file_data, db_name):
     try:
-        client = MilvusClient(db_name)
-        if not client.has_collection(collection_name="demo_collection"):
-            print(f"Collection 'demo_collection' does not exist in {db_name}")
+        target_db, dir_id = _resolve(db_name)
+        if target_db is None or not vector_store.has_collection(target_db):
+            print(f"Collection '{COLLECTION_NAME}' does not exist in {db_name}")
             return
 
+        for row in file_data:
+            row.pop("chunk_id", None)  # 자동 발급되는 기본 키는 다시 넣을 수 없다
+            if dir_id is not None:
+                row["dir_id"] = dir_id
+
         # 데이터 삽입
-        res = client.insert(collection_name="demo_collection", data=file_data)
+        vector_store.insert(target_db, file_data)
+        index_maintainer.check(target_db)
+
+        vectors = [row["vector"] for row in file_data]
+        vectors_by_file = {}
+        for row, vector in zip(file_data, vectors):
+            vectors_by_file.setdefault(row["id"], []).append(vector)
+        _update_routing(db_name, dir_id, vectors_by_file)
+        _update_fulltext(file_data, vectors)
 
     except MemoryError as me:
         print(f"MemoryError: {me}")
@@ -112,74 +263,379 @@ def insert_file_embedding(file_data, db_name):
         print(f"ValueError: {ve}")
     except Exception as e:
         print(f"Error occurred during saving data to Milvus: {e}")
-    finally:
-        client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
 
 
-def search(db_name, query_list):
+def _update_routing(db_name, dir_id, vectors_by_file, append=False):
+    """새로 삽입한 벡터를 디렉토리 라우팅 인덱스에 반영하는 함수"""
     try:
-        client = MilvusClient(db_name)
-        if not client.has_collection(collection_name="demo_collection"):
-            print(f"Collection 'demo_collection' does not exist in {db_name}")
-            return
-
-        query_vectors = embedding(query_list)
+        if dir_id is None:
+            dir_id = get_directory_id(os.path.dirname(db_name))
+        if dir_id is not None:
+            add_file_vectors(dir_id, vectors_by_file, append=append)
+    except Exception as e:
+        print(f"Error updating routing index for {db_name}: {e}")
 
-        res = client.search(
-            collection_name="demo_collection",
-            data=query_vectors,
-            limit=2,
-        )
-        id_list = [item["id"] for item in res[0]]
-        path_list = [get_path_by_id(id, "filesystem.db") for id in id_list]
-        return path_list
-    finally:
-        client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
 
+def _update_fulltext(rows, vectors):
+    """벡터 DB에 삽입한 청크 텍스트(word)를 전문 검색 인덱스에도 저장하는 함수
 
-def find_by_id(search_id, db_name):
+    벡터를 압축해서 저장하고 재채점을 쓰는 경우 원래 정밀도의 벡터도 함께 저장한다.
+    """
     try:
-        client = MilvusClient(db_name)
-        collection_name = "demo_collection"
+        if rescoring_enabled(vector_store.encoding):
+            add_chunks(
+                [
+                    (row["id"], row.get("word"), to_blob(vector))
+                    for row, vector in zip(rows, vectors)
+                ]
+            )
+        else:
+            add_chunks([(row["id"], row.get("word")) for row in rows])
+    except Exception as e:
+        print(f"Error updating full-text index: {e}")
+
+
+def insert_embeddings(results, metadata=None):
+    """BatchEmbedder의 결과를 db별로 모아서 한 번에 삽입하는 함수
+
+    results: [((db_name, id), 청크 목록, 벡터 목록), ...]
+    metadata: {id: describe_file()의 결과} (각 행에 검색 필터용 스칼라 필드로 저장)
+    """
+    metadata = metadata or {}
+    rows_by_db = {}
+    for (db_name, id), chunks, vectors in results:
+        rows = rows_by_db.setdefault(db_name, [])
+        fields = metadata.get(id, {})
+        rows.extend(
+            {"id": id, "vector": vector, "word": chunk, **fields}
+            for chunk, vector in zip(chunks, vectors)
+        )
 
-        if not client.has_collection(collection_name):
-            print(f"Collection '{collection_name}' does not exist in {db_name}")
+    for db_name, rows in rows_by_db.items():
+        if rows:
+            insert_file_embedding(rows, db_name)
+
+
+def _aggregate_hits(hits, aggregate="max"):
+    """청크 단위 검색 결과 [(파일 id, 점수), ...]를 파일 단위 {파일 id: 점수}로 합치는 함수
+
+    aggregate가 "max"이면 가장 잘 맞는 청크의 점수를, "sum"이면 맞은 청크 점수의 합을 쓴다.
+    """
+    scores = {}
+    for id, score in hits:
+        if id not in scores:
+            scores[id] = score
+        elif aggregate == "sum":
+            scores[id] += score
+        elif score > scores[id]:
+            scores[id] = score
+    return scores
+
+
+def _rank(scores, top_k, threshold=None):
+    """점수 내림차순으로 정렬하고 threshold 미만을 버린 상위 후보를 반환하는 함수
+
+    그 사이 삭제되어 경로가 없는 파일을 걸러낼 수 있도록 top_k보다 조금 더 남긴다.
+    """
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if threshold is not None:
+        ranked = [(id, score) for id, score in ranked if score >= threshold]
+    return ranked[: top_k * 2]
+
+
+def _chunk_limit(limit):
+    """파일 limit개를 찾기 위해 벡터 DB에서 가져올 청크 수
+
+    한 파일의 청크가 여러 개 걸릴 수 있으므로 넉넉히 가져오고,
+    재채점할 때는 압축된 벡터의 오차를 고려해 후보를 더 가져온다.
+    """
+    limit *= CHUNKS_PER_FILE
+    if rescoring_enabled(vector_store.encoding):
+        limit *= RESCORE_FACTOR
+    return limit
+
+
+def _vector_ranking(query_vector, hits, top_k, threshold=None, aggregate="max"):
+    """청크 단위 벡터 검색 결과를 파일 단위 순위로 만드는 함수
+
+    재채점을 쓰면 1차 점수로 고른 후보를 원래 정밀도의 벡터로 다시 점수 매긴 뒤 순위를 정한다.
+    """
+    hits = list(hits)
+    scores = _aggregate_hits(hits, aggregate)
+    if rescoring_enabled(vector_store.encoding):
+        hit_counts = {}
+        for id, _ in hits:
+            hit_counts[id] = hit_counts.get(id, 0) + 1
+        candidates = _rank(scores, top_k * RESCORE_FACTOR)
+        scores = rescore(query_vector, candidates, aggregate, hit_counts)
+    return _rank(scores, top_k, threshold)
+
+
+def _fuse(vector_ranking, lexical, top_k, mode):
+    """검색 방식에 맞게 벡터 순위와 전문 검색 순위들을 하나의 순위로 만드는 함수"""
+    if mode == "vector":
+        return vector_ranking
+    rankings = lexical if mode == "lexical" else [vector_ranking] + lexical
+    return reciprocal_rank_fusion(rankings)[: top_k * 2]
+
+
+def _with_paths(rankings, top_k):
+    """질의별 [(파일 id, 점수), ...] 순위의 경로를 한 번에 조회해서 [(경로, 점수), ...]로 바꾸는 함수"""
+    # 그 사이 삭제되어 경로가 없는 id는 제외
+    ids = list(dict.fromkeys(id for ranked in rankings for id, _ in ranked))
+    paths = dict(zip(ids, get_paths_by_ids(ids, "filesystem.db")))
+    return [
+        [(paths[id], float(score)) for id, score in ranked if paths[id] is not None][
+            :top_k
+        ]
+        for ranked in rankings
+    ]
+
+
+def search_many(
+    db_name,
+    query_list,
+    top_k=SEARCH_TOP_K,
+    threshold=SEARCH_THRESHOLD,
+    aggregate="max",
+    mode=SEARCH_MODE,
+    search_filter=None,
+):
+    """여러 질의를 한 번에 임베딩하고 검색해서 질의마다 파일 단위 결과를 반환하는 함수
+
+    반환: 질의 순서대로 [[(경로, 점수), ...], ...] (질의마다 최대 top_k개, 점수 내림차순)
+    모든 질의의 경로는 SQLite에서 한 번에 조회한다.
+    점수는 "vector" 방식에서는 코사인 유사도, 그 외에는 RRF 점수이며,
+    threshold는 벡터 검색 결과에만 적용한다.
+    search_filter(SearchFilter)는 벡터 DB와 전문 검색의 질의 안에서 평가되어 후보를 먼저 줄인다.
+    """
+    target_db, dir_id = _resolve(db_name)
+    try:
+        has_vectors = target_db is not None and vector_store.has_collection(target_db)
+    except Exception as e:
+        print(f"Error opening {target_db}: {e}")
+        has_vectors = False
+    if not has_vectors and mode != "lexical":
+        print(f"Collection '{COLLECTION_NAME}' does not exist in {db_name}")
+        if mode == "vector":
+            return
+        mode = "lexical"  # 전문 검색 결과만이라도 반환
+    if not query_list or top_k <= 0:
+        return [[] for _ in query_list]
+
+    vector_rankings = [[] for _ in query_list]
+    if mode != "lexical":
+        query_vectors = embed_queries(query_list)
+        if not query_vectors:
             return
 
-        res = client.query(
-            collection_name=collection_name, filter=f"id in [{search_id}]"
+        # consolidated 모드에서는 dir_id 필터로 디렉토리 단위 검색을 유지
+        expression = combine_expressions(
+            f"dir_id == {dir_id}" if dir_id is not None else "",
+            search_filter.to_expression() if search_filter is not None else "",
         )
+        try:
+            res = vector_store.search(
+                target_db, query_vectors, _chunk_limit(top_k), expression
+            )
+        except Exception as e:
+            # 검색에 실패해도 (전문 검색 결과나 빈 결과로) 계속한다
+            print(f"Error searching {target_db}: {e}")
+            res = [[] for _ in query_vectors]
+        vector_rankings = [
+            _vector_ranking(vector, hits, top_k, threshold, aggregate)
+            for vector, hits in zip(query_vectors, res)
+        ]
 
-        if not res:
-            print(f"No results found for ID: {search_id}")
-            return
-        return res
-    finally:
-        client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
+    if mode != "vector":
+        if dir_id is None:
+            dir_id = get_directory_id(os.path.dirname(db_name))
+        dir_ids = [dir_id] if dir_id is not None else []
+        vector_rankings = [
+            _fuse(
+                ranked,
+                lexical_rankings(query, top_k * 2, dir_ids, search_filter),
+                top_k,
+                mode,
+            )
+            for query, ranked in zip(query_list, vector_rankings)
+        ]
+    return _with_paths(vector_rankings, top_k)
+
+
+def search(
+    db_name,
+    query_list,
+    top_k=SEARCH_TOP_K,
+    threshold=SEARCH_THRESHOLD,
+    aggregate="max",
+    mode=SEARCH_MODE,
+    search_filter=None,
+):
+    """질의들로 검색한 파일 경로를 (질의 사이의 중복 없이) 점수 내림차순으로 반환하는 함수"""
+    results = search_many(
+        db_name, query_list, top_k, threshold, aggregate, mode, search_filter
+    )
+    if results is None:
+        return
+    best = {}
+    for ranked in results:
+        for path, score in ranked:
+            if score > best.get(path, float("-inf")):
+                best[path] = score
+    return sorted(best, key=best.get, reverse=True)
+
+
+def _scope_ids(directories):
+    """검색할 디렉토리와 그 하위 디렉토리의 id 목록 (directories가 None이면 전체를 뜻하는 None)"""
+    if directories is None:
+        return None
+    dir_ids = []
+    for directory in directories:
+        dir_ids.extend(get_subdirectory_ids(os.path.normpath(directory)))
+    return list(dict.fromkeys(dir_ids))
+
+
+def _search_targets(dir_ids):
+    """검색할 디렉토리 id 목록을 [(db 파일, filter), ...]로 변환하는 함수
+
+    dir_ids가 None이면 등록된 모든 디렉토리를 검색한다.
+    아직 벡터 DB가 만들어지지 않은 디렉토리는 건너뛴다.
+    """
+    if is_consolidated():
+        if dir_ids is None:
+            shards = [
+                os.path.join(INDEX_DIR, f"mafm_index_{shard}.db")
+                for shard in range(INDEX_SHARDS)
+            ]
+            return [(shard_db, "") for shard_db in shards if os.path.exists(shard_db)]
+
+        # 샤드마다 한 번만 dir_id 필터로 검색한다
+        dir_ids_by_shard = {}
+        for dir_id in dir_ids:
+            dir_ids_by_shard.setdefault(get_shard_db_name(dir_id), set()).add(dir_id)
+        return [
+            (shard_db, f"dir_id in [{', '.join(map(str, sorted(ids)))}]")
+            for shard_db, ids in dir_ids_by_shard.items()
+            if os.path.exists(shard_db)
+        ]
 
+    if dir_ids is None:
+        dir_paths = get_directory_structure()
+    else:
+        dir_paths = [path for path in get_paths_by_ids(dir_ids) if path]
+    db_names = (get_db_name(dir_path) for dir_path in dir_paths)
+    return [(db_name, "") for db_name in db_names if os.path.exists(db_name)]
 
-def remove_by_id(remove_id, db_name):
+
+def _search_target(target, query_vector, limit, expression=""):
+    db_name, scope = target
     try:
-        client = MilvusClient(db_name)
-        collection_name = "demo_collection"
-        if not client.has_collection(collection_name):
-            raise Exception(
-                f"Collection '{collection_name}' does not exist in {db_name}"
+        if not vector_store.has_collection(db_name):
+            return []
+        return vector_store.search(
+            db_name, [query_vector], limit, combine_expressions(scope, expression)
+        )[0]
+    except Exception as e:
+        print(f"Error searching {db_name}: {e}")
+        return []
+
+
+def _search_vectors(query, dir_ids, limit, threshold, aggregate, search_filter=None):
+    """질의를 한 번 임베딩해서 디렉토리 인덱스들을 동시에 검색하고 파일 단위 순위를 반환하는 함수"""
+    targets = _search_targets(dir_ids)
+    if not targets:
+        return []
+
+    query_vectors = embed_queries([query])
+    if not query_vectors:
+        return []
+    query_vector = query_vectors[0]
+
+    chunk_limit = _chunk_limit(limit)
+    expression = search_filter.to_expression() if search_filter is not None else ""
+    if len(targets) == 1:
+        results = [_search_target(targets[0], query_vector, chunk_limit, expression)]
+    else:
+        workers = max(1, min(SEARCH_WORKERS, len(targets)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    lambda target: _search_target(
+                        target, query_vector, chunk_limit, expression
+                    ),
+                    targets,
+                )
             )
 
-        res = client.delete(
-            collection_name=collection_name, filter=f"id in [{remove_id}]"
+    hits = (hit for hits in results for hit in hits)
+    return _vector_ranking(query_vector, hits, limit, threshold, aggregate)
+
+
+def search_directories(
+    query,
+    directories=None,
+    limit=SEARCH_LIMIT,
+    threshold=None,
+    aggregate="max",
+    mode=SEARCH_MODE,
+    search_filter=None,
+):
+    """LLM 에이전트를 거치지 않고 디렉토리 인덱스들을 바로 검색하는 함수
+
+    모든(또는 선택한 디렉토리와 그 하위) 디렉토리를 검색해서 파일 단위로 합친
+    [(경로, 점수), ...]를 점수 내림차순으로 반환한다. 검색 방식(mode), 점수와
+    search_filter는 search_many와 같다. "lexical" 방식은 임베딩 모델을 전혀 사용하지 않는다.
+    """
+    if limit <= 0:
+        return []
+    dir_ids = _scope_ids(directories)
+    if dir_ids is not None and not dir_ids:
+        return []
+
+    ranked = []
+    if mode != "lexical":
+        ranked = _search_vectors(
+            query, dir_ids, limit, threshold, aggregate, search_filter
         )
+    if mode != "vector":
+        lexical = lexical_rankings(query, limit * 2, dir_ids, search_filter)
+        ranked = _fuse(ranked, lexical, limit, mode)
+    return _with_paths([ranked], limit)[0]
 
-        print(f"Deleted records with ID: {remove_id}")
-        return res
-    finally:
-        client.close()
-        gc.collect()
-        delete_db_lock_file(db_name)
+
+def find_by_id(search_id, db_name):
+    target_db, _ = _resolve(db_name)
+    if target_db is None or not vector_store.has_collection(target_db):
+        print(f"Collection '{COLLECTION_NAME}' does not exist in {db_name}")
+        return
+
+    res = vector_store.query(target_db, f"id in [{search_id}]")
+
+    if not res:
+        print(f"No results found for ID: {search_id}")
+        return
+
+    if is_compressed(vector_store.encoding):
+        # 다른 곳에 다시 삽입할 수 있도록 압축을 푼 벡터 대신 원래 정밀도의 벡터를 돌려준다
+        stored = get_chunk_vectors(search_id)
+        for row in res:
+            vector = stored.get(row.get("word"))
+            if vector is not None:
+                row["vector"] = vector
+    return res
+
+
+def remove_by_id(remove_id, db_name):
+    target_db, _ = _resolve(db_name)
+    if target_db is None or not vector_store.has_collection(target_db):
+        raise Exception(
+            f"Collection '{COLLECTION_NAME}' does not exist in {db_name}"
+        )
+
+    res = vector_store.delete(target_db, f"id in [{remove_id}]")
+    remove_file_vectors([remove_id])
+    remove_files([remove_id])
+
+    print(f"Deleted records with ID: {remove_id}")
+    return res
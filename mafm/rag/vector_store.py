@@ -0,0 +1,457 @@
+import gc
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pymilvus import MilvusClient, DataType
+from .ann import ANN_NPROBE
+from .quantization import (
+    VECTOR_DIMENSION,
+    VECTOR_ENCODING,
+    encode_vector,
+    decode_vector,
+    similarity_from_distance,
+)
+
+COLLECTION_NAME = "demo_collection"
+
+# 벡터 저장소 구현
+# "milvus": Milvus Lite db 파일에 저장한다 (기본값)
+# "numpy": 메모리 맵 float32 행렬 파일에 저장하고 행렬 곱 한 번으로 검색한다 (rag/numpy_store.py)
+VECTOR_BACKEND = os.getenv("MAFM_VECTOR_BACKEND", "milvus").lower()
+
+# 동시에 열어둘 수 있는 Milvus Lite 클라이언트 수와 유휴 클라이언트를 닫기까지의 시간(초)
+MAX_OPEN_CLIENTS = int(os.getenv("MAFM_MAX_OPEN_CLIENTS", "32"))
+CLIENT_IDLE_TIMEOUT = float(os.getenv("MAFM_CLIENT_IDLE_TIMEOUT", "300"))
+
+# 벡터 저장 형식(MAFM_VECTOR_ENCODING)별 벡터 필드 타입, 인덱스 종류와 거리
+_VECTOR_FIELDS = {
+    "float32": (DataType.FLOAT_VECTOR, "FLAT", "COSINE"),
+    "float16": (DataType.FLOAT16_VECTOR, "FLAT", "COSINE"),
+    "binary": (DataType.BINARY_VECTOR, "BIN_FLAT", "HAMMING"),
+}
+
+
+class VectorStore(ABC):
+    """벡터 DB 구현이 제공해야 하는 연산 (rag/vectorDb.py는 이 인터페이스만 사용한다)
+
+    abstractmethod는 모든 구현이 제공해야 하고 (하나라도 빠지면 객체를 만들 때 TypeError),
+    나머지는 인덱스나 열어둔 자원이 없는 저장소의 기본 동작이다.
+
+    db_name은 저장 위치(파일 또는 디렉토리 경로)이고, 한 위치에는 컬렉션이 하나만 있다.
+    행은 {"id": 파일 id, "vector": float 벡터, "word": 청크 텍스트, 그 밖의 스칼라 필드} 형태이고,
+    filter 식은 Milvus 문법의 부분 집합(and로 묶은 in, like, ==, <=, >= 비교)이다.
+    """
+
+    # 저장하는 벡터 형식 (압축 형식이면 검색 결과를 원래 정밀도의 벡터로 재채점한다)
+    encoding = "float32"
+
+    @abstractmethod
+    def has_collection(self, db_name):
+        """db_name에 컬렉션이 있는지 확인하는 함수"""
+
+    @abstractmethod
+    def create_collection(self, db_name, with_dir_id=False):
+        """컬렉션을 (이미 있으면 지우고) 새로 만드는 함수"""
+
+    @abstractmethod
+    def drop_collection(self, db_name):
+        """컬렉션을 지우는 함수 (컬렉션이 있었으면 True)"""
+
+    @abstractmethod
+    def insert(self, db_name, rows):
+        """행들을 컬렉션에 삽입하는 함수"""
+
+    @abstractmethod
+    def search(self, db_name, query_vectors, limit, expression="", search_params=None):
+        """질의마다 [(파일 id, 점수), ...]를 점수 내림차순으로 반환하는 함수 (점수는 클수록 가까움)
+
+        search_params로 인덱스의 검색 파라미터를 바꿀 수 있다.
+        ({"nprobe": n}, 또는 전수 검색과 같은 결과를 얻는 {"exact": True})
+        """
+
+    @abstractmethod
+    def query(self, db_name, expression):
+        """filter 식에 맞는 행들을 float 벡터와 함께 반환하는 함수"""
+
+    @abstractmethod
+    def delete(self, db_name, expression):
+        """filter 식에 맞는 행들을 지우는 함수"""
+
+    def supported_indexes(self, db_name):
+        """db_name에서 만들 수 있는 인덱스 종류 (rag/ann.py)"""
+        return ("flat",)
+
+    @abstractmethod
+    def row_count(self, db_name):
+        """컬렉션의 행 수를 반환하는 함수"""
+
+    def index_info(self, db_name):
+        """현재 인덱스 설정 (choose_index()의 형식, flat이면 None)"""
+        return None
+
+    @abstractmethod
+    def build_index(self, db_name, config):
+        """config(choose_index()의 결과)대로 인덱스를 다시 만드는 함수
+
+        지금은 만들 수 없으면(사용 중 등) False를 반환하고, 다음 확인 때 다시 시도한다.
+        """
+
+    def release(self, db_name):
+        """db_name에 대해 열어둔 자원을 닫는 함수"""
+
+    def release_under(self, dir_path):
+        """dir_path 아래의 저장 위치들에 대해 열어둔 자원을 닫는 함수"""
+
+    def close_idle(self):
+        """오래 사용하지 않은 자원을 닫는 함수"""
+
+    def close_all(self):
+        """열어둔 모든 자원을 닫는 함수"""
+
+
+def delete_db_lock_file(db_name):
+    dir_path = os.path.dirname(db_name)
+    base_name = os.path.basename(db_name)
+
+    lock_file = f"{dir_path}/.{base_name}.lock"
+    if os.path.exists(lock_file):
+        os.remove(lock_file)
+    else:
+        print(f"No lock file found for {lock_file}")
+
+
+class MilvusClientPool:
+    """db 파일별 MilvusClient를 LRU 방식으로 재사용하는 클래스
+
+    호출마다 클라이언트를 열고 닫는 대신 최근에 사용한 클라이언트를 최대 max_clients개까지
+    열어두고, 컬렉션 존재 여부도 캐시한다. 한도를 넘거나 오래 사용하지 않은 클라이언트는
+    닫으면서 lock 파일을 정리한다.
+    """
+
+    def __init__(self, max_clients=MAX_OPEN_CLIENTS, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.max_clients = max(1, max_clients)
+        self.idle_timeout = idle_timeout
+        self._lock = threading.RLock()
+        # 클라이언트를 반납하거나 독점 사용이 끝났음을 알린다
+        self._changed = threading.Condition(self._lock)
+        # db_name -> [client, 마지막 사용 시각, 사용 중인 횟수]
+        self._clients = OrderedDict()
+        # db_name -> 독점 사용 중인 스레드 id (exclusive())
+        self._exclusive = {}
+        # db_name -> 컬렉션 존재 여부
+        self._collections = {}
+
+    @contextmanager
+    def connect(self, db_name):
+        """db_name에 대한 클라이언트를 빌려주는 컨텍스트 매니저"""
+        entry = self._acquire(db_name)
+        try:
+            yield entry[0]
+        except BaseException:
+            # 오류가 난 클라이언트는 상태를 알 수 없으므로 반납 후 닫는다
+            self._release(db_name, entry, broken=True)
+            raise
+        else:
+            self._release(db_name, entry)
+
+    @contextmanager
+    def exclusive(self, db_name):
+        """db_name을 아무도 쓰고 있지 않으면 독점하는 컨텍스트 매니저 (독점했으면 True)
+
+        독점하는 동안 다른 스레드의 connect(db_name)는 실패하지 않고 끝날 때까지 기다린다.
+        """
+        with self._lock:
+            entry = self._clients.get(db_name)
+            acquired = db_name not in self._exclusive and (entry is None or entry[2] == 0)
+            if acquired:
+                self._exclusive[db_name] = threading.get_ident()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with self._lock:
+                    del self._exclusive[db_name]
+                    self._changed.notify_all()
+
+    def _acquire(self, db_name):
+        with self._lock:
+            while self._exclusive.get(db_name, threading.get_ident()) != threading.get_ident():
+                self._changed.wait()
+            entry = self._clients.get(db_name)
+            if entry is None:
+                entry = [MilvusClient(db_name), time.monotonic(), 0]
+                self._clients[db_name] = entry
+            self._clients.move_to_end(db_name)
+            entry[2] += 1
+            self._evict()
+            return entry
+
+    def _release(self, db_name, entry, broken=False):
+        with self._lock:
+            entry[1] = time.monotonic()
+            entry[2] -= 1
+            self._changed.notify_all()
+            if broken:
+                self._collections.pop(db_name, None)
+                if self._clients.get(db_name) is entry and entry[2] == 0:
+                    del self._clients[db_name]
+                    self._close(db_name, entry[0])
+            self._evict()
+
+    def _evict(self):
+        # 한도를 넘은 만큼 가장 오래 사용하지 않은 클라이언트부터 닫는다 (사용 중인 클라이언트 제외)
+        overflow = len(self._clients) - self.max_clients
+        for name in list(self._clients):
+            if overflow <= 0:
+                break
+            entry = self._clients[name]
+            if entry[2] > 0:
+                continue
+            del self._clients[name]
+            self._close(name, entry[0])
+            overflow -= 1
+
+    def _close(self, db_name, client):
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Error closing Milvus client for {db_name}: {e}")
+        gc.collect()
+        delete_db_lock_file(db_name)
+
+    def has_collection(self, db_name, collection_name=COLLECTION_NAME):
+        """컬렉션 존재 여부를 캐시를 통해 확인하는 함수"""
+        with self._lock:
+            exists = self._collections.get(db_name)
+        if exists is None:
+            with self.connect(db_name) as client:
+                exists = client.has_collection(collection_name=collection_name)
+            with self._lock:
+                self._collections[db_name] = exists
+        return exists
+
+    def set_collection_exists(self, db_name, exists):
+        with self._lock:
+            self._collections[db_name] = exists
+
+    def release(self, db_name):
+        """db_name의 클라이언트를 닫고 캐시에서 제거하는 함수"""
+        with self._lock:
+            self._collections.pop(db_name, None)
+            entry = self._clients.pop(db_name, None)
+            if entry is not None:
+                self._close(db_name, entry[0])
+
+    def release_under(self, dir_path):
+        """dir_path 아래에 있는 db 파일들의 클라이언트를 모두 닫는 함수"""
+        prefix = dir_path.rstrip("/") + "/"
+        with self._lock:
+            for name in [n for n in self._clients if n.startswith(prefix)]:
+                self.release(name)
+
+    def close_idle(self):
+        """idle_timeout 동안 사용하지 않은 클라이언트를 닫는 함수"""
+        now = time.monotonic()
+        with self._lock:
+            for name, entry in list(self._clients.items()):
+                if entry[2] == 0 and now - entry[1] >= self.idle_timeout:
+                    del self._clients[name]
+                    self._close(name, entry[0])
+
+    def close_all(self):
+        with self._lock:
+            while self._clients:
+                name, entry = self._clients.popitem(last=False)
+                self._close(name, entry[0])
+            self._collections.clear()
+
+
+class MilvusVectorStore(VectorStore):
+    """Milvus Lite db 파일마다 컬렉션 하나를 두는 저장소
+
+    클라이언트는 MilvusClientPool로 재사용하고, 벡터는 encoding 형식으로 바꿔서 저장한다.
+    """
+
+    def __init__(self, encoding=VECTOR_ENCODING, pool=None):
+        self.encoding = encoding
+        self.pool = pool or MilvusClientPool()
+        # db_name -> 인덱스 설정 (describe_index 결과를 캐시)
+        self._indexes = {}
+
+    def has_collection(self, db_name):
+        return self.pool.has_collection(db_name)
+
+    def create_collection(self, db_name, with_dir_id=False):
+        with self.pool.connect(db_name) as client:
+            if client.has_collection(collection_name=COLLECTION_NAME):
+                client.drop_collection(collection_name=COLLECTION_NAME)
+            self._create_collection(client, with_dir_id)
+        self.pool.set_collection_exists(db_name, True)
+        self._indexes.pop(db_name, None)
+
+    def _create_collection(self, client, with_dir_id=False):
+        """저장 형식에 맞는 벡터 필드를 가진 컬렉션을 만드는 함수
+
+        청크마다 기본 키를 자동 발급하고 파일 id는 일반 필드로 둔다
+        (중복 기본 키는 filter 삭제가 일부 누락된다).
+        """
+        data_type, index_type, metric_type = _VECTOR_FIELDS[self.encoding]
+        schema = MilvusClient.create_schema(auto_id=True, enable_dynamic_field=True)
+        schema.add_field("chunk_id", DataType.INT64, is_primary=True)
+        schema.add_field("id", DataType.INT64)
+        schema.add_field("vector", data_type, dim=VECTOR_DIMENSION)
+        if with_dir_id:
+            schema.add_field("dir_id", DataType.INT64)
+        index_params = client.prepare_index_params()
+        index_params.add_index(
+            field_name="vector", index_type=index_type, metric_type=metric_type
+        )
+        client.create_collection(
+            collection_name=COLLECTION_NAME,
+            schema=schema,
+            index_params=index_params,
+            consistency_level="Strong",
+        )
+
+    def drop_collection(self, db_name):
+        with self.pool.connect(db_name) as client:
+            exists = client.has_collection(collection_name=COLLECTION_NAME)
+            if exists:
+                client.drop_collection(collection_name=COLLECTION_NAME)
+        self.pool.set_collection_exists(db_name, False)
+        self._indexes.pop(db_name, None)
+        return exists
+
+    def insert(self, db_name, rows):
+        if self.encoding != "float32":
+            rows = [
+                {**row, "vector": encode_vector(row["vector"], self.encoding)}
+                for row in rows
+            ]
+        with self.pool.connect(db_name) as client:
+            return client.insert(collection_name=COLLECTION_NAME, data=rows)
+
+    def search(self, db_name, query_vectors, limit, expression="", search_params=None):
+        params = {}
+        index = self.index_info(db_name)
+        search_params = search_params or {}
+        if index is not None and index["type"] == "ivf":
+            nprobe = index["nlist"] if search_params.get("exact") else None
+            params["nprobe"] = nprobe or search_params.get("nprobe", index["nprobe"])
+        with self.pool.connect(db_name) as client:
+            res = client.search(
+                collection_name=COLLECTION_NAME,
+                data=[encode_vector(vector, self.encoding) for vector in query_vectors],
+                filter=expression,
+                limit=limit,
+                output_fields=["id"],
+                search_params={"params": params},
+            )
+        return [
+            [
+                (
+                    item["entity"].get("id", item["id"]),
+                    similarity_from_distance(item["distance"], self.encoding),
+                )
+                for item in hits
+            ]
+            for hits in res
+        ]
+
+    def query(self, db_name, expression):
+        with self.pool.connect(db_name) as client:
+            rows = client.query(collection_name=COLLECTION_NAME, filter=expression)
+        for row in rows:
+            row["vector"] = decode_vector(row["vector"], self.encoding)
+        return rows
+
+    def delete(self, db_name, expression):
+        with self.pool.connect(db_name) as client:
+            return client.delete(collection_name=COLLECTION_NAME, filter=expression)
+
+    def supported_indexes(self, db_name):
+        # Milvus Lite(로컬 db 파일)는 float32 벡터에만 IVF_FLAT을 만들 수 있다
+        if self.encoding != "float32":
+            return ("flat",)
+        return ("flat", "ivf")
+
+    def row_count(self, db_name):
+        with self.pool.connect(db_name) as client:
+            return client.get_collection_stats(collection_name=COLLECTION_NAME)[
+                "row_count"
+            ]
+
+    def index_info(self, db_name):
+        """Milvus는 segment마다 인덱스를 따로 만들어 두므로, 행 수가 늘어도 다시 만들 필요가
+        없다 (rows가 None). 인덱스 종류가 바뀔 때만 다시 만든다."""
+        if db_name not in self._indexes:
+            with self.pool.connect(db_name) as client:
+                described = client.describe_index(
+                    collection_name=COLLECTION_NAME, index_name="vector"
+                )
+            index_type = (described or {}).get("index_type", "")
+            index = None
+            if index_type == "IVF_FLAT":
+                nlist = int(described["nlist"])
+                index = {"type": "ivf", "rows": None, "nlist": nlist, "nprobe": min(ANN_NPROBE, nlist)}
+            self._indexes[db_name] = index
+        return self._indexes[db_name]
+
+    def build_index(self, db_name, config):
+        """Milvus Lite는 인덱스를 바꾸려면 컬렉션을 내려야(release) 하므로, 아무도 이 db를 쓰고
+        있지 않을 때만 독점해서 바꾼다. 바꾸는 동안의 검색과 삽입은 실패하지 않고 기다린다.
+        쓰고 있는 중이면 바꾸지 않고 False를 반환한다 (다음 확인 때 다시 시도한다).
+        """
+        _, flat_index, metric_type = _VECTOR_FIELDS[self.encoding]
+        index_type, params = flat_index, {}
+        if config["type"] == "ivf":
+            index_type, params = "IVF_FLAT", {"nlist": config["nlist"]}
+
+        with self.pool.exclusive(db_name) as acquired:
+            if not acquired:
+                return False
+            with self.pool.connect(db_name) as client:
+                client.release_collection(collection_name=COLLECTION_NAME)
+                try:
+                    client.drop_index(collection_name=COLLECTION_NAME, index_name="vector")
+                    index_params = client.prepare_index_params()
+                    index_params.add_index(
+                        field_name="vector",
+                        index_type=index_type,
+                        metric_type=metric_type,
+                        params=params,
+                    )
+                    client.create_index(
+                        collection_name=COLLECTION_NAME, index_params=index_params
+                    )
+                finally:
+                    client.load_collection(collection_name=COLLECTION_NAME)
+            self._indexes.pop(db_name, None)
+        return True
+
+    def release(self, db_name):
+        self.pool.release(db_name)
+        self._indexes.pop(db_name, None)
+
+    def release_under(self, dir_path):
+        self.pool.release_under(dir_path)
+
+    def close_idle(self):
+        self.pool.close_idle()
+
+    def close_all(self):
+        self.pool.close_all()
+
+
+def get_vector_store(backend=VECTOR_BACKEND):
+    """backend 이름에 맞는 벡터 저장소를 만드는 함수"""
+    if backend == "milvus":
+        return MilvusVectorStore()
+    if backend == "numpy":
+        from .numpy_store import NumpyVectorStore
+
+        return NumpyVectorStore()
+    raise ValueError(f"unknown vector backend: {backend}")
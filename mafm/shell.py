@@ -2,23 +2,69 @@ import os
 import subprocess
 import tempfile
 import time
-from rag.fileops import make_soft_links, get_file_data
+from rag.fileops import make_soft_links
 from rag.sqlite import (
     initialize_database,
     insert_file_info,
-    insert_directory_structure,
 )
 from rag.vectorDb import (
     initialize_vector_db,
     save,
+    close_all_clients,
+    search_directories,
+    SEARCH_LIMIT,
+    SEARCH_MODE,
 )
-from rag.embedding import initialize_model
+from rag.filters import SearchFilter
+from rag.embedding import initialize_model, get_query_cache_stats
 from agent.graph import graph
 
 
 link_dir = None
 
 
+def parse_msearch_args(args):
+    """msearch 인자를 (질의, 디렉토리 목록, 결과 수, 검색 방식, 필터)로 나누는 함수
+
+    msearch [-k <개수>] [-m hybrid|vector|lexical] [-d <디렉토리>]... [-f <조건>]... <query>
+    조건 예: ext=pdf,docx  mime=image/  size<1M  modified>7d  modified<2024-01-01
+    """
+    directories = []
+    conditions = []
+    limit = SEARCH_LIMIT
+    mode = SEARCH_MODE
+    while len(args) >= 2 and args[0] in ("-d", "-k", "-m", "-f"):
+        if args[0] == "-f":
+            conditions.append(args[1])
+        elif args[0] == "-d":
+            directories.append(os.path.abspath(os.path.expanduser(args[1])))
+        elif args[0] == "-m":
+            if args[1] not in ("hybrid", "vector", "lexical"):
+                raise ValueError(f"unknown search mode: {args[1]}")
+            mode = args[1]
+        else:
+            limit = int(args[1])
+        args = args[2:]
+    search_filter = SearchFilter.parse(conditions) if conditions else None
+    return " ".join(args), directories or None, limit, mode, search_filter
+
+
+def show_links(paths, temp_dir_path):
+    """검색된 파일들의 소프트 링크를 임시 디렉토리에 만들고 그 디렉토리로 이동하는 함수"""
+    global link_dir
+
+    # 임시 디렉토리 생성
+    temp_dir = tempfile.TemporaryDirectory(dir=temp_dir_path)
+
+    # 소프트 링크 생성
+    result = make_soft_links(paths, temp_dir)
+    print(f"Soft links created: {result}")
+
+    # 디렉토리 변경 및 링크 디렉토리 갱신
+    os.chdir(temp_dir.name)
+    link_dir = temp_dir
+
+
 def execute_command(command, root_dir):
     global link_dir
 
@@ -38,17 +84,42 @@ def execute_command(command, root_dir):
 
             prompt = " ".join(cmd_parts[1:])
             paths = graph(root_dir, prompt)
+            show_links(paths, temp_dir_path)
+            return
 
-            # 임시 디렉토리 생성
-            temp_dir = tempfile.TemporaryDirectory(dir=temp_dir_path)
-
-            # 소프트 링크 생성
-            result = make_soft_links(paths, temp_dir)
-            print(f"Soft links created: {result}")
+        elif cmd_parts[0] == "msearch":
+            # 에이전트(LLM) 없이 벡터 인덱스를 바로 검색
+            try:
+                query, directories, limit, mode, search_filter = parse_msearch_args(
+                    cmd_parts[1:]
+                )
+            except ValueError as e:
+                print(f"msearch: {e}")
+                query = ""
+            if not query:
+                print(
+                    "msearch: missing arguments. "
+                    "Usage: msearch [-k <count>] [-m hybrid|vector|lexical] "
+                    "[-d <directory>]... [-f <filter>]... <query>"
+                )
+                return
 
-            # 디렉토리 변경 및 링크 디렉토리 갱신
-            os.chdir(temp_dir.name)
-            link_dir = temp_dir
+            start = time.perf_counter()
+            results = search_directories(
+                query, directories, limit, mode=mode, search_filter=search_filter
+            )
+            elapsed = (time.perf_counter() - start) * 1000
+            for path, score in results:
+                print(f"{score:.4f}  {path}")
+            print(f"{len(results)} results in {elapsed:.1f} ms")
+            cache_stats = get_query_cache_stats()
+            if cache_stats is not None:
+                print(
+                    f"query cache: hit {cache_stats['hits']}, miss {cache_stats['misses']} "
+                    f"(hit rate {cache_stats['hit_rate']:.1%})"
+                )
+            if results:
+                show_links([path for path, _ in results], temp_dir_path)
             return
 
         elif cmd_parts[0] == "cd":
@@ -99,6 +170,7 @@ def shell(root_dir: str):
 
         if command.strip().lower() in ["exit", "quit"]:
             print("쉘 종료 중...")
+            close_all_clients()
             break
         elif command.strip() == "":
             continue
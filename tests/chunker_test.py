@@ -0,0 +1,52 @@
+import pytest
+from mafm.rag import chunker
+from mafm.rag.chunker import chunk_text, token_spans
+from mafm.rag.extractor import read_text
+
+
+@pytest.fixture(autouse=True)
+def approx_tokens(monkeypatch):
+    # 모델 토크나이저 대신 근사 토큰(영문 단어 하나, 그 밖의 글자 하나)으로 센다
+    monkeypatch.setattr(chunker, "get_tokenizer", lambda: None)
+
+
+def count(text):
+    return len(token_spans(text))
+
+
+def test_chunks_respect_token_limit_and_sentences():
+    sentences = [f"sentence number {i} has a few words." for i in range(40)]
+    text = " ".join(sentences)
+
+    chunks = chunk_text(text, max_tokens=30, overlap=8)
+    assert all(count(chunk) <= 30 for chunk in chunks)
+    # 문장 중간에서 자르지 않고, 모든 문장이 어딘가에 들어 있다
+    assert all(chunk.endswith(".") for chunk in chunks)
+    assert all(any(s in chunk for chunk in chunks) for s in sentences)
+    # 다음 청크는 이전 청크의 마지막 문장으로 시작한다
+    assert chunks[1].startswith(chunks[0].split(". ")[-1])
+
+
+def test_paragraphs_and_long_sentences():
+    text = "first paragraph is short.\n\n" + "word " * 100 + "\n\nlast one."
+
+    chunks = chunk_text(text, max_tokens=40, overlap=10)
+    assert chunks[0] == "first paragraph is short."
+    assert all(count(chunk) <= 40 for chunk in chunks)
+    assert chunks[-1].endswith("last one.")
+    assert sum(chunk.count("word") for chunk in chunks) >= 100
+    assert chunk_text("  \n ") == []
+
+
+def test_korean_text_is_not_split_inside_characters(tmp_path):
+    path = tmp_path / "note.txt"
+    path.write_bytes(("한국어 문장입니다. " * 200).encode("utf-8"))
+
+    chunks = chunk_text(read_text(str(path)), max_tokens=50, overlap=0)
+    assert len(chunks) > 1
+    assert all("�" not in chunk for chunk in chunks)
+    assert all(chunk.startswith("한국어") for chunk in chunks)
+
+    binary = tmp_path / "data.bin"
+    binary.write_bytes(b"\x00\x01\x02" * 10)
+    assert read_text(str(binary)) == ""
@@ -0,0 +1,15 @@
+import pytest
+from mafm.rag.sqlite import connection_manager, initialize_database
+
+
+def vector(*values):
+    """앞의 값만 채우고 나머지는 0인 384차원 벡터"""
+    return list(values) + [0.0] * (384 - len(values))
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    name = str(tmp_path / "filesystem.db")
+    initialize_database(name)
+    yield name
+    connection_manager.close(name)
@@ -0,0 +1,152 @@
+import pytest
+from mafm.rag.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+
+
+@pytest.fixture
+def chunk_cache(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embedding_cache.db"), max_entries=10)
+    yield cache
+    cache.close()
+
+
+def test_chunk_cache_hits_and_misses(chunk_cache):
+    a = EmbeddingCache.make_key("model", "apple")
+    b = EmbeddingCache.make_key("model", "banana")
+    chunk_cache.put_many([(a, [0.5, 0.25])])
+
+    assert chunk_cache.get_many([a, b, a]) == {a: [0.5, 0.25]}
+    assert chunk_cache.stats() == {"entries": 1, "hits": 2, "misses": 1, "hit_rate": 2 / 3}
+
+
+def test_chunk_cache_separates_models(chunk_cache):
+    # 같은 텍스트라도 모델(백엔드)이 다르면 다른 벡터로 저장된다
+    fp32 = EmbeddingCache.make_key("model", "apple")
+    int8 = EmbeddingCache.make_key("model+onnx-int8", "apple")
+    assert fp32 != int8
+
+    chunk_cache.put_many([(fp32, [1.0])])
+    assert chunk_cache.get_many([int8]) == {}
+    chunk_cache.put_many([(int8, [2.0])])
+    assert chunk_cache.get_many([fp32, int8]) == {fp32: [1.0], int8: [2.0]}
+
+
+def test_chunk_cache_evicts_least_recently_used(tmp_path):
+    path = str(tmp_path / "embedding_cache.db")
+    cache = EmbeddingCache(path=path, max_entries=10)
+    keys = [EmbeddingCache.make_key("model", str(i)) for i in range(11)]
+    cache.put_many([(key, [float(i)]) for i, key in enumerate(keys[:10])])
+    cache.get_many([keys[0]])  # 0이 최근 사용으로 바뀐다
+
+    # 한도를 넘으면 한도의 10%만큼 더 지워서 오래된 1, 2가 빠진다
+    cache.put_many([(keys[10], [10.0])])
+    assert cache.stats()["entries"] == 9
+    assert set(cache.get_many(keys)) == set(keys) - {keys[1], keys[2]}
+    cache.close()
+
+    # 다시 열어도 남은 항목이 그대로 있다
+    cache = EmbeddingCache(path=path, max_entries=10)
+    assert cache.get_many([keys[0]]) == {keys[0]: [0.0]}
+    assert cache.stats()["entries"] == 9
+    cache.close()
+
+
+def test_embedding_encodes_only_missing_texts(monkeypatch, chunk_cache):
+    from mafm.rag import embedding as embedding_module
+
+    encoded = []
+
+    def encode(queries, batch_size):
+        encoded.append(list(queries))
+        return [[float(len(q))] for q in queries]
+
+    monkeypatch.setattr(embedding_module, "embedding_cache", chunk_cache)
+    monkeypatch.setattr(embedding_module, "_encode", encode)
+    monkeypatch.setattr(embedding_module, "get_model_id", lambda: "model")
+
+    assert embedding_module.embedding(["a", "bb", "a"]) == [[1.0], [2.0], [1.0]]
+    assert embedding_module.embedding(["bb", "ccc"]) == [[2.0], [3.0]]
+    assert encoded == [["a", "bb"], ["ccc"]]
+    assert chunk_cache.stats()["hits"] == 1
+
+
+
+def test_embedding_keys_on_backend_that_actually_loaded(monkeypatch, chunk_cache):
+    import numpy as np
+    from mafm.rag import embedding as embedding_module
+
+    class TorchModel:
+        def encode(self, queries, batch_size):
+            return np.ones((len(queries), 2), dtype=np.float32)
+
+    def load_model(backend):
+        if backend != "torch":
+            raise ValueError("onnx-int8 needs MAFM_MODEL_PATH")
+        return TorchModel()
+
+    monkeypatch.setattr(embedding_module, "embedding_cache", chunk_cache)
+    monkeypatch.setattr(embedding_module, "model", None)
+    monkeypatch.setattr(embedding_module, "model_backend", None)
+    monkeypatch.setattr(embedding_module, "EMBED_BACKEND", "onnx-int8")
+    monkeypatch.setattr(embedding_module, "load_model", load_model)
+
+    # int8 모델을 읽지 못해 torch로 대신 실행했으면 torch(fp32)의 id로 저장된다
+    assert embedding_module.embedding(["apple"]) == [[1.0, 1.0]]
+    assert embedding_module.model_backend == "torch"
+    name = embedding_module.MODEL_NAME
+    assert chunk_cache.get_many([EmbeddingCache.make_key(f"{name}+onnx-int8", "apple")]) == {}
+    assert set(chunk_cache.get_many([EmbeddingCache.make_key(name, "apple")])) == {
+        EmbeddingCache.make_key(name, "apple")
+    }
+
+def key(text):
+    return QueryEmbeddingCache.make_key("model", text)
+
+
+def test_normalized_queries_share_key():
+    assert key("  apple   pie ") == key("apple pie")
+    assert key("apple pie") != QueryEmbeddingCache.make_key("other-model", "apple pie")
+
+
+def test_lru_eviction_and_stats():
+    cache = QueryEmbeddingCache(max_entries=2, path="")
+    cache.put(key("a"), [1.0])
+    cache.put(key("b"), [2.0])
+    assert cache.get(key("a")) == [1.0]  # a가 최근 사용으로 바뀐다
+
+    cache.put(key("c"), [3.0])
+    assert cache.get(key("b")) is None
+    assert cache.get(key("a")) == [1.0]
+    assert cache.stats() == {"entries": 2, "hits": 2, "misses": 1, "hit_rate": 2 / 3}
+
+
+def test_persisted_entries_survive_restart(tmp_path):
+    path = str(tmp_path / "query_cache.db")
+    cache = QueryEmbeddingCache(max_entries=8, path=path)
+    cache.put(key("apple"), [0.5, 0.25])
+    cache.close()
+
+    cache = QueryEmbeddingCache(max_entries=8, path=path)
+    assert cache.get(key("apple")) == [0.5, 0.25]
+    assert cache.stats()["entries"] == 1
+    cache.close()
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_queries_encode_the_same_text_with_or_without_cache(monkeypatch, cached):
+    from mafm.rag import embedding as embedding_module
+
+    encoded = []
+
+    def encode(queries, batch_size):
+        encoded.extend(queries)
+        return [[1.0]] * len(queries)
+
+    cache = QueryEmbeddingCache(max_entries=8, path="") if cached else None
+    monkeypatch.setattr(embedding_module, "_encode", encode)
+    monkeypatch.setattr(embedding_module, "get_model_id", lambda: "model")
+    monkeypatch.setattr(embedding_module, "query_cache", cache)
+    monkeypatch.setattr(embedding_module, "_query_cache_failed", not cached)
+
+    # 캐시 설정과 관계없이 같은 (정규화한) 질의를 임베딩한다
+    assert embedding_module.embed_queries(["  apple\t pie "]) == [[1.0]]
+    assert encoded == ["apple pie"]
@@ -12,8 +12,70 @@ def test_sentences():
     ]
 
 
-def test_embedding_output_shape(test_sentences):
+@pytest.fixture
+def real_model():
+    # 모델을 받을 수 없는 환경(오프라인 등)에서는 실제 모델이 필요한 테스트를 건너뛴다
+    from mafm.rag import embedding as embedding_module
+
+    try:
+        embedding_module.initialize_model()
+    except RuntimeError as e:
+        pytest.skip(f"embedding model is not available: {e}")
+
+
+def test_embedding_output_shape(real_model, test_sentences):
     """Test that the embeddings have the correct shape."""
     embeddings = embedding(test_sentences)
     # Assert that the number of embeddings matches the number of sentences
     assert len(embeddings) == len(test_sentences)
+
+
+def test_backend_load_error_falls_back_to_torch(monkeypatch):
+    from mafm.rag import embedding as embedding_module
+
+    def load_model(backend):
+        if backend != "torch":
+            raise ValueError("onnx-int8 needs MAFM_MODEL_PATH")
+        return "torch-model"
+
+    monkeypatch.setattr(embedding_module, "model", None)
+    monkeypatch.setattr(embedding_module, "model_backend", None)
+    monkeypatch.setattr(embedding_module, "EMBED_BACKEND", "onnx-int8")
+    monkeypatch.setattr(embedding_module, "load_model", load_model)
+    embedding_module.initialize_model()
+    assert (embedding_module.model, embedding_module.model_backend) == ("torch-model", "torch")
+
+    # torch도 읽지 못하면 조용히 넘어가지 않고 오류를 낸다
+    def broken(backend):
+        raise OSError("model files are missing")
+
+    monkeypatch.setattr(embedding_module, "model", None)
+    monkeypatch.setattr(embedding_module, "load_model", broken)
+    with pytest.raises(RuntimeError):
+        embedding_module.initialize_model()
+
+
+def test_batch_failure_is_retried_per_file(monkeypatch):
+    from mafm.rag import embedding as embedding_module
+
+    def fake_embedding(texts, batch_size=32):
+        if "bad chunk" in texts:
+            return None
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(embedding_module, "embedding", fake_embedding)
+    monkeypatch.setattr(embedding_module, "get_cache_stats", lambda: None)
+    results = []
+    embedder = embedding_module.BatchEmbedder(results.extend, batch_size=10)
+    embedder.add("a", ["one", "two"])
+    embedder.add("b", ["bad chunk"])
+    embedder.add("c", ["three"])
+    embedder.flush()
+
+    # 실패한 파일만 None으로 넘기고, 나머지 파일은 그대로 임베딩된다
+    assert [(key, vectors) for key, _, vectors in results] == [
+        ("a", [[3.0], [3.0]]),
+        ("b", None),
+        ("c", [[5.0]]),
+    ]
+    assert (embedder.total_files, embedder.failed_files, embedder.total_chunks) == (2, 1, 3)
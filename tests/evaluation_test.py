@@ -0,0 +1,21 @@
+from mafm.rag.evaluation import make_queries, nearest_neighbors, recall_at_k
+
+
+def test_nearest_neighbors_orders_by_cosine_similarity():
+    corpus = [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]]
+
+    neighbors = nearest_neighbors([[1.0, 0.1], [0.0, 2.0]], corpus, 2)
+
+    assert neighbors.tolist() == [[0, 2], [1, 2]]
+
+
+def test_recall_at_k():
+    reference = [[0, 1, 2], [3, 4, 5]]
+
+    assert recall_at_k(reference, reference, 3) == 1.0
+    assert recall_at_k(reference, [[2, 1, 9], [5, 8, 9]], 3) == 0.5
+    assert recall_at_k(reference, [[0, 1], [9, 3]], 1) == 0.5
+
+
+def test_make_queries_uses_leading_words():
+    assert make_queries(["one two  three\nfour", "x"], 3) == ["one two three", "x"]
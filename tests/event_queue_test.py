@@ -0,0 +1,155 @@
+import pytest
+from mafm.event_queue import CoalescingEventQueue, CREATED, MODIFIED, DELETED, MOVED
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def event_queue(clock):
+    return CoalescingEventQueue(debounce=1.0, clock=clock)
+
+
+def drain(event_queue, clock):
+    clock.now += 10
+    events = []
+    while True:
+        event = event_queue.get(timeout=0)
+        if event is None:
+            return events
+        event_queue.done(event)
+        events.append(event)
+
+
+def test_debounce_holds_events_until_quiet(event_queue, clock):
+    event_queue.put_created("/root/a.txt")
+    assert event_queue.get(timeout=0) is None
+    clock.now += 1.5
+    event = event_queue.get(timeout=0)
+    assert (event.kind, event.path) == (CREATED, "/root/a.txt")
+
+
+def test_create_then_delete_cancels_out(event_queue, clock):
+    event_queue.put_created("/root/a.txt")
+    event_queue.put_modified("/root/a.txt")
+    event_queue.put_deleted("/root/a.txt")
+    assert drain(event_queue, clock) == []
+
+
+def test_repeated_modifies_collapse(event_queue, clock):
+    for _ in range(5):
+        event_queue.put_modified("/root/a.txt")
+    events = drain(event_queue, clock)
+    assert [(e.kind, e.path) for e in events] == [(MODIFIED, "/root/a.txt")]
+
+
+def test_rename_chain_collapses_to_final_destination(event_queue, clock):
+    event_queue.put_moved("/root/a.txt", "/root/b.txt")
+    event_queue.put_moved("/root/b.txt", "/root/c.txt")
+    events = drain(event_queue, clock)
+    assert [(e.kind, e.src_path, e.path) for e in events] == [
+        (MOVED, "/root/a.txt", "/root/c.txt")
+    ]
+
+
+def test_created_then_moved_is_created_at_destination(event_queue, clock):
+    event_queue.put_created("/root/tmp123")
+    event_queue.put_modified("/root/tmp123")
+    event_queue.put_moved("/root/tmp123", "/root/a.txt")
+    events = drain(event_queue, clock)
+    assert [(e.kind, e.path) for e in events] == [(CREATED, "/root/a.txt")]
+
+
+def test_moved_then_deleted_deletes_original(event_queue, clock):
+    event_queue.put_moved("/root/a.txt", "/root/b.txt")
+    event_queue.put_deleted("/root/b.txt")
+    events = drain(event_queue, clock)
+    assert [(e.kind, e.path) for e in events] == [(DELETED, "/root/a.txt")]
+
+
+def test_directory_move_rebases_pending_file_events(event_queue, clock):
+    event_queue.put_created("/root/dir/a.txt")
+    event_queue.put_moved("/root/dir", "/root/renamed", is_directory=True)
+    events = drain(event_queue, clock)
+    assert [(e.kind, e.path, e.is_directory) for e in events] == [
+        (MOVED, "/root/renamed", True),
+        (CREATED, "/root/renamed/a.txt", False),
+    ]
+
+
+def test_directory_event_waits_for_in_flight_events(event_queue, clock):
+    event_queue.put_modified("/root/a.txt")
+    event_queue.put_created("/root/dir", is_directory=True)
+    clock.now += 10
+    first = event_queue.get(timeout=0)
+    assert first.path == "/root/a.txt"
+    assert event_queue.get(timeout=0) is None
+    event_queue.done(first)
+    assert event_queue.get(timeout=0).path == "/root/dir"
+
+
+def test_hot_file_does_not_block_other_events(event_queue, clock):
+    event_queue.put_modified("/root/hot.txt")
+    event_queue.put_modified("/root/other.txt")
+    for _ in range(1000):
+        clock.now += 0.5
+        event_queue.put_modified("/root/hot.txt")  # debounce보다 자주 바뀌는 파일
+    event = event_queue.get(timeout=0)
+    assert event.path == "/root/other.txt"
+    # 같은 이벤트를 다시 건드려도 힙이 계속 커지지 않는다
+    assert len(event_queue._heap) <= 2
+    assert len(event_queue._deadlines) <= 4 * 2 + 64
+
+    # 처리 중인 경로가 있어도 다른 경로의 이벤트는 꺼낼 수 있다
+    event_queue.put_modified("/root/third.txt")
+    clock.now += 10
+    assert event_queue.get(timeout=0).path == "/root/hot.txt"
+    assert event_queue.get(timeout=0).path == "/root/third.txt"
+
+
+def test_later_events_do_not_overtake_related_or_directory_events(event_queue, clock):
+    event_queue.put_moved("/root/a.txt", "/root/b.txt")
+    clock.now += 0.5
+    event_queue.put_created("/root/a.txt")  # 이동한 원래 경로에 새 파일
+    event_queue.put_created("/root/dir", is_directory=True)
+    event_queue.put_created("/root/c.txt")
+    for _ in range(4):
+        clock.now += 0.5
+        event_queue.put_modified("/root/b.txt")
+    # 이동이 debounce 중이므로 원래 경로의 생성과 디렉토리 뒤의 이벤트는 기다린다
+    assert event_queue.get(timeout=0) is None
+    events = drain(event_queue, clock)
+    assert [(e.kind, e.path) for e in events] == [
+        (MOVED, "/root/b.txt"),
+        (CREATED, "/root/a.txt"),
+        (CREATED, "/root/dir"),
+        (CREATED, "/root/c.txt"),
+    ]
+
+
+def test_burst_of_debouncing_events_does_not_wake_workers(event_queue, clock):
+    wakeups = []
+    notify_all = event_queue._cond.notify_all
+    event_queue._cond.notify_all = lambda: (wakeups.append(1), notify_all())
+
+    # 일괄 복사처럼 debounce 중인 이벤트가 쏟아져도 가장 이른 시각은 그대로라 깨우지 않는다
+    event_queue.put_created("/root/0.txt")
+    for i in range(1, 1000):
+        event_queue.put_created(f"/root/{i}.txt")
+        event_queue.put_modified(f"/root/{i}.txt")
+    assert len(wakeups) == 1
+
+    clock.now += 0.5
+    assert event_queue.get(timeout=0) is None
+    clock.now += 1
+    assert [e.path for e in drain(event_queue, clock)] == [f"/root/{i}.txt" for i in range(1000)]
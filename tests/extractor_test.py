@@ -0,0 +1,64 @@
+import os
+import random
+import pytest
+from mafm.rag import chunker
+from mafm.rag.chunker import chunk_stream, chunk_text
+from mafm.rag.extractor import iter_file_text, iter_text
+
+
+@pytest.fixture(autouse=True)
+def approx_tokens(monkeypatch):
+    monkeypatch.setattr(chunker, "get_tokenizer", lambda: None)
+
+
+def test_iter_text_decodes_across_block_boundaries(tmp_path):
+    path = tmp_path / "note.txt"
+    text = "가나다라마바사 아자차카타파하. " * 50
+    path.write_bytes(text.encode("utf-8"))
+
+    # 7바이트씩 읽으면 3바이트 글자가 블록 경계에 걸친다
+    blocks = list(iter_text(str(path), block_size=7))
+    assert len(blocks) > 1
+    assert "".join(blocks) == text
+
+    capped = "".join(iter_file_text(str(path), max_bytes=100))
+    assert len(capped.encode("utf-8")) <= 100
+    assert text.startswith(capped)
+
+
+def test_iter_text_survives_truncation_while_reading(tmp_path):
+    # 편집기가 파일을 다시 쓰면서 읽는 도중 파일이 잘려도 프로세스가 죽지 않는다 (SIGBUS)
+    path = tmp_path / "log.txt"
+    path.write_bytes(b"line of text\n" * 100000)
+
+    blocks = iter_text(str(path), block_size=4096)
+    first = next(blocks)
+    os.truncate(path, 0)
+    rest = "".join(blocks)
+    assert first.startswith("line of text") and len(first) + len(rest) < 1300000
+
+
+def test_chunk_stream_matches_whole_text():
+    pages = [
+        f"page {p} sentence {s} is about something.\n" for p in range(30) for s in range(5)
+    ]
+    whole = chunk_text("".join(pages), max_tokens=40, overlap=10)
+    streamed = list(chunk_stream(iter(pages), 40, 10, buffer_chars=300))
+    assert streamed == whole
+
+
+def test_chunk_stream_matches_whole_text_across_sentence_and_paragraph_seams():
+    # 블록 경계가 문장/문단 중간에 걸리고, 긴 문장과 빈 줄이 섞인 텍스트
+    words = ["alpha", "beta", "문장", "한국어", "end", "data"]
+    for seed in range(100):
+        rng = random.Random(seed)
+        text = "".join(
+            " ".join(rng.choice(words) for _ in range(rng.randint(1, rng.choice([20, 80]))))
+            + rng.choice([".", "?", "。", ""])
+            + rng.choice([" ", "\n", "\n\n", "  \n \n"])
+            for _ in range(rng.randint(5, 50))
+        )
+        blocks = [text[i : i + 97] for i in range(0, len(text), 97)]
+        whole = chunk_text(text, max_tokens=30, overlap=8)
+        streamed = list(chunk_stream(iter(blocks), 30, 8, buffer_chars=500))
+        assert streamed == whole, seed
@@ -0,0 +1,105 @@
+import os
+import pytest
+
+try:
+    from mafm.rag.fileops import (
+        SCAN_FILE,
+        SCAN_LINK_DIR,
+        get_all_file_data,
+        get_file_data,
+        scan_tree,
+        utf8_chunk_offsets,
+    )
+except OSError:  # make로 C 라이브러리를 빌드하지 않은 환경
+    pytest.skip("libfileops.so is not built", allow_module_level=True)
+
+
+def test_get_file_data_keeps_utf8_characters_whole(tmp_path):
+    path = tmp_path / "note.txt"
+    text = "한글 문장입니다. " * 100
+    path.write_bytes(text.encode("utf-8"))
+
+    data = get_file_data(str(path))
+    assert data[:2] == [str(path), "note.txt"]
+    assert all(len(chunk.encode("utf-8")) <= 500 for chunk in data[2:])
+    assert "".join(data[2:]) == text
+
+    assert get_file_data(str(tmp_path / "photo.jpg"))[2:] == []
+
+
+def test_utf8_chunk_offsets_do_not_split_characters():
+    assert utf8_chunk_offsets(b"0123456789" * 10, 30) == [0, 30, 60, 90, 100]
+    assert utf8_chunk_offsets(bytearray(), 10) == [0]
+
+    data = bytearray("가나다".encode("utf-8"))  # 3바이트 글자 세 개
+    assert utf8_chunk_offsets(data, 4) == [0, 3, 6, 9]
+    assert utf8_chunk_offsets(memoryview(data)[:8], 4) == [0, 3, 6, 8]
+
+
+def test_get_all_file_data_collects_nested_files(tmp_path):
+    # 하위 디렉토리의 파일이 4개를 넘어도 배열 끝을 넘어 쓰지 않는다
+    for d in ("a", "a/b"):
+        (tmp_path / d).mkdir()
+        for i in range(10):
+            (tmp_path / d / f"{i}.txt").write_text(f"file {d} {i}")
+
+    files = get_all_file_data(str(tmp_path))
+    assert len(files) == 20
+    assert sorted(f[1] for f in files)[:2] == ["0.txt", "0.txt"]
+    assert all(f[2].startswith("file ") for f in files)
+
+
+def test_scan_tree_reports_deep_long_paths_with_stat(tmp_path):
+    # 512바이트보다 긴 경로와 깊은 디렉토리도 잘리지 않는다
+    deep = tmp_path
+    for i in range(40):
+        deep = deep / f"level{i:02d}_{'x' * 20}"
+    deep.mkdir(parents=True)
+    (deep / "leaf.txt").write_text("leaf")
+    for i in range(30):
+        (tmp_path / f"{i}.txt").write_text("x" * i)
+    (tmp_path / "vectors.db").mkdir()
+    (tmp_path / "vectors.db" / "hidden.txt").write_text("skip")
+    os.symlink(deep, tmp_path / "link")
+
+    entries = [
+        entry
+        for batch in scan_tree(str(tmp_path), threads=4, prune_suffix=".db", batch_size=8)
+        for entry in batch
+    ]
+    paths = [entry.path for entry in entries]
+    assert len(paths) == len(set(paths)) == 40 + 1 + 30 + 1
+    assert str(deep / "leaf.txt") in paths and len(str(deep / "leaf.txt")) > 512
+    assert not any("vectors.db" in path for path in paths)
+
+    # 디렉토리는 그 안의 항목보다 먼저 나온다
+    order = {path: i for i, path in enumerate(paths)}
+    for path in paths:
+        if os.path.dirname(path) != str(tmp_path):
+            assert order[os.path.dirname(path)] < order[path]
+
+    for entry in entries:
+        if entry.type == SCAN_FILE:
+            stat = os.stat(entry.path)
+            assert (entry.size, entry.mtime, entry.inode) == (
+                stat.st_size,
+                stat.st_mtime,
+                stat.st_ino,
+            )
+    link = entries[order[str(tmp_path / "link")]]
+    assert link.type == SCAN_LINK_DIR and link.is_dir
+
+
+def test_scan_tree_can_stop_early(tmp_path):
+    for d in range(20):
+        (tmp_path / str(d)).mkdir()
+        for i in range(50):
+            (tmp_path / str(d) / f"{i}.txt").write_text("")
+
+    scan = scan_tree(str(tmp_path), threads=4, batch_size=16)
+    assert len(next(scan)) <= 16
+    scan.close()  # 남은 탐색을 멈추고 스레드와 결과를 해제한다
+
+    assert sum(len(batch) for batch in scan_tree(str(tmp_path), threads=1)) == 20 + 1000
+    with pytest.raises(StopIteration):
+        next(scan_tree(str(tmp_path / "missing")))
@@ -0,0 +1,43 @@
+import pytest
+from mafm.rag.filters import SearchFilter, describe_file, combine_expressions
+
+NOW = 1_000_000.0
+
+
+def test_describe_file():
+    assert describe_file("/r/Report.PDF", 10, 1.5) == {
+        "extension": "pdf",
+        "mime_type": "application/pdf",
+        "size": 10,
+        "mtime": 1.5,
+    }
+
+
+def test_parse_conditions():
+    search_filter = SearchFilter.parse(
+        ["ext=.PDF,docx", "size<1M", "modified>7d", "mime=image/"], now=NOW
+    )
+
+    assert search_filter.extensions == ["pdf", "docx"]
+    assert search_filter.max_size == 1024 * 1024
+    assert search_filter.modified_after == NOW - 7 * 86400
+    assert search_filter.mime_type == "image/"
+    assert SearchFilter.parse([]).is_empty()
+
+    with pytest.raises(ValueError):
+        SearchFilter.parse(["size=big"])
+
+
+def test_expression_and_sql():
+    search_filter = SearchFilter(extensions=["pdf"], mime_type="image/", min_size=5)
+
+    assert search_filter.to_expression() == (
+        'extension in ["pdf"] and mime_type like "image/%" and size >= 5'
+    )
+    assert search_filter.to_sql("m") == (
+        "m.extension IN (?) AND m.mime_type LIKE ? AND m.size >= ?",
+        ["pdf", "image/%", 5],
+    )
+    assert combine_expressions("dir_id == 3", "", search_filter.to_expression()) == (
+        '(dir_id == 3) and (extension in ["pdf"] and mime_type like "image/%" and size >= 5)'
+    )
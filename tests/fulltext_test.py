@@ -0,0 +1,76 @@
+import pytest
+from mafm.rag.sqlite import (
+    insert_file_infos,
+    change_file_path,
+    delete_directory_and_subdirectories,
+    upsert_file_metadata,
+)
+from mafm.rag.filters import SearchFilter, describe_file
+from mafm.rag.fulltext import (
+    add_chunks,
+    remove_files,
+    build_match_query,
+    lexical_search,
+    reciprocal_rank_fusion,
+)
+
+
+@pytest.fixture
+def tree(db_name):
+    ids = insert_file_infos(
+        [("/r", 1), ("/r/a", 1), ("/r/b", 1), ("/r/a/x.txt", 0), ("/r/b/report_v2.pdf", 0)],
+        db_name,
+    )
+    add_chunks([(ids[3], "engine failure code E1234"), (ids[3], "other text")], db_name)
+    add_chunks([(ids[4], "quarterly numbers")], db_name)
+    return ids
+
+
+def test_build_match_query_quotes_terms():
+    assert build_match_query('report_v2.pdf "E12*') == '"report v2 pdf" OR "E12"'
+    assert build_match_query(" -- ") is None
+
+
+def test_content_and_name_search(db_name, tree):
+    assert lexical_search("E1234", 5, db_name=db_name)[0][0] == tree[3]
+    assert lexical_search("report_v2", 5, db_name=db_name)[0][0] == tree[4]
+    assert lexical_search("E1234", 5, dir_ids=[tree[2]], db_name=db_name) == []
+
+
+def test_metadata_filter(db_name, tree):
+    upsert_file_metadata(
+        [
+            (tree[3], describe_file("/r/a/x.txt", 100, 10.0)),
+            (tree[4], describe_file("/r/b/report_v2.pdf", 5000, 20.0)),
+        ],
+        db_name,
+    )
+
+    def ids(search_filter):
+        results = lexical_search(
+            "E1234 quarterly", 5, search_filter=search_filter, db_name=db_name
+        )
+        return [id for id, _ in results]
+
+    assert ids(SearchFilter(extensions=["pdf"])) == [tree[4]]
+    assert ids(SearchFilter(max_size=1000)) == [tree[3]]
+
+
+def test_index_follows_rename_and_delete(db_name, tree):
+    change_file_path("/r/b/report_v2.pdf", "/r/b/summary.pdf", db_name)
+    assert lexical_search("report_v2", 5, db_name=db_name) == []
+    assert lexical_search("summary", 5, db_name=db_name)[0][0] == tree[4]
+
+    remove_files([tree[3]], db_name)
+    assert lexical_search("E1234", 5, db_name=db_name) == []
+
+    add_chunks([(tree[4], "E1234 again")], db_name)
+    delete_directory_and_subdirectories("/r/b", db_name)
+    assert lexical_search("E1234 summary", 5, db_name=db_name) == []
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[(1, 0.9), (2, 0.8)], [(2, 5.0), (3, 1.0)]], k=60)
+
+    assert [id for id, _ in fused] == [2, 1, 3]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
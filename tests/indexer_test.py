@@ -0,0 +1,60 @@
+import os
+from mafm.rag.filters import describe_file
+from mafm.rag import indexer
+from mafm.rag.indexer import IndexingPipeline, is_in_tree
+from mafm.rag.sqlite import (
+    insert_file_infos,
+    get_directory_structure,
+    get_manifest,
+    upsert_file_metadata,
+    upsert_manifest,
+)
+
+
+def test_is_in_tree():
+    assert is_in_tree("/r/a", "/r/a")
+    assert is_in_tree("/r/a/x.txt", "/r/a")
+    assert not is_in_tree("/r/ab/x.txt", "/r/a")
+    assert is_in_tree("/x.txt", "/")
+
+
+def test_rescan_leaves_other_roots_alone(monkeypatch, tmp_path, db_name):
+    monkeypatch.setattr(indexer, "get_index_id", lambda: "model chunker")
+    root = str(tmp_path / "a")
+    os.makedirs(os.path.join(root, "sub"))
+    kept = os.path.join(root, "sub", "kept.txt")
+    with open(kept, "w") as f:
+        f.write("kept")
+
+    pipeline = IndexingPipeline(extract_workers=1)
+    ids = insert_file_infos(
+        [
+            (root, 1),
+            (os.path.join(root, "sub"), 1),
+            (kept, 0),
+            (os.path.join(root, "gone.txt"), 0),
+            (os.path.join(root, "gone"), 1),
+            # 같은 DB에 등록된 다른 root (이름이 root로 시작하는 형제 디렉토리 포함)
+            (str(tmp_path / "ab"), 1),
+            (str(tmp_path / "ab" / "x.txt"), 0),
+            ("/other", 1),
+            ("/other/y.txt", 0),
+        ],
+        db_name,
+    )
+    stat = os.stat(kept)
+    upsert_manifest(ids[2], stat.st_size, stat.st_mtime, "", 0, pipeline.model_id, db_name)
+    upsert_file_metadata([(ids[2], describe_file(kept, stat.st_size, stat.st_mtime))], db_name)
+
+    removed = []
+    pipeline._remove_file = lambda path, id: removed.append(path)
+    pipeline._remove_directory = removed.append
+    pipeline.embedder.report = lambda: None
+    pipeline.run(
+        root,
+        manifest=get_manifest(db_name),
+        directories=get_directory_structure(db_name),
+    )
+
+    assert sorted(removed) == [os.path.join(root, "gone"), os.path.join(root, "gone.txt")]
+    assert pipeline.unchanged == 1
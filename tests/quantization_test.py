@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from mafm.rag.sqlite import insert_file_infos
+from mafm.rag.fulltext import add_chunks
+from mafm.rag.quantization import (
+    encode_vector,
+    decode_vector,
+    similarity_from_distance,
+    to_blob,
+    get_chunk_vectors,
+    rescore,
+)
+from .conftest import vector
+
+
+def test_encode_and_decode():
+    original = vector(0.5, -0.25, 1.0)
+
+    half = encode_vector(original, "float16")
+    assert half.dtype == np.float16
+    assert decode_vector([half.tobytes()], "float16") == pytest.approx(original)
+
+    bits = encode_vector(original, "binary")
+    assert len(bits) == 384 // 8
+    assert decode_vector(bits, "binary")[:3] == [1.0, -1.0, 1.0]
+    assert encode_vector(original, "float32") is original
+
+
+def test_hamming_distance_becomes_similarity():
+    assert similarity_from_distance(0, "binary") == 1.0
+    assert similarity_from_distance(192, "binary") == 0.0
+    assert similarity_from_distance(0.7, "float16") == 0.7
+
+
+def test_rescore_uses_full_precision_vectors(db_name):
+    ids = insert_file_infos([("/r", 1), ("/r/x", 0), ("/r/y", 0), ("/r/z", 0)], db_name)
+    add_chunks(
+        [
+            (ids[1], "x1", to_blob(vector(0, 1))),
+            (ids[1], "x2", to_blob(vector(1, 1))),
+            (ids[2], "y1", to_blob(vector(1, 0))),
+        ],
+        db_name,
+    )
+
+    # 1차 점수로는 x가 앞서지만 원래 벡터로 다시 매기면 y가 앞선다 (z는 벡터가 없어 1차 점수 유지)
+    candidates = [(ids[1], 0.9), (ids[2], 0.8), (ids[3], 0.1)]
+    scores = rescore(vector(1, 0), candidates, db_name=db_name)
+    assert scores == pytest.approx({ids[1]: 0.5**0.5, ids[2]: 1.0, ids[3]: 0.1})
+
+    scores = rescore(vector(1, 0), candidates, "sum", {ids[1]: 2}, db_name=db_name)
+    assert scores[ids[1]] == pytest.approx(0.5**0.5)
+
+    assert get_chunk_vectors(ids[2], db_name)["y1"] == vector(1, 0)
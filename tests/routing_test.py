@@ -0,0 +1,70 @@
+import pytest
+from mafm.rag.sqlite import (
+    connection_manager,
+    insert_file_infos,
+    change_directory_path,
+    delete_directory_and_subdirectories,
+)
+from mafm.rag.routing import DirectoryRouter, add_file_vectors, remove_file_vectors
+from .conftest import vector
+
+
+@pytest.fixture
+def tree(db_name):
+    # /r/a에는 첫 번째 축, /r/b에는 두 번째 축 방향의 벡터를 넣는다
+    ids = insert_file_infos(
+        [("/r", 1), ("/r/a", 1), ("/r/b", 1), ("/r/a/x", 0), ("/r/a/y", 0), ("/r/b/z", 0)],
+        db_name,
+    )
+    add_file_vectors(ids[1], {ids[3]: [vector(1, 0)], ids[4]: [vector(1, 0.2)]}, db_name)
+    add_file_vectors(ids[2], {ids[5]: [vector(0, 1), vector(0.1, 1)]}, db_name)
+    return ids
+
+
+def test_top_k_orders_directories_by_similarity(db_name, tree):
+    router = DirectoryRouter(db_name)
+
+    assert [path for path, _ in router.top_k(vector(1, 0), 2)] == ["/r/a", "/r/b"]
+    assert [path for path, _ in router.top_k(vector(0, 1), 1)] == ["/r/b"]
+
+
+def test_remove_and_move_files(db_name, tree):
+    router = DirectoryRouter(db_name)
+
+    # /r/b의 파일을 /r/a로 옮기면 /r/b의 요약은 사라진다
+    remove_file_vectors([tree[5]], db_name)
+    add_file_vectors(tree[1], {tree[5]: [vector(0, 1)]}, db_name)
+    assert [path for path, _ in router.top_k(vector(0, 1), 5)] == ["/r/a"]
+
+    remove_file_vectors(tree[3:], db_name)
+    assert router.top_k(vector(0, 1), 5) == []
+
+
+def test_directory_rename_and_delete(db_name, tree):
+    router = DirectoryRouter(db_name)
+
+    change_directory_path("/r/b", "/r/c", db_name)
+    assert router.top_k(vector(0, 1), 1)[0][0] == "/r/c"
+
+    delete_directory_and_subdirectories("/r/a", db_name)
+    assert [path for path, _ in router.top_k(vector(1, 0), 5)] == ["/r/c"]
+
+
+def test_append_file_vectors(db_name, tree):
+    def counts():
+        with connection_manager.connect(db_name) as connection:
+            file_count = connection.execute(
+                "SELECT chunk_count FROM file_summary WHERE file_id = ?", (tree[5],)
+            ).fetchone()[0]
+            dir_count = connection.execute(
+                "SELECT chunk_count FROM directory_summary WHERE dir_id = ?", (tree[2],)
+            ).fetchone()[0]
+        return file_count, dir_count
+
+    # 청크를 나눠서 저장하면 이전 벡터에 이어서 더한다
+    add_file_vectors(tree[2], {tree[5]: [vector(1, 0)] * 3}, db_name, append=True)
+    assert counts() == (5, 5)
+    assert DirectoryRouter(db_name).top_k(vector(1, 0), 1)[0][0] == "/r/a"
+
+    add_file_vectors(tree[2], {tree[5]: [vector(0, 1)]}, db_name)
+    assert counts() == (1, 1)
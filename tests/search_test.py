@@ -0,0 +1,36 @@
+import pytest
+from mafm.rag.vectorDb import _aggregate_hits, _rank
+
+# 파일 1은 청크 두 개, 파일 2는 청크 하나가 검색된 결과
+HITS = [(1, 0.9), (2, 0.8), (1, 0.5)]
+
+
+def test_aggregate_max_and_sum():
+    assert _aggregate_hits(HITS) == {1: 0.9, 2: 0.8}
+    assert _aggregate_hits(HITS, "sum") == pytest.approx({1: 1.4, 2: 0.8})
+
+
+def test_rank_applies_threshold_and_keeps_spare_candidates():
+    scores = {1: 0.9, 2: 0.8, 3: 0.3, 4: 0.7}
+
+    assert _rank(scores, 1) == [(1, 0.9), (2, 0.8)]
+    assert _rank(scores, 5, threshold=0.75) == [(1, 0.9), (2, 0.8)]
+
+
+def test_search_many_degrades_when_vector_search_fails(monkeypatch):
+    from mafm.rag import vectorDb
+
+    class FailingStore:
+        encoding = "float32"
+
+        def has_collection(self, db_name):
+            return True
+
+        def search(self, *args, **kwargs):
+            raise RuntimeError("collection not loaded")
+
+    monkeypatch.setattr(vectorDb, "vector_store", FailingStore())
+    monkeypatch.setattr(vectorDb, "_resolve", lambda db_name: (db_name, None))
+    monkeypatch.setattr(vectorDb, "embed_queries", lambda queries: [[0.0]] * len(queries))
+
+    assert vectorDb.search_many("/root/dir.db", ["a", "b"], mode="vector") == [[], []]
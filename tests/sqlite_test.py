@@ -0,0 +1,165 @@
+import sqlite3
+import pytest
+from mafm.rag.sqlite import (
+    connection_manager,
+    transaction,
+    initialize_database,
+    insert_file_info,
+    insert_file_infos,
+    get_paths_by_ids,
+    get_ids_by_paths,
+    find_id_by_path,
+    change_file_path,
+    change_directory_path,
+    delete_file_info,
+    delete_directory_and_subdirectories,
+    get_directory_structure,
+    get_subdirectory_ids,
+    get_manifest,
+    upsert_manifest,
+    get_directory_version,
+)
+
+
+def test_insert_file_infos_returns_ids_in_order(db_name):
+    ids = insert_file_infos([("/r/a", 1), ("/r/a/x.txt", 0), ("/r/a/y.txt", 0)], db_name)
+
+    assert len(set(ids)) == 3
+    assert get_paths_by_ids(ids, db_name) == ["/r/a", "/r/a/x.txt", "/r/a/y.txt"]
+
+
+def test_insert_existing_path_returns_existing_id(db_name):
+    id = insert_file_info("/r/a.txt", 0, db_name)
+
+    assert insert_file_info("/r/a.txt", 0, db_name) == id
+    assert insert_file_infos([("/r/b.txt", 0), ("/r/a.txt", 0)], db_name)[1] == id
+
+
+def test_get_paths_by_ids_missing_id(db_name):
+    id = insert_file_info("/r/a.txt", 0, db_name)
+
+    assert get_paths_by_ids([id, 999, id], db_name) == ["/r/a.txt", None, "/r/a.txt"]
+
+
+def test_cache_follows_writes(db_name):
+    id = insert_file_info("/r/a.txt", 0, db_name)
+    change_file_path("/r/a.txt", "/r/b.txt", db_name)
+
+    assert get_paths_by_ids([id], db_name) == ["/r/b.txt"]
+    assert find_id_by_path("/r/a.txt", db_name) is None
+
+    delete_file_info(id, db_name)
+    assert get_paths_by_ids([id], db_name) == [None]
+    assert get_ids_by_paths(["/r/b.txt"], db_name) == {}
+
+
+def test_cache_invalidated_by_other_connection(db_name):
+    _, id = insert_file_infos([("/r", 1), ("/r/a.txt", 0)], db_name)
+    assert get_paths_by_ids([id], db_name) == ["/r/a.txt"]
+
+    # 다른 프로세스(shell/observer)의 쓰기
+    other = sqlite3.connect(db_name)
+    other.execute("UPDATE file_info SET name = 'c.txt' WHERE id = ?", (id,))
+    other.commit()
+    other.close()
+
+    assert get_paths_by_ids([id], db_name) == ["/r/c.txt"]
+
+
+def test_insert_children_before_parents(db_name):
+    ids = insert_file_infos([("/r/a/b/x.txt", 0), ("/r/a/b", 1), ("/r/a", 1), ("/r", 1)], db_name)
+
+    assert get_paths_by_ids(ids, db_name) == ["/r/a/b/x.txt", "/r/a/b", "/r/a", "/r"]
+    assert sorted(get_directory_structure(db_name)) == ["/r", "/r/a", "/r/a/b"]
+
+
+def test_directory_move_updates_subtree(db_name):
+    ids = insert_file_infos(
+        [("/r", 1), ("/r/a", 1), ("/r/a/b", 1), ("/r/a/b/x.txt", 0), ("/r/ab", 1)],
+        db_name,
+    )
+
+    change_directory_path("/r/a", "/r/c", db_name)
+
+    assert get_paths_by_ids(ids, db_name) == [
+        "/r",
+        "/r/c",
+        "/r/c/b",
+        "/r/c/b/x.txt",
+        "/r/ab",  # 이름이 같은 접두어로 시작하는 형제 디렉토리는 그대로
+    ]
+    assert find_id_by_path("/r/c/b/x.txt", db_name) == ids[3]
+    assert find_id_by_path("/r/a/b/x.txt", db_name) is None
+    assert sorted(get_subdirectory_ids("/r/c", db_name)) == sorted([ids[1], ids[2]])
+
+
+def test_delete_directory_removes_subtree(db_name):
+    ids = insert_file_infos(
+        [("/r", 1), ("/r/a", 1), ("/r/a/b", 1), ("/r/a/b/x.txt", 0), ("/r/ab.txt", 0)],
+        db_name,
+    )
+    upsert_manifest(ids[3], 1, 1.0, "h", 1, "m", db_name)
+    upsert_manifest(ids[4], 1, 1.0, "h", 1, "m", db_name)
+
+    delete_directory_and_subdirectories("/r/a", db_name)
+
+    assert get_paths_by_ids(ids, db_name) == ["/r", None, None, None, "/r/ab.txt"]
+    assert list(get_manifest(db_name)) == ["/r/ab.txt"]
+
+
+def test_directory_version_bumped_by_directory_changes(db_name):
+    version = get_directory_version(db_name)
+    insert_file_infos([("/r", 1), ("/r/a", 1)], db_name)
+    after_insert = get_directory_version(db_name)
+    assert after_insert > version
+
+    # 파일만 바뀌면 디렉토리 버전은 그대로
+    insert_file_info("/r/a/x.txt", 0, db_name)
+    change_file_path("/r/a/x.txt", "/r/a/y.txt", db_name)
+    assert get_directory_version(db_name) == after_insert
+
+    change_directory_path("/r/a", "/r/b", db_name)
+    after_move = get_directory_version(db_name)
+    assert after_move > after_insert
+
+    delete_directory_and_subdirectories("/r/b", db_name)
+    assert get_directory_version(db_name) > after_move
+
+
+def test_transaction_rollback(db_name):
+    with pytest.raises(RuntimeError):
+        with transaction(db_name):
+            insert_file_info("/r/a.txt", 0, db_name)
+            with transaction(db_name):
+                insert_file_info("/r/b.txt", 0, db_name)
+            raise RuntimeError
+
+    assert get_ids_by_paths(["/r/a.txt", "/r/b.txt"], db_name) == {}
+
+
+def test_migration_from_path_table(tmp_path):
+    name = str(tmp_path / "old.db")
+    # file_path 열을 쓰던 이전 스키마에서 같은 경로가 두 번 등록된 db
+    old = sqlite3.connect(name)
+    old.execute(
+        "CREATE TABLE file_info (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "file_path TEXT NOT NULL, is_dir INTEGER NOT NULL)"
+    )
+    old.executemany(
+        "INSERT INTO file_info (file_path, is_dir) VALUES (?, ?)",
+        [("/r", 1), ("/r/a.txt", 0), ("/r/a.txt", 0), ("/r/b", 1), ("/r/b/c.txt", 0)],
+    )
+    old.commit()
+    old.close()
+
+    initialize_database(name, reset=False)
+
+    assert get_ids_by_paths(["/r", "/r/a.txt", "/r/b/c.txt"], name) == {
+        "/r": 1,
+        "/r/a.txt": 2,
+        "/r/b/c.txt": 5,
+    }
+    assert get_paths_by_ids([3], name) == [None]
+    change_directory_path("/r", "/s", name)
+    assert get_paths_by_ids([5], name) == ["/s/b/c.txt"]
+    connection_manager.close(name)
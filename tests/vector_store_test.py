@@ -0,0 +1,208 @@
+import threading
+import numpy as np
+import pytest
+from mafm.rag import vector_store as vector_store_module
+from mafm.rag.ann import choose_index, needs_rebuild
+from mafm.rag.numpy_store import NumpyVectorStore, parse_expression
+from .conftest import vector
+
+
+@pytest.fixture
+def store(tmp_path):
+    db_name = str(tmp_path / "dir.db")
+    store = NumpyVectorStore()
+    store.create_collection(db_name)
+    store.insert(
+        db_name,
+        [
+            {"id": 1, "vector": vector(1, 0), "word": "a", "extension": "txt", "size": 10},
+            {"id": 1, "vector": vector(2, 1), "word": "b", "extension": "txt", "size": 10},
+            {"id": 2, "vector": vector(0, 3), "word": "c", "extension": "pdf", "size": 500},
+            {"id": 3, "vector": vector(1, 1), "word": "d", "dir_id": 7},
+        ],
+    )
+    yield store, db_name
+    store.close_all()
+
+
+def test_parse_expression():
+    assert parse_expression('(dir_id in [1, 2]) and (extension in ["pdf"] and size <= 10)') == [
+        ("dir_id", "in", [1, 2]),
+        ("extension", "in", ["pdf"]),
+        ("size", "<=", 10),
+    ]
+    assert parse_expression("") == []
+    with pytest.raises(ValueError):
+        parse_expression("not (id in [1])")
+
+
+def test_search_orders_by_cosine_and_filters(store):
+    store, db_name = store
+
+    hits = store.search(db_name, [vector(1, 0), vector(0, 1)], 2)
+    assert [id for id, _ in hits[0]] == [1, 1]
+    assert hits[0][0][1] == pytest.approx(1.0)
+    assert [id for id, _ in hits[1]] == [2, 3]
+
+    assert [id for id, _ in store.search(db_name, [vector(1, 0)], 5, 'extension in ["pdf"]')[0]] == [2]
+    assert [id for id, _ in store.search(db_name, [vector(1, 0)], 5, "size >= 100")[0]] == [2]
+    assert [id for id, _ in store.search(db_name, [vector(1, 0)], 5, "dir_id == 7")[0]] == [3]
+    assert store.search(db_name, [vector(1, 0)], 5, 'mime_type like "text/%"') == [[]]
+
+
+def test_query_returns_original_vectors(store):
+    store, db_name = store
+
+    rows = store.query(db_name, "id in [1]")
+    assert [row["word"] for row in rows] == ["a", "b"]
+    assert rows[1]["vector"][:2] == pytest.approx([2, 1])
+    assert rows[1]["extension"] == "txt"
+
+
+def test_delete_compacts_and_is_visible_to_other_instances(store):
+    store, db_name = store
+    reader = NumpyVectorStore()
+    assert len(reader.search(db_name, [vector(1, 0)], 10)[0]) == 4
+
+    store.delete(db_name, "id in [3]")
+    assert 3 not in [id for id, _ in reader.search(db_name, [vector(1, 1)], 10)[0]]
+
+    # 절반 넘게 지우면 남은 행만 새 파일로 다시 쓴다
+    store.delete(db_name, "id in [1]")
+    assert [row["word"] for row in reader.query(db_name, "size >= 0")] == ["c"]
+
+    store.insert(db_name, [{"id": 4, "vector": vector(1, 0), "word": "e"}])
+    assert [id for id, _ in reader.search(db_name, [vector(1, 0)], 10)[0]] == [4, 2]
+
+    assert store.drop_collection(db_name)
+    assert not reader.has_collection(db_name)
+
+
+def test_choose_index_and_rebuild():
+    assert choose_index(100, "auto")["type"] == "flat"
+    assert choose_index(10**6, "auto")["type"] == "ivf"
+    # 지원하지 않는 인덱스(예전 설정의 hnsw 등)는 ivf로 대신한다
+    assert choose_index(10**6, "hnsw", ("flat", "ivf"))["type"] == "ivf"
+
+    current = choose_index(10000, "ivf")
+    assert not needs_rebuild(current, 11000, "ivf", growth=0.2)
+    assert needs_rebuild(current, 12000, "ivf", growth=0.2)
+    assert needs_rebuild(None, 12000, "ivf")
+    assert not needs_rebuild({"type": "ivf", "rows": None}, 10**6, "ivf")
+
+
+def test_ivf_index_recall_and_appended_rows(tmp_path):
+    db_name = str(tmp_path / "ivf.db")
+    store = NumpyVectorStore()
+    store.create_collection(db_name)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 384)).astype(np.float32)
+    store.insert(db_name, [{"id": i, "vector": v, "word": ""} for i, v in enumerate(vectors)])
+
+    store.build_index(db_name, choose_index(2000, "ivf"))
+    index = store.index_info(db_name)
+    assert index["type"] == "ivf" and index["rows"] == 2000
+
+    queries = (vectors[:50] + 0.3 * rng.standard_normal((50, 384))).tolist()
+    exact = store.search(db_name, queries, 10, search_params={"exact": True})
+    approx = store.search(db_name, queries, 10, search_params={"nprobe": index["nlist"]})
+    assert [[id for id, _ in hits] for hits in approx] == [[id for id, _ in hits] for hits in exact]
+    assert [hits[0][0] for hits in store.search(db_name, queries, 1)] == list(range(50))
+
+    # 인덱스를 만든 뒤 덧붙인 행도 검색되고, 다른 인스턴스도 같은 인덱스를 쓴다
+    store.insert(db_name, [{"id": 9999, "vector": vectors[0] * -1, "word": ""}])
+    reader = NumpyVectorStore()
+    assert reader.index_info(db_name) == index
+    assert reader.search(db_name, [(-vectors[0]).tolist()], 1, search_params={"nprobe": 1})[0][0][0] == 9999
+
+    # 정리(compaction)로 행 번호가 바뀌면 인덱스는 쓰지 않는다
+    store.delete(db_name, "id >= 0 and id < 1500")
+    assert store.index_info(db_name) is None
+    assert store.search(db_name, [vectors[1600].tolist()], 1)[0][0][0] == 1600
+
+
+class FakeMilvusClient:
+    def __init__(self, db_name):
+        self.calls = []
+        self.loaded = True
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            if name == "release_collection":
+                self.loaded = False
+            elif name == "load_collection":
+                self.loaded = True
+            elif name == "search":
+                # 인덱스를 바꾸는 중(컬렉션을 내린 상태)에는 검색이 실패한다
+                assert self.loaded, "collection not loaded"
+                return [[]]
+            return None
+
+        return call
+
+    def prepare_index_params(self):
+        return FakeMilvusClient(None)
+
+
+def test_milvus_index_switch_waits_for_idle_collection(monkeypatch):
+    monkeypatch.setattr(vector_store_module, "MilvusClient", FakeMilvusClient)
+    store = vector_store_module.MilvusVectorStore(encoding="float32")
+    monkeypatch.setattr(store, "index_info", lambda db_name: None)
+    config = choose_index(100000, "ivf")
+
+    # 다른 스레드가 db를 쓰고 있으면 바꾸지 않는다
+    with store.pool.connect("a.db"):
+        assert store.build_index("a.db", config) is False
+
+    # 바꾸는 동안 들어온 검색은 실패하지 않고 끝날 때까지 기다린다
+    results = []
+    with store.pool.exclusive("a.db") as acquired:
+        assert acquired
+        searcher = threading.Thread(
+            target=lambda: results.append(store.search("a.db", [vector(1)], 5))
+        )
+        searcher.start()
+        searcher.join(0.2)
+        assert searcher.is_alive() and not results
+    searcher.join()
+    assert results == [[[]]]
+
+    assert store.build_index("a.db", config) is True
+    with store.pool.connect("a.db") as client:
+        assert client.loaded and "create_index" in client.calls
+
+
+def test_incomplete_backend_fails_at_construction():
+    class PartialStore(vector_store_module.VectorStore):
+        def has_collection(self, db_name):
+            return False
+
+    with pytest.raises(TypeError):
+        PartialStore()
+    assert isinstance(NumpyVectorStore(), vector_store_module.VectorStore)
+
+
+def test_milvus_modify_then_search(tmp_path):
+    pytest.importorskip("milvus_lite")
+    db_name = str(tmp_path / "dir.db")
+    store = vector_store_module.MilvusVectorStore(encoding="float32")
+    try:
+        store.create_collection(db_name)
+        # 파일 id는 청크마다 같으므로 기본 키가 아닌 일반 필드여야 한다
+        store.insert(db_name, [{"id": 1, "vector": vector(1, i), "word": "old"} for i in range(3)])
+        store.insert(db_name, [{"id": 2, "vector": vector(0, 1), "word": "other"}])
+        assert len(store.query(db_name, "id in [1]")) == 3
+
+        # 파일 수정: 기존 청크를 모두 지우고 새 청크를 넣는다
+        store.delete(db_name, "id in [1]")
+        store.insert(
+            db_name, [{"id": 1, "vector": vector(-1, i), "word": f"new{i}"} for i in range(2)]
+        )
+
+        rows = store.query(db_name, "id in [1]")
+        assert sorted(row["word"] for row in rows) == ["new0", "new1"]
+        hits = store.search(db_name, [vector(-1, 0)], 10)[0]
+        assert sorted(id for id, _ in hits) == [1, 1, 2]
+    finally:
+        store.pool.close_all()